@@ -2,4 +2,4 @@
 
 export PYTHONPATH=$PYTHONPATH:./src/
 
-exec python -m uvicorn amiami_api.web:app --host 0.0.0.0 --port 8000
+exec python -m uvicorn amiami_api.web:create_app --factory --timeout-graceful-shutdown 10 --host 0.0.0.0 --port 8000
@@ -0,0 +1,175 @@
+import asyncio
+import heapq
+from dataclasses import dataclass, replace
+from datetime import date
+from typing import AsyncIterator, TypeVar
+
+from amiami_api.analytics import AnalyticsService, Stats, merge_stats
+from amiami_api.api import Item, OrderInfo, OrderType
+from amiami_api.service import AmiamiService
+from amiami_api.store import OrdersQuery, order_sort_key
+from amiami_api.sync import SyncJob, SyncScheduler
+
+RowType = TypeVar("RowType")
+
+
+class AccountOrderInfo(OrderInfo):
+    """Order as it is served, with the account it belongs to."""
+
+    account: str
+
+
+@dataclass
+class Account:
+    name: str
+    service: AmiamiService
+    sync_scheduler: SyncScheduler
+    analytics_service: AnalyticsService
+
+    def tag(self, order: OrderInfo) -> AccountOrderInfo:
+        # the fields are already validated, they are reused as they are
+        return AccountOrderInfo.model_construct(**vars(order), account=self.name)
+
+    async def iter_orders(self, query: OrdersQuery) -> AsyncIterator[AccountOrderInfo]:
+        async for order in self.service.iter_orders(query):
+            yield self.tag(order)
+
+
+async def merge_orders(streams: list[AsyncIterator[AccountOrderInfo]]) -> AsyncIterator[AccountOrderInfo]:
+    """Merge order streams that are each sorted by release and id."""
+    # the first rows are requested from all the stores at once, they are read on their own threads
+    first_orders = await asyncio.gather(*(anext(stream, None) for stream in streams))
+    heap = [(order_sort_key(order), index, order) for index, order in enumerate(first_orders) if order is not None]
+    heapq.heapify(heap)
+    while heap:
+        _, index, order = heap[0]
+        yield order
+        next_order = await anext(streams[index], None)
+        if next_order is None:
+            heapq.heappop(heap)
+        else:
+            heapq.heapreplace(heap, (order_sort_key(next_order), index, next_order))
+
+
+async def paginate(rows: AsyncIterator[RowType], query: OrdersQuery) -> AsyncIterator[RowType]:
+    if query.limit == 0:
+        return
+    index = 0
+    async for row in rows:
+        if index >= query.offset:
+            yield row
+        index += 1
+        if query.limit is not None and index >= query.offset + query.limit:
+            return
+
+
+@dataclass
+class Accounts:
+    """AmiAmi accounts served by the process, reads of several accounts are aggregated."""
+
+    accounts: dict[str, Account]
+
+    @property
+    def names(self) -> tuple[str, ...]:
+        return tuple(self.accounts)
+
+    @property
+    def version(self) -> tuple[int, ...]:
+        return tuple(account.service.version for account in self.accounts.values())
+
+    def select(self, name: str | None) -> "Accounts | None":
+        """All the accounts when no name is given, None for an unknown account."""
+        if name is None:
+            return self
+        account = self.accounts.get(name)
+        return None if account is None else Accounts({name: account})
+
+    def _single(self) -> Account | None:
+        return next(iter(self.accounts.values())) if len(self.accounts) == 1 else None
+
+    async def wait_until_loaded(self) -> None:
+        await asyncio.gather(*(account.service.store.wait_until_loaded() for account in self.accounts.values()))
+
+    async def get_order(self, order_id: str) -> AccountOrderInfo | None:
+        for account in self.accounts.values():
+            order = await account.service.get_order(order_id)
+            if order is not None:
+                return account.tag(order)
+        return None
+
+    async def get_current_orders(self, include_finished: bool = True) -> list[AccountOrderInfo]:
+        accounts = list(self.accounts.values())
+        orders = await asyncio.gather(*(account.service.get_current_orders(include_finished) for account in accounts))
+        return [account.tag(order) for account, account_orders in zip(accounts, orders) for order in account_orders]
+
+    async def query_orders(self, query: OrdersQuery) -> list[AccountOrderInfo]:
+        account = self._single()
+        if account is not None:
+            return [account.tag(order) for order in await account.service.query_orders(query)]
+        return [order async for order in self.iter_orders(query)]
+
+    async def query_items(self, query: OrdersQuery) -> list[Item]:
+        account = self._single()
+        if account is not None:
+            return await account.service.query_items(query)
+        return [item async for item in self.iter_items(query)]
+
+    def iter_orders(self, query: OrdersQuery) -> AsyncIterator[AccountOrderInfo]:
+        account = self._single()
+        if account is not None:
+            return account.iter_orders(query)
+        # every account contributes at most offset + limit rows to the page
+        account_query = replace(query, offset=0, limit=None if query.limit is None else query.offset + query.limit)
+        return paginate(merge_orders([account.iter_orders(account_query) for account in self.accounts.values()]), query)
+
+    def iter_items(self, query: OrdersQuery) -> AsyncIterator[Item]:
+        account = self._single()
+        if account is not None:
+            return account.service.iter_items(query)
+        return paginate(self._iter_merged_items(query), query)
+
+    async def _iter_merged_items(self, query: OrdersQuery) -> AsyncIterator[Item]:
+        # items keep the order of their orders, as in a single store
+        async for order in self.iter_orders(replace(query, limit=None, offset=0)):
+            for item in order.items:
+                if query.matches_item(item):
+                    yield item
+
+    async def get_stats(self, start: date | None = None, end: date | None = None) -> Stats:
+        account = self._single()
+        if account is not None:
+            return await account.analytics_service.get_stats(start, end)
+        analytics_services = [account.analytics_service for account in self.accounts.values()]
+        if start is None or end is None:
+            # the accounts are summed over the same months, so an open range is resolved across all of them first
+            ranges = await asyncio.gather(*(analytics_service.get_stats(start, end) for analytics_service in analytics_services))
+            starts = [stats.start for stats in ranges if stats.start is not None]
+            ends = [stats.end for stats in ranges if stats.end is not None]
+            if not starts or not ends:
+                return Stats(start=start, end=end)
+            start, end = start or min(starts), end or max(ends)
+        return merge_stats(start, end, await asyncio.gather(*(analytics_service.get_stats(start, end) for analytics_service in analytics_services)))
+
+    def get_job(self, job_id: str) -> SyncJob | None:
+        for account in self.accounts.values():
+            job = account.sync_scheduler.get_job(job_id)
+            if job is not None:
+                return job
+        return None
+
+    def trigger(self, order_type: OrderType, force: bool = False) -> list[SyncJob]:
+        return [account.sync_scheduler.trigger(order_type, force) for account in self.accounts.values()]
+
+    async def run(self, order_type: OrderType, force: bool = False) -> list[SyncJob]:
+        # accounts sync concurrently, the shared global rate limiter keeps the total request rate bounded
+        return list(await asyncio.gather(*(account.sync_scheduler.run(order_type, force) for account in self.accounts.values())))
+
+    def start(self) -> None:
+        for index, account in enumerate(self.accounts.values()):
+            account.service.store.start_loading()
+            # periodic syncs of the accounts are spread over their intervals instead of all starting at once
+            account.sync_scheduler.start(phase=index / len(self.accounts))
+
+    async def stop(self) -> None:
+        await asyncio.gather(*(account.sync_scheduler.stop() for account in self.accounts.values()))
+        await asyncio.gather(*(account.service.store.close() for account in self.accounts.values()))
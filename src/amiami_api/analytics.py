@@ -0,0 +1,97 @@
+import re
+from dataclasses import dataclass, field
+from datetime import date
+
+from pydantic import BaseModel, Field
+
+from amiami_api import utils
+from amiami_api.api import Item
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.store import AmiAmiOrdersStore
+
+FIGURE_SCALE_PATTERN = re.compile(r"1/\d{1,2}")
+
+
+def get_figure_type(item: Item) -> str:
+    scale_match = FIGURE_SCALE_PATTERN.search(item.name)
+    if scale_match:
+        return f"{scale_match[0]} scale"
+    if "Nendoroid" in item.name:
+        return "nendoroid"
+    if "GOODS" in item.scode:
+        return "goods"
+    return "other"
+
+
+class TypeStats(BaseModel):
+    count: int = 0
+    cost: int = 0
+
+
+class Stats(BaseModel):
+    start: date | None
+    end: date | None
+    by_type: dict[str, TypeStats] = Field(default_factory=dict)
+    total: TypeStats = Field(default_factory=TypeStats)
+    cost_per_month: dict[str, int] = Field(default_factory=dict)
+
+
+def merge_stats(start: date | None, end: date | None, stats_list: list[Stats]) -> Stats:
+    merged = Stats(start=start, end=end)
+    for stats in stats_list:
+        for figure_type, type_stats in stats.by_type.items():
+            merged_type_stats = merged.by_type.setdefault(figure_type, TypeStats())
+            merged_type_stats.count += type_stats.count
+            merged_type_stats.cost += type_stats.cost
+        merged.total.count += stats.total.count
+        merged.total.cost += stats.total.cost
+        for month, cost in stats.cost_per_month.items():
+            merged.cost_per_month[month] = merged.cost_per_month.get(month, 0) + cost
+    merged.by_type = dict(sorted(merged.by_type.items()))
+    merged.cost_per_month = dict(sorted(merged.cost_per_month.items()))
+    return merged
+
+
+@dataclass
+class AnalyticsService:
+    store: AsyncAmiAmiOrdersStore
+    max_cached_stats: int = 32
+    _cache_version: int | None = field(default=None, init=False)
+    _cache: dict[tuple[date | None, date | None], Stats] = field(default_factory=dict, init=False)
+
+    @staticmethod
+    def _compute_stats(store: AmiAmiOrdersStore, start: date | None, end: date | None) -> Stats:
+        if start is None or end is None:
+            release_dates = [order.scheduled_release for order in store.get_orders()]
+            if not release_dates:
+                return Stats(start=start, end=end)
+            start = start or min(release_dates)
+            end = end or max(release_dates)
+
+        months = utils.months_between(start, end)
+        stats = Stats(start=start, end=end, cost_per_month={month.strftime("%Y-%m"): 0 for month in months})
+        # both ends of the range include their whole month
+        for order in store.get_orders_by_release_months(months):
+            stats.cost_per_month[order.scheduled_release.strftime("%Y-%m")] += order.price
+            for item in order.items:
+                type_stats = stats.by_type.setdefault(get_figure_type(item), TypeStats())
+                type_stats.count += 1
+                type_stats.cost += item.price
+                stats.total.count += 1
+                stats.total.cost += item.price
+        stats.by_type = dict(sorted(stats.by_type.items()))
+        return stats
+
+    async def get_stats(self, start: date | None = None, end: date | None = None) -> Stats:
+        await self.store.wait_until_loaded()
+        if self._cache_version != self.store.version:
+            self._cache.clear()
+            self._cache_version = self.store.version
+        stats = self._cache.get((start, end))
+        if stats is None:
+            # computed on the store thread, the orders are not copied out of it
+            stats = await self.store.run(lambda store: self._compute_stats(store, start, end))
+            if len(self._cache) >= self.max_cached_stats:
+                del self._cache[next(iter(self._cache))]
+            self._cache[(start, end)] = stats
+        return stats
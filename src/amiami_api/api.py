@@ -1,39 +1,63 @@
+import asyncio
+import base64
+import json
+import math
+import os
+import random
+import time
 import urllib.parse
 from dataclasses import dataclass, field
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from enum import Enum
-from functools import wraps
+from functools import lru_cache, wraps
+from pathlib import Path
 from typing import Any, Callable, Literal, Self, TypeVar, cast
 
-import aiohttp
 from loguru import logger
 from pydantic import (
     AliasChoices,
     BaseModel,
     Field,
     TypeAdapter,
+    ValidationError,
     ValidationInfo,
     computed_field,
     field_validator,
     model_validator,
 )
 
-from amiami_api import utils
+from amiami_api import metrics, utils
+from amiami_api.http_client import HttpClient, HttpConnectionError
+from amiami_api.rate_limit import AdaptiveConcurrencyLimiter, TokenBucket
 
 AMIAMI_STORE_BASE_URL = "https://www.amiami.com/"
 AMIAMI_ACCOUNT_BASE_URL = "https://secure.amiami.com/"
 AMIAMI_API_BASE_URL = "https://api-secure.amiami.com/api/v1.0/"
+AMIAMI_ALL_ORDER_STATUS_IDS = "1,2,3,4,5,6,7,10,999"
+# RMessage values, compared whole, of the responses that mean the login token is missing or no longer valid
+AMIAMI_AUTH_ERROR_MESSAGES = frozenset({"please login", "login required", "unauthorized", "invalid token", "token expired", "session expired"})
+DEBUG_LOGGED_BODY_BYTES = 2000
 
 
-def amiami_month_date_validate(value: str | datetime | date) -> date:
-    if isinstance(value, datetime):
-        return value.date()
-    if isinstance(value, date):
-        return value
+class AmiAmiApiError(Exception):
+    pass
+
+
+class AmiAmiAuthError(AmiAmiApiError):
+    pass
+
+
+class AmiAmiRetryableError(AmiAmiApiError):
+    def __init__(self, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@lru_cache(maxsize=1024)
+def _parse_amiami_month_date(value: str, today: date) -> date:
     if value == "This Month":
-        return date.today().replace(day=1)
+        return today.replace(day=1)
     if value == "Before Last Month":
-        today = date.today()
         before_last_month_month = (((today.month - 1) - 2) % 12) + 1
         before_last_month_year = today.year
         if before_last_month_month > today.month:
@@ -41,11 +65,20 @@ def amiami_month_date_validate(value: str | datetime | date) -> date:
         return today.replace(day=1, month=before_last_month_month, year=before_last_month_year)
     last_token = value.split(" ")[-1]
     if last_token.find("/") != -1:
-        return datetime.strptime(last_token, "%Y/%m")
+        return datetime.strptime(last_token, "%Y/%m").date()
     elif last_token.find("-") != -1 and len(last_token) == 10:
-        return datetime.strptime(last_token, "%Y-%m-%d")
+        return datetime.strptime(last_token, "%Y-%m-%d").date()
     else:
-        return datetime.strptime(last_token, "%b-%Y")
+        return datetime.strptime(last_token, "%b-%Y").date()
+
+
+def amiami_month_date_validate(value: str | datetime | date) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    # relative values depend on the current date, so it is a part of the cache key
+    return _parse_amiami_month_date(value, date.today())
 
 
 class OrderCommon(BaseModel):
@@ -132,12 +165,40 @@ class ApiOrderInfoResponse(BaseApiResponse):
     order: OrderInfo
 
 
+class ApiErrorResponse(BaseModel):
+    RSuccess: bool
+    RMessage: str | None = None
+
+
+class ApiLoginResponse(ApiErrorResponse):
+    login: dict | None = None
+
+
+ResponseType = TypeVar("ResponseType")
+
+api_orders_response_adapter = TypeAdapter(ApiOrdersResponse)
+api_order_info_response_adapter = TypeAdapter(ApiOrderInfoResponse)
+api_error_response_adapter = TypeAdapter(ApiErrorResponse)
+api_login_response_adapter = TypeAdapter(ApiLoginResponse)
+
+
 class OrderType(str, Enum):
     all = "all"
     open = "open"
     shipped = "shipped"
     current_month = "current_month"
 
+    def matches(self, order: OrderCommon) -> bool:
+        match self:
+            case OrderType.all:
+                return True
+            case OrderType.open:
+                return bool(order.is_open)
+            case OrderType.shipped:
+                return not order.is_open  # type: ignore[truthy-function]
+            case OrderType.current_month:
+                return bool(order.is_open) and order.scheduled_release < utils.first_day_of_next_month()
+
 
 MethodType = TypeVar("MethodType", bound=Callable)
 
@@ -145,13 +206,13 @@ MethodType = TypeVar("MethodType", bound=Callable)
 def ensure_login_decorator(func: MethodType) -> MethodType:
     @wraps(func)
     async def wrapper(self: "AmiAmiApi", *args, **kwargs):
-        if self._login_data is None:
-            await self._login()
+        await self._ensure_login()
+        login_generation = self._login_generation
         try:
             return await func(self, *args, **kwargs)
-        except Exception:
-            logger.warning("Request failed, try re-login")
-            await self._login()
+        except AmiAmiAuthError:
+            logger.warning("Request is not authorized, try re-login")
+            await self._relogin(login_generation)
             return await func(self, *args, **kwargs)
 
     return cast(MethodType, wrapper)
@@ -162,24 +223,169 @@ class AmiAmiApi:
     username: str
     password: str
     api_root_url: str = AMIAMI_API_BASE_URL
-    _session: aiohttp.ClientSession = field(init=False)
+    page_size: int = 20
+    page_fetch_parallelism: int = 4
+    requests_per_second: float = 2
+    max_concurrency: int = 6
+    request_timeout_seconds: float = 30
+    max_retries: int = 3
+    retry_backoff_seconds: float = 1
+    max_retry_backoff_seconds: float = 30
+    http_client: HttpClient = field(default_factory=HttpClient)
+    # shared by the apis of all accounts, so that they stay within one request budget together
+    global_rate_limiter: TokenBucket | None = None
+    _headers: dict[str, str] = field(default_factory=lambda: {"X-User-Key": "amiami_dev"}, init=False)
+    token_file_path: Path | None = None
+    token_ttl: timedelta = field(default_factory=lambda: timedelta(days=7))
     _login_data: dict | None = field(default=None, init=False)
+    _token_expires_at: datetime | None = field(default=None, init=False)
+    _login_generation: int = field(default=0, init=False)
+    _login_lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False)
+    _rate_limiter: TokenBucket = field(init=False)
+    _concurrency_limiter: AdaptiveConcurrencyLimiter = field(init=False)
 
     def __post_init__(self):
-        self._session = aiohttp.ClientSession(
-            headers={
-                "X-User-Key": "amiami_dev",
-            },
+        self._rate_limiter = TokenBucket(rate=self.requests_per_second, capacity=max(1, self.requests_per_second))
+        self._concurrency_limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=min(3, self.max_concurrency),
+            max_limit=self.max_concurrency,
         )
 
     @staticmethod
-    def _get_status_ids_from_order_type(order_type: OrderType) -> str:
-        return {
-            OrderType.all: "1,2,3,4,5,6,7,10,999",
-            OrderType.open: "1,2,5,6,7,10,999",
-            OrderType.shipped: "3,4",
-            OrderType.current_month: "1,2,5,6,7,10,999",  # same as open
-        }[order_type]
+    def _is_auth_error_message(message: Any) -> bool:
+        return isinstance(message, str) and message.strip().rstrip(".!").lower() in AMIAMI_AUTH_ERROR_MESSAGES
+
+    def _validate_response(self, path: str, body: bytes, response_adapter: TypeAdapter[ResponseType]) -> ResponseType:
+        try:
+            return response_adapter.validate_json(body)
+        except ValidationError:
+            error_response = api_error_response_adapter.validate_json(body)
+            if not error_response.RSuccess and self._is_auth_error_message(error_response.RMessage):
+                metrics.amiami_request_errors.inc(endpoint=path, kind="auth")
+                raise AmiAmiAuthError(f"{path}: {error_response.RMessage}")
+            metrics.amiami_request_errors.inc(endpoint=path, kind="invalid_response")
+            raise
+
+    async def _send_request(self, method: str, path: str, response_adapter: TypeAdapter[ResponseType], **kwargs: Any) -> ResponseType:
+        await self._rate_limiter.acquire()
+        if self.global_rate_limiter is not None:
+            await self.global_rate_limiter.acquire()
+        async with self._concurrency_limiter.slot():
+            started_at = time.perf_counter()
+            try:
+                async with self.http_client.request(
+                    method,
+                    urllib.parse.urljoin(self.api_root_url, path),
+                    self.request_timeout_seconds,
+                    headers=self._headers,
+                    **kwargs,
+                ) as response:
+                    if response.status == 401:
+                        metrics.amiami_request_errors.inc(endpoint=path, kind="auth")
+                        raise AmiAmiAuthError(f"{path}: unauthorized")
+                    if response.status == 429 or response.status >= 500:
+                        metrics.amiami_request_errors.inc(endpoint=path, kind=f"http_{response.status}")
+                        self._concurrency_limiter.on_overload()
+                        retry_after = response.headers.get("Retry-After")
+                        raise AmiAmiRetryableError(
+                            f"{path}: HTTP {response.status}",
+                            retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+                        )
+                    body = await response.read()
+            except (asyncio.TimeoutError, HttpConnectionError) as exception:
+                metrics.amiami_request_errors.inc(endpoint=path, kind="timeout" if isinstance(exception, asyncio.TimeoutError) else "connection")
+                self._concurrency_limiter.on_overload()
+                raise AmiAmiRetryableError(f"{path}: {exception!r}") from exception
+            finally:
+                metrics.amiami_request_duration.observe(time.perf_counter() - started_at, endpoint=path)
+        self._concurrency_limiter.on_success()
+        # the login response carries the token and is never logged, other bodies are decoded only when debug logging is enabled
+        if path != "login":
+            logger.opt(lazy=True).debug("{}: {}", lambda: path, lambda: body[:DEBUG_LOGGED_BODY_BYTES].decode(errors="replace"))
+        return self._validate_response(path, body, response_adapter)
+
+    async def _request(self, method: str, path: str, response_adapter: TypeAdapter[ResponseType], **kwargs: Any) -> ResponseType:
+        # only GET requests are idempotent and safe to repeat
+        retries = self.max_retries if method == "GET" else 0
+        for attempt in range(retries + 1):
+            try:
+                return await self._send_request(method, path, response_adapter, **kwargs)
+            except AmiAmiRetryableError as exception:
+                if attempt == retries:
+                    raise
+                backoff = exception.retry_after
+                if backoff is None:
+                    backoff = random.uniform(0, min(self.max_retry_backoff_seconds, self.retry_backoff_seconds * 2**attempt))
+                logger.warning(f"Request failed: {exception}, retry in {backoff:.1f}s")
+                metrics.amiami_request_retries.inc(endpoint=path)
+                await asyncio.sleep(backoff)
+        raise AssertionError("unreachable")
+
+    def _get_token_expiry(self, token: str) -> datetime:
+        # the token is usually a JWT, prefer its own expiry over the configured ttl
+        try:
+            payload = token.split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+            return datetime.fromtimestamp(claims["exp"])
+        except Exception:
+            return datetime.now() + self.token_ttl
+
+    def _set_login_data(self, login_data: dict, expires_at: datetime) -> None:
+        self._login_data = login_data
+        self._token_expires_at = expires_at
+        self._login_generation += 1
+        self._headers["X-Authorization"] = f"bearer {login_data['login']['token']}"
+
+    def _load_token(self) -> bool:
+        if self.token_file_path is None:
+            return False
+        try:
+            with open(self.token_file_path, "rb") as file:
+                token_data = json.loads(file.read())
+            expires_at = datetime.fromisoformat(token_data["expires_at"])
+            if token_data["username"] != self.username or expires_at <= datetime.now():
+                return False
+            self._set_login_data({"login": {"token": token_data["token"]}}, expires_at)
+            logger.info("Reusing persisted login token")
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as exception:
+            logger.opt(exception=exception).warning("Failed to load persisted login token")
+            return False
+
+    def _save_token(self) -> None:
+        if self.token_file_path is None or self._login_data is None or self._token_expires_at is None:
+            return
+        token_data = {
+            "username": self.username,
+            "token": self._login_data["login"]["token"],
+            "expires_at": self._token_expires_at.isoformat(),
+        }
+        try:
+            file_descriptor = os.open(self.token_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(file_descriptor, "w") as file:
+                json.dump(token_data, file)
+        except Exception as exception:
+            logger.opt(exception=exception).warning("Failed to persist login token")
+
+    async def _ensure_login(self) -> None:
+        if self._login_data is not None and self._token_expires_at is not None and self._token_expires_at > datetime.now():
+            return
+        async with self._login_lock:
+            if self._login_data is not None and self._token_expires_at is not None and self._token_expires_at > datetime.now():
+                return
+            if self._login_data is None and self._load_token():
+                return
+            await self._login()
+
+    async def _relogin(self, failed_login_generation: int) -> None:
+        # concurrent auth failures share a single login, later ones just pick up the new token
+        async with self._login_lock:
+            if self._login_generation != failed_login_generation:
+                return
+            metrics.amiami_relogins.inc()
+            await self._login()
 
     async def _login(self) -> bool:
         login_request_data = {
@@ -189,65 +395,72 @@ class AmiAmiApi:
             "c_ransu": None,
         }
 
-        response = await self._session.post(
-            url=urllib.parse.urljoin(self.api_root_url, "login"),
-            data=login_request_data,
-        )
         try:
-            json_response = await response.json()
-            assert isinstance(json_response, dict)
-            if json_response.get("RSuccess", False):
-                self._login_data = await response.json()
+            login_response = await self._request("POST", "login", api_login_response_adapter, data=login_request_data)
+            if login_response.RSuccess and login_response.login is not None:
                 logger.info("Login successfull")
-                assert self._login_data is not None
-                self._session.headers.update(
-                    {
-                        "X-Authorization": f"bearer {self._login_data['login']['token']}",
-                    }
-                )
+                login_data = {"login": login_response.login}
+                self._set_login_data(login_data, self._get_token_expiry(login_response.login["token"]))
+                self._save_token()
                 return True
 
-            error_message = (await response.json())["RMessage"]
-        except Exception:
-            error_message = response.status
+            error_message = login_response.RMessage
+        except Exception as exception:
+            error_message = repr(exception)
         logger.error(f"Login failed: {error_message}")
         return False
 
+    async def _get_orders_page(self, page: int) -> ApiOrdersResponse:
+        return await self._request(
+            "GET",
+            "orders",
+            api_orders_response_adapter,
+            params={
+                "status_ids": AMIAMI_ALL_ORDER_STATUS_IDS,
+                "search_key": "id",
+                "pagemax": self.page_size,
+                "lang": "eng",
+                "pagecnt": page,
+            },
+        )
+
     @ensure_login_decorator
     async def get_orders(self, order_type: OrderType = OrderType.all) -> list[Order]:
-        orders: list[Order] = []
-        params: dict[str, str | int] = {
-            "status_ids": self._get_status_ids_from_order_type(order_type),
-            "search_key": "id",
-            "pagemax": 20,
-            "lang": "eng",
-            "pagecnt": 1,
-        }
-        while True:
-            response = await self._session.get(
-                url=urllib.parse.urljoin(self.api_root_url, "orders"),
-                params=params,
-            )
-            api_orders_response = TypeAdapter(ApiOrdersResponse).validate_python(await response.json())
-            orders += api_orders_response.orders
-            if len(orders) == api_orders_response.search_result.total_results:
-                break
-            assert isinstance(params["pagecnt"], int)
-            params["pagecnt"] += 1
-        if order_type == OrderType.current_month:
-            first_day_of_next_month = utils.first_day_of_next_month()
-            orders = [order for order in orders if order.scheduled_release < first_day_of_next_month]
-        return orders
+        # all order types are filtered locally from the full listing, so one listing can serve every view
+        first_page = await self._get_orders_page(1)
+        pages = [first_page.orders]
+        total_results = first_page.search_result.total_results
+        # the server may cap pagemax below the requested size, page numbers then follow the size it actually serves
+        page_size = len(first_page.orders) if 0 < len(first_page.orders) < min(self.page_size, total_results) else self.page_size
+        pages_count = math.ceil(total_results / page_size)
+
+        if first_page.orders and pages_count > 1:
+            semaphore = asyncio.Semaphore(self.page_fetch_parallelism)
+
+            async def fetch_page(page: int) -> list[Order]:
+                async with semaphore:
+                    return (await self._get_orders_page(page)).orders
+
+            pages += await asyncio.gather(*[fetch_page(page) for page in range(2, pages_count + 1)])
+
+        # orders may be added while paginating, keep going until an incomplete page
+        next_page = len(pages) + 1
+        while len(pages[-1]) == page_size:
+            pages.append((await self._get_orders_page(next_page)).orders)
+            next_page += 1
+
+        orders = {order.id: order for page_orders in pages for order in page_orders}.values()
+        return [order for order in orders if order_type.matches(order)]
 
     @ensure_login_decorator
     async def get_order_info(self, order_number: str) -> OrderInfo:
-        response = await self._session.get(
-            url=urllib.parse.urljoin(self.api_root_url, "orders/detail"),
+        api_order_info = await self._request(
+            "GET",
+            "orders/detail",
+            api_order_info_response_adapter,
             params={
                 "d_no": order_number,
                 "lang": "eng",
             },
         )
-        logger.debug(await response.json())
-        api_order_info = TypeAdapter(ApiOrderInfoResponse).validate_python(await response.json())
         return api_order_info.order
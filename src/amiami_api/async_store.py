@@ -0,0 +1,144 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from functools import partial
+from itertools import islice
+from typing import Any, AsyncIterator, Callable, Generator, Iterable, Iterator, TypeVar
+
+from amiami_api.api import Item, OrderInfo, OrderType
+from amiami_api.store import AmiAmiOrdersStore, OrdersQuery
+
+ResultType = TypeVar("ResultType")
+RowType = TypeVar("RowType")
+
+
+def _update_and_clean_up(store: AmiAmiOrdersStore, orders: list[OrderInfo], existing_order_ids: list[str], fetched_at: datetime | None) -> list[str]:
+    with store.batch():
+        store.bulk_update(orders, fetched_at)
+        return store.clean_up_not_existing_orders(existing_order_ids)
+
+
+@dataclass
+class AsyncAmiAmiOrdersStore:
+    """Runs every store call on one dedicated thread and persists changes from another one, debounced."""
+
+    store: AmiAmiOrdersStore
+    flush_delay_seconds: float = 1
+    stream_batch_size: int = 200
+    _executor: ThreadPoolExecutor = field(default_factory=lambda: ThreadPoolExecutor(1, thread_name_prefix="store"), init=False)
+    _writer_executor: ThreadPoolExecutor = field(
+        default_factory=lambda: ThreadPoolExecutor(1, thread_name_prefix="store-writer"),
+        init=False,
+    )
+    _load_task: asyncio.Task | None = field(default=None, init=False)
+    _flush_task: asyncio.Task | None = field(default=None, init=False)
+    _flush_requested: bool = field(default=False, init=False)
+    _flush_lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False)
+
+    @property
+    def version(self) -> int:
+        return self.store.version
+
+    async def _call(self, function: Callable[..., ResultType], *args: Any) -> ResultType:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(function, *args))
+
+    async def run(self, function: Callable[[AmiAmiOrdersStore], ResultType]) -> ResultType:
+        """Run a function with the wrapped store on the store thread."""
+        return await self._call(function, self.store)
+
+    def start_loading(self) -> None:
+        if self._load_task is None:
+            self._load_task = asyncio.create_task(self._call(self.store.load))
+
+    async def wait_until_loaded(self) -> None:
+        self.start_loading()
+        assert self._load_task is not None
+        await asyncio.shield(self._load_task)
+
+    async def get_order(self, order_id: str) -> OrderInfo | None:
+        return await self._call(self.store.get_order, order_id)
+
+    async def get_orders(self, order_type: OrderType = OrderType.all) -> list[OrderInfo]:
+        return await self._call(self.store.get_orders, order_type)
+
+    async def count_orders(self) -> int:
+        return await self._call(self.store.count_orders)
+
+    async def get_orders_by_ids(self, order_ids: Iterable[str]) -> dict[str, OrderInfo]:
+        return await self._call(self.store.get_orders_by_ids, list(order_ids))
+
+    async def get_fetched_at(self, order_ids: Iterable[str]) -> dict[str, datetime]:
+        return await self._call(self.store.get_fetched_at, list(order_ids))
+
+    async def get_orders_by_release_months(self, months: Iterable[date]) -> list[OrderInfo]:
+        return await self._call(self.store.get_orders_by_release_months, list(months))
+
+    async def query_orders(self, query: OrdersQuery) -> list[OrderInfo]:
+        return await self._call(self.store.query_orders, query)
+
+    async def query_items(self, query: OrdersQuery) -> list[Item]:
+        return await self._call(self.store.query_items, query)
+
+    async def _iterate(self, make_iterator: Callable[[], Iterator[RowType]]) -> AsyncIterator[RowType]:
+        # the store iterator is advanced on the store thread only, a batch at a time
+        iterator = await self._call(make_iterator)
+        try:
+            while rows := await self._call(lambda: list(islice(iterator, self.stream_batch_size))):
+                for row in rows:
+                    yield row
+        finally:
+            # an abandoned stream releases what its iterator holds, like the read snapshot of the sqlite store
+            if isinstance(iterator, Generator):
+                await self._call(iterator.close)
+
+    def iter_orders(self, query: OrdersQuery) -> AsyncIterator[OrderInfo]:
+        return self._iterate(lambda: self.store.iter_orders(query))
+
+    def iter_items(self, query: OrdersQuery) -> AsyncIterator[Item]:
+        return self._iterate(lambda: self.store.iter_items(query))
+
+    async def bulk_update(self, orders: list[OrderInfo], fetched_at: datetime | None = None) -> None:
+        await self._call(self.store.bulk_update, orders, fetched_at)
+        self._schedule_flush()
+
+    async def bulk_delete(self, order_ids: list[str]) -> None:
+        await self._call(self.store.bulk_delete, order_ids)
+        self._schedule_flush()
+
+    async def update_and_clean_up(self, orders: list[OrderInfo], existing_order_ids: list[str], fetched_at: datetime | None = None) -> list[str]:
+        """Store updated orders and delete the ones that no longer exist, persisted as a single batch."""
+        deleted = await self._call(_update_and_clean_up, self.store, orders, existing_order_ids, fetched_at)
+        self._schedule_flush()
+        return deleted
+
+    def _schedule_flush(self) -> None:
+        self._flush_requested = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        # writes requested while waiting or flushing are coalesced into the next flush
+        while self._flush_requested:
+            self._flush_requested = False
+            await asyncio.sleep(self.flush_delay_seconds)
+            # a started flush is finished even when the task is cancelled, it has already taken the pending changes
+            if not await asyncio.shield(self.flush()):
+                # the store keeps the changes pending, the write is retried after the delay
+                self._flush_requested = True
+
+    async def flush(self) -> bool:
+        """Persist pending changes, returns False when the store failed to write them."""
+        async with self._flush_lock:
+            write = await self._call(self.store.take_pending_write)
+            if write is None:
+                return True
+            return await asyncio.get_running_loop().run_in_executor(self._writer_executor, write)
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.flush()
+        self._executor.shutdown()
+        self._writer_executor.shutdown()
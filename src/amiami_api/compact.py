@@ -0,0 +1,106 @@
+import sys
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Self
+
+from amiami_api.api import Item, OrderInfo
+
+
+def _split_interned(value: str, separator: str) -> tuple[str, str]:
+    # the shared part (scode category, image directory) is interned, only the unique tail is stored per row
+    head, separator, tail = value.rpartition(separator)
+    return sys.intern(head + separator), tail
+
+
+@dataclass(slots=True, frozen=True)
+class CompactItem:
+    id: str
+    scode_prefix: str
+    scode_suffix: str
+    name: str
+    thumb_directory: str
+    thumb_file_name: str | None  # None when the file name is "<scode>.jpg"
+    release_ordinal: int
+    price: int
+    amount: int
+    in_stock_flag: int
+
+    @property
+    def scode(self) -> str:
+        return self.scode_prefix + self.scode_suffix
+
+    @property
+    def release_date(self) -> date:
+        return date.fromordinal(self.release_ordinal)
+
+    @classmethod
+    def from_item(cls, item: Item) -> Self:
+        scode_prefix, scode_suffix = _split_interned(item.scode, "-")
+        thumb_directory, thumb_file_name = _split_interned(item.thumb_url, "/")
+        return cls(
+            id=item.id,
+            scode_prefix=scode_prefix,
+            scode_suffix=scode_suffix,
+            name=item.name,
+            thumb_directory=thumb_directory,
+            thumb_file_name=None if thumb_file_name == f"{item.scode}.jpg" else thumb_file_name,
+            release_ordinal=item.release_date.toordinal(),
+            price=item.price,
+            amount=item.amount,
+            in_stock_flag=item.in_stock_flag,
+        )
+
+    def to_item(self) -> Item:
+        scode = self.scode
+        thumb_file_name = f"{scode}.jpg" if self.thumb_file_name is None else self.thumb_file_name
+        # the data has been validated when it was stored
+        return Item.model_construct(
+            id=self.id,
+            scode=scode,
+            name=self.name,
+            thumb_url=self.thumb_directory + thumb_file_name,
+            release_date=self.release_date,
+            price=self.price,
+            amount=self.amount,
+            in_stock_flag=self.in_stock_flag,
+        )
+
+
+@dataclass(slots=True, frozen=True)
+class CompactOrder:
+    id: str
+    status: str
+    is_open: bool
+    release_ordinal: int
+    price: int
+    fetched_timestamp: float | None  # sync metadata kept by the store next to the order
+    items: tuple[CompactItem, ...]
+
+    @property
+    def scheduled_release(self) -> date:
+        return date.fromordinal(self.release_ordinal)
+
+    @property
+    def fetched_at(self) -> datetime | None:
+        return datetime.fromtimestamp(self.fetched_timestamp) if self.fetched_timestamp is not None else None
+
+    @classmethod
+    def from_order_info(cls, order: OrderInfo, fetched_at: datetime | None = None) -> Self:
+        return cls(
+            id=order.id,
+            status=sys.intern(order.status),
+            is_open=bool(order.is_open),
+            release_ordinal=order.scheduled_release.toordinal(),
+            price=order.price,
+            fetched_timestamp=fetched_at.timestamp() if fetched_at else None,
+            items=tuple(CompactItem.from_item(item) for item in order.items),
+        )
+
+    def to_order_info(self) -> OrderInfo:
+        return OrderInfo.model_construct(
+            id=self.id,
+            status=self.status,
+            scheduled_release=self.scheduled_release,
+            price=self.price,
+            items=[item.to_item() for item in self.items],
+        )
@@ -1,15 +1,95 @@
 from pathlib import Path
+from typing import Literal, Self
 
-from pydantic import Field
+from pydantic import AliasChoices, BaseModel, Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+DEFAULT_ACCOUNT_NAME = "default"
+
+
+class AccountConfig(BaseModel):
+    name: str = Field(pattern=r"^[A-Za-z0-9_-]+$")
+    username: str = Field(validation_alias=AliasChoices("login", "username"))
+    password: str
+    store_file_path: Path | None = None
+    store_sqlite_path: Path | None = None
+    api_token_file_path: Path | None = None
+
+
+def _account_path(path: Path, account_name: str) -> Path:
+    # orders.json -> orders.<account>.json
+    return path.with_name(f"{path.stem}.{account_name}{path.suffix}")
+
 
 class Config(BaseSettings):
     model_config = SettingsConfigDict(case_sensitive=False, env_file=".env", env_prefix="AMIAMI_", extra="ignore")
 
-    username: str = Field(alias="AMIAMI_LOGIN")
-    password: str = Field(alias="AMIAMI_PASSWORD")
+    username: str | None = Field(default=None, alias="AMIAMI_LOGIN")
+    password: str | None = Field(default=None, alias="AMIAMI_PASSWORD")
+    accounts: list[AccountConfig] = Field(default_factory=list)
+    store_backend: Literal["file", "sqlite"] = Field(default="file")
     store_file_path: Path = Field(default=Path("./orders.json"))
-    telegram_bot_token: str = Field(alias="TELEGRAM_BOT_TOKEN")
+    store_compact_json: bool = Field(default=False)
+    store_sqlite_path: Path = Field(default=Path("./orders.sqlite3"))
+    store_background_load: bool = Field(default=True)
+    store_flush_delay_seconds: float = Field(default=1)
+    telegram_bot_token: str | None = Field(default=None, alias="TELEGRAM_BOT_TOKEN")
     telegram_bot_white_list: list[str] = Field(default_factory=list, alias="TELEGRAM_BOT_WHITE_LIST")
-    fx_rates_access_key: str = Field(alias="FX_RATES_ACCESS_KEY")
\ No newline at end of file
+    fx_rates_access_key: str = Field(alias="FX_RATES_ACCESS_KEY")
+    fx_rates_ttl_hours: int = Field(default=24)
+    fx_rates_cache_file_path: Path | None = Field(default=None)
+    http_connections_limit: int = Field(default=100)
+    http_connections_limit_per_host: int = Field(default=10)
+    http_keepalive_timeout_seconds: float = Field(default=30)
+    http_dns_cache_ttl_seconds: int = Field(default=300)
+    http_compression: bool = Field(default=True)
+    api_page_size: int = Field(default=20)
+    api_requests_per_second: float = Field(default=2)
+    api_global_requests_per_second: float = Field(default=10)
+    api_max_concurrency: int = Field(default=6)
+    api_request_timeout_seconds: float = Field(default=30)
+    api_max_retries: int = Field(default=3)
+    api_token_file_path: Path | None = Field(default=None)
+    api_token_ttl_hours: int = Field(default=24 * 7)
+    sync_max_staleness_hours: int = Field(default=24)
+    sync_open_interval_minutes: int = Field(default=30)
+    sync_full_interval_hours: int = Field(default=24)
+    events_buffer_size: int = Field(default=1000)
+    history_file_path: Path | None = Field(default=None)
+    history_compaction_interval_hours: int = Field(default=24)
+    history_compact_after_days: int = Field(default=30)
+
+    @model_validator(mode="after")
+    def default_cache_file_paths(self) -> Self:
+        # keep the login token, fx rates and history next to the orders store
+        if self.api_token_file_path is None:
+            self.api_token_file_path = self.store_file_path.with_name("amiami_token.json")
+        if self.fx_rates_cache_file_path is None:
+            self.fx_rates_cache_file_path = self.store_file_path.with_name("fx_rates.json")
+        if self.history_file_path is None:
+            self.history_file_path = self.store_file_path.with_name("history.sqlite3")
+        return self
+
+    @model_validator(mode="after")
+    def resolve_accounts(self) -> Self:
+        if not self.accounts:
+            # a single account from AMIAMI_LOGIN / AMIAMI_PASSWORD keeps the original file names
+            if self.username is None or self.password is None:
+                raise ValueError("AMIAMI_LOGIN and AMIAMI_PASSWORD or AMIAMI_ACCOUNTS must be set")
+            account = AccountConfig(name=DEFAULT_ACCOUNT_NAME, username=self.username, password=self.password)
+            account.store_file_path = self.store_file_path
+            account.store_sqlite_path = self.store_sqlite_path
+            account.api_token_file_path = self.api_token_file_path
+            self.accounts = [account]
+            return self
+
+        names = [account.name for account in self.accounts]
+        if len(set(names)) != len(names):
+            raise ValueError(f"Account names must be unique: {names}")
+        # every account gets its own store and login token files
+        assert self.api_token_file_path is not None
+        for account in self.accounts:
+            account.store_file_path = account.store_file_path or _account_path(self.store_file_path, account.name)
+            account.store_sqlite_path = account.store_sqlite_path or _account_path(self.store_sqlite_path, account.name)
+            account.api_token_file_path = account.api_token_file_path or _account_path(self.api_token_file_path, account.name)
+        return self
@@ -1,38 +1,175 @@
+from datetime import timedelta
+from typing import Any
+
 from dependency_injector import containers, providers
 
+from amiami_api.accounts import Account, Accounts
+from amiami_api.analytics import AnalyticsService
 from amiami_api.api import AmiAmiApi
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.events import EventBus
 from amiami_api.fx_rates import FxRatesService
+from amiami_api.history import OrderHistoryLog
+from amiami_api.http_client import HttpClient
+from amiami_api.rate_limit import TokenBucket
+from amiami_api.response_cache import ResponseCache
 from amiami_api.service import AmiamiService
-from amiami_api.store import AmiAmiOrdersFileStore, AmiAmiOrdersStore
-from amiami_api.telegram_bot import create_bot
+from amiami_api.store import (
+    AmiAmiOrdersFileStore,
+    AmiAmiOrdersSqliteStore,
+    AmiAmiOrdersStore,
+)
+from amiami_api.sync import SyncScheduler
+
+
+def create_telegram_bot(token: str) -> Any:
+    # python-telegram-bot is slow to import, so it is loaded only when the bot is enabled
+    from amiami_api.telegram_bot import create_bot
+
+    return create_bot(token)
+
+
+class AccountContainer(containers.DeclarativeContainer):
+    config = providers.Configuration()
+    account_config = providers.Configuration()
+
+    http_client = providers.Dependency(instance_of=HttpClient)
+    global_rate_limiter = providers.Dependency(instance_of=TokenBucket)
+    events = providers.Dependency(instance_of=EventBus)
+    history = providers.Dependency(instance_of=OrderHistoryLog)
+
+    api = providers.Singleton(
+        AmiAmiApi,
+        username=account_config.username,
+        password=account_config.password,
+        http_client=http_client,
+        global_rate_limiter=global_rate_limiter,
+        page_size=config.api_page_size,
+        requests_per_second=config.api_requests_per_second,
+        max_concurrency=config.api_max_concurrency,
+        request_timeout_seconds=config.api_request_timeout_seconds,
+        max_retries=config.api_max_retries,
+        token_file_path=account_config.api_token_file_path,
+        token_ttl=providers.Factory(timedelta, hours=config.api_token_ttl_hours),
+    )
+    store = providers.Selector[AmiAmiOrdersStore](
+        config.store_backend,
+        file=providers.Singleton(
+            AmiAmiOrdersFileStore,
+            file_path=account_config.store_file_path,
+            compact=config.store_compact_json,
+            background_load=config.store_background_load,
+            deferred_save=True,
+            account=account_config.name,
+        ),
+        sqlite=providers.Singleton(
+            AmiAmiOrdersSqliteStore,
+            file_path=account_config.store_sqlite_path,
+            account=account_config.name,
+        ),
+    )
+
+    async_store = providers.Singleton(
+        AsyncAmiAmiOrdersStore,
+        store=store,
+        flush_delay_seconds=config.store_flush_delay_seconds,
+    )
+
+    service = providers.Singleton(
+        AmiamiService,
+        api=api,
+        store=async_store,
+        account=account_config.name,
+        max_staleness=providers.Factory(timedelta, hours=config.sync_max_staleness_hours),
+        events=events,
+        history=history,
+    )
+
+    sync_scheduler = providers.Singleton(
+        SyncScheduler,
+        service=service,
+        open_interval=providers.Factory(timedelta, minutes=config.sync_open_interval_minutes),
+        full_interval=providers.Factory(timedelta, hours=config.sync_full_interval_hours),
+    )
+
+    analytics_service = providers.Singleton(
+        AnalyticsService,
+        store=async_store,
+    )
+
+    account = providers.Singleton(
+        Account,
+        name=account_config.name,
+        service=service,
+        sync_scheduler=sync_scheduler,
+        analytics_service=analytics_service,
+    )
+
+
+def create_accounts(
+    config: dict[str, Any], http_client: HttpClient, global_rate_limiter: TokenBucket, events: EventBus, history: OrderHistoryLog
+) -> Accounts:
+    accounts: dict[str, Account] = {}
+    for account_config in config["accounts"]:
+        container = AccountContainer(http_client=http_client, global_rate_limiter=global_rate_limiter, events=events, history=history)
+        container.config.from_dict(config)
+        container.account_config.from_dict(account_config)
+        accounts[account_config["name"]] = container.account()
+    return Accounts(accounts)
 
 
 class DIContainer(containers.DeclarativeContainer):
-    wiring_config = containers.WiringConfiguration(modules=[".web", ".telegram_bot"])
+    wiring_config = containers.WiringConfiguration(modules=[".web"])
 
     config = providers.Configuration()
 
+    http_client = providers.Singleton(
+        HttpClient,
+        limit=config.http_connections_limit,
+        limit_per_host=config.http_connections_limit_per_host,
+        keepalive_timeout_seconds=config.http_keepalive_timeout_seconds,
+        dns_cache_ttl_seconds=config.http_dns_cache_ttl_seconds,
+        compression=config.http_compression,
+    )
+
     fx_rates_service = providers.Singleton(
         FxRatesService,
         access_key=config.fx_rates_access_key,
+        http_client=http_client,
+        ttl_seconds=providers.Factory(lambda hours: hours * 60 * 60, config.fx_rates_ttl_hours),
+        cache_file_path=config.fx_rates_cache_file_path,
     )
-    api = providers.Singleton(
-        AmiAmiApi,
-        username=config.username,
-        password=config.password,
+
+    global_rate_limiter = providers.Singleton(
+        TokenBucket,
+        rate=config.api_global_requests_per_second,
+        capacity=providers.Factory(lambda rate: max(1, rate), config.api_global_requests_per_second),
+    )
+
+    events = providers.Singleton(
+        EventBus,
+        capacity=config.events_buffer_size,
     )
-    store = providers.Singleton[AmiAmiOrdersStore](
-        AmiAmiOrdersFileStore,
-        file_path=config.store_file_path,
+
+    history = providers.Singleton(
+        OrderHistoryLog,
+        file_path=config.history_file_path,
+        compaction_interval=providers.Factory(timedelta, hours=config.history_compaction_interval_hours),
+        compact_after=providers.Factory(timedelta, days=config.history_compact_after_days),
+    )
+
+    accounts = providers.Singleton(
+        create_accounts,
+        config=config,
+        http_client=http_client,
+        global_rate_limiter=global_rate_limiter,
+        events=events,
+        history=history,
     )
 
     telegram_bot = providers.Singleton(
-        create_bot,
+        create_telegram_bot,
         token=config.telegram_bot_token,
     )
 
-    service = providers.Singleton(
-        AmiamiService,
-        api=api,
-        store=store,
-    )
+    response_cache = providers.Singleton(ResponseCache)
@@ -0,0 +1,117 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from enum import Enum
+from itertools import islice
+from typing import Iterable
+
+from pydantic import BaseModel
+
+from amiami_api import metrics
+from amiami_api.api import OrderInfo
+
+
+class OrderEventType(str, Enum):
+    order_added = "order_added"
+    order_removed = "order_removed"
+    status_changed = "status_changed"
+    release_changed = "release_changed"
+    price_changed = "price_changed"
+    item_release_changed = "item_release_changed"
+    item_stock_changed = "item_stock_changed"
+
+
+class OrderEvent(BaseModel):
+    id: int = 0  # assigned when published
+    type: OrderEventType
+    account: str
+    order_id: str
+    item_id: str | None = None
+    old: str | int | date | None = None
+    new: str | int | date | None = None
+    created_at: datetime
+
+
+def detect_changes(account: str, stored: OrderInfo | None, fetched: OrderInfo, now: datetime) -> list[OrderEvent]:
+    if stored is None:
+        return [OrderEvent(type=OrderEventType.order_added, account=account, order_id=fetched.id, new=fetched.status, created_at=now)]
+
+    events: list[OrderEvent] = []
+
+    def changed(event_type: OrderEventType, old: str | int | date, new: str | int | date, item_id: str | None = None) -> None:
+        if old != new:
+            events.append(OrderEvent(type=event_type, account=account, order_id=fetched.id, item_id=item_id, old=old, new=new, created_at=now))
+
+    changed(OrderEventType.status_changed, stored.status, fetched.status)
+    changed(OrderEventType.release_changed, stored.scheduled_release, fetched.scheduled_release)
+    changed(OrderEventType.price_changed, stored.price, fetched.price)
+    stored_items = {item.id: item for item in stored.items}
+    for item in fetched.items:
+        stored_item = stored_items.get(item.id)
+        if stored_item is not None:
+            changed(OrderEventType.item_release_changed, stored_item.release_date, item.release_date, item_id=item.id)
+            changed(OrderEventType.item_stock_changed, stored_item.in_stock_flag, item.in_stock_flag, item_id=item.id)
+    return events
+
+
+def removed_order_events(account: str, order_ids: Iterable[str], now: datetime) -> list[OrderEvent]:
+    return [OrderEvent(type=OrderEventType.order_removed, account=account, order_id=order_id, created_at=now) for order_id in order_ids]
+
+
+@dataclass
+class EventBus:
+    """In-process pub/sub over a ring buffer, subscribers that fall behind by more than the capacity miss events."""
+
+    capacity: int = 1000
+    _events: deque[OrderEvent] = field(init=False)
+    _last_id: int = field(default=0, init=False)
+    _published: asyncio.Event = field(default_factory=asyncio.Event, init=False)
+
+    def __post_init__(self) -> None:
+        self._events = deque(maxlen=self.capacity)
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def publish(self, events: Iterable[OrderEvent]) -> None:
+        published = False
+        for event in events:
+            self._last_id += 1
+            event.id = self._last_id
+            self._events.append(event)
+            metrics.order_events.inc(type=event.type.value)
+            published = True
+        if published:
+            # wake up all the waiting subscribers, later waits use a new event
+            self._published.set()
+            self._published = asyncio.Event()
+
+    def resume_id(self, last_event_id: int | None) -> int:
+        # ids restart with the process, a newer id than the last one means the client has seen a previous run
+        if last_event_id is None or last_event_id > self._last_id:
+            return self._last_id
+        return last_event_id
+
+    def has_gap(self, after_id: int) -> bool:
+        """Whether events right after the id have already been dropped from the buffer."""
+        return after_id < self._last_id and (not self._events or self._events[0].id > after_id + 1)
+
+    def events_after(self, after_id: int) -> list[OrderEvent]:
+        if not self._events:
+            return []
+        # ids are consecutive, so the position in the buffer is known
+        start = max(0, after_id + 1 - self._events[0].id)
+        return list(islice(self._events, start, None))
+
+    async def wait_for_events(self, after_id: int, timeout: float) -> list[OrderEvent]:
+        """Events after the id, waiting for new ones up to the timeout, cancelling the wait loses nothing."""
+        events = self.events_after(after_id)
+        if events:
+            return events
+        try:
+            await asyncio.wait_for(self._published.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        return self.events_after(after_id)
@@ -1,7 +1,14 @@
-from dataclasses import dataclass, field
+import asyncio
 import datetime
-import aiohttp
-from pydantic import BaseModel, Field
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from loguru import logger
+from pydantic import BaseModel
+
+from amiami_api.http_client import HttpClient
+
 
 class LatestFxRatesResponse(BaseModel):
     success: bool
@@ -10,30 +17,113 @@ class LatestFxRatesResponse(BaseModel):
     date: datetime.date
     rates: dict[str, float]
 
+
+class CachedFxRates(BaseModel):
+    fetched_at: datetime.datetime
+    data: LatestFxRatesResponse
+
+
 @dataclass
 class FxRatesService:
     access_key: str
-    ttl_seconds: int = 60*60*24  # 1 day
-    _cache: dict[str, LatestFxRatesResponse] = field(default_factory=dict, init=False)
+    http_client: HttpClient = field(default_factory=HttpClient)
+    ttl_seconds: int = 60 * 60 * 24  # 1 day
+    cache_file_path: Path | None = None
+    refresh_retry_seconds: int = 60 * 5
+    _last_refresh_attempt: datetime.datetime | None = field(default=None, init=False)
+    _cached: CachedFxRates | None = field(default=None, init=False)
+    _pair_rates: dict[tuple[str, str], float] = field(default_factory=dict, init=False)
+    _refresh_task: asyncio.Task | None = field(default=None, init=False)
+
+    def __post_init__(self) -> None:
+        self._load_cache()
+
+    def _load_cache(self) -> None:
+        if self.cache_file_path is None:
+            return
+        try:
+            with open(self.cache_file_path, "rb") as file:
+                self._cached = CachedFxRates.model_validate_json(file.read())
+        except FileNotFoundError:
+            pass
+        except Exception as exception:
+            logger.opt(exception=exception).warning("Failed to load cached fx rates")
+
+    def _write_cache(self, cache_file_path: Path, data: bytes) -> None:
+        temp_file_path = cache_file_path.with_name(f".{cache_file_path.name}.tmp")
+        try:
+            # write to a temporary file and rename it, so a crash never leaves a partially written cache
+            with open(temp_file_path, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_file_path, cache_file_path)
+        except Exception as exception:
+            logger.opt(exception=exception).warning("Failed to save cached fx rates")
+
+    async def _save_cache(self) -> None:
+        if self.cache_file_path is None or self._cached is None:
+            return
+        # the file is written off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self._write_cache, self.cache_file_path, self._cached.model_dump_json().encode())
 
     async def _get_rates_data(self) -> LatestFxRatesResponse:
-        url = f'https://api.exchangeratesapi.io/v1/latest'
-        async with aiohttp.ClientSession() as session:
-            # base is EUR by default
-            async with session.get(url, params={'access_key': self.access_key, "symbols": "USD,JPY"}) as response: 
-                data = await response.json()
-                return LatestFxRatesResponse.model_validate(data)
-
-    async def _get_cached_rates(self) -> dict[str, float]:
-        cached = self._cache.get('rates')
-        if cached is not None:
-            cache_time = datetime.datetime.fromtimestamp(cached.timestamp)
-            if (datetime.datetime.now() - cache_time).total_seconds() < self.ttl_seconds:
-                return cached.rates
-        rates_data = await self._get_rates_data()
-        self._cache['rates'] = rates_data
-        return rates_data.rates
+        url = "https://api.exchangeratesapi.io/v1/latest"
+        # base is EUR by default, no symbols filter so that any currency pair can be served from the cache
+        async with self.http_client.session.get(url, params={"access_key": self.access_key}) as response:
+            data = await response.json()
+            return LatestFxRatesResponse.model_validate(data)
+
+    async def _refresh(self) -> None:
+        self._last_refresh_attempt = datetime.datetime.now()
+        try:
+            rates_data = await self._get_rates_data()
+        except Exception as exception:
+            # keep serving the last known rates
+            logger.opt(exception=exception).error("Failed to refresh fx rates")
+            return
+        self._cached = CachedFxRates(fetched_at=datetime.datetime.now(), data=rates_data)
+        self._pair_rates.clear()
+        await self._save_cache()
+
+    def _start_refresh(self) -> asyncio.Task:
+        # single flight: concurrent callers share one refresh
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+        return self._refresh_task
+
+    def _is_stale(self, cached: CachedFxRates) -> bool:
+        return (datetime.datetime.now() - cached.fetched_at).total_seconds() >= self.ttl_seconds
+
+    def _is_refresh_backing_off(self) -> bool:
+        # don't hammer a failing provider on every call while serving stale rates
+        if self._last_refresh_attempt is None:
+            return False
+        return (datetime.datetime.now() - self._last_refresh_attempt).total_seconds() < self.refresh_retry_seconds
+
+    async def _get_cached_rates(self) -> LatestFxRatesResponse:
+        if self._cached is None:
+            await asyncio.shield(self._start_refresh())
+            if self._cached is None:
+                raise RuntimeError("Fx rates are not available")
+        elif self._is_stale(self._cached) and not self._is_refresh_backing_off():
+            # stale while revalidate
+            self._start_refresh()
+        return self._cached.data
+
+    async def get_rate(self, from_currency: str, to_currency: str) -> float:
+        rates_data = await self._get_cached_rates()
+        pair = (from_currency, to_currency)
+        rate = self._pair_rates.get(pair)
+        if rate is None:
+            rates = {rates_data.base: 1.0, **rates_data.rates}
+            rate = rates[to_currency] / rates[from_currency]
+            self._pair_rates[pair] = rate
+        return rate
 
     async def get_jpy_to_usd_rate(self) -> float:
-        rates = await self._get_cached_rates()
-        return rates['USD'] / rates['JPY']
+        return await self.get_rate("JPY", "USD")
+
+    def warm_up(self) -> None:
+        if self._cached is None or self._is_stale(self._cached):
+            self._start_refresh()
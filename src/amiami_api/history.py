@@ -0,0 +1,266 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from enum import Enum
+from functools import partial
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Callable, Iterable, TypeVar
+
+from loguru import logger
+from pydantic import BaseModel
+
+from amiami_api.analytics import get_figure_type
+from amiami_api.api import Item, OrderInfo
+from amiami_api.events import OrderEvent, OrderEventType
+
+ResultType = TypeVar("ResultType")
+
+RELEASE_CHANGE_TYPES = (OrderEventType.release_changed, OrderEventType.item_release_changed)
+# repeated changes of these fields are collapsed by the compaction, release changes are the delay history and are kept
+COMPACTED_CHANGE_TYPES = (OrderEventType.status_changed, OrderEventType.price_changed, OrderEventType.item_stock_changed)
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    order_id TEXT NOT NULL,
+    item_id TEXT,
+    scode TEXT,
+    figure_type TEXT,
+    type TEXT NOT NULL,
+    old TEXT,
+    new TEXT,
+    delay_months INTEGER,
+    changed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_order_idx ON changes (order_id, id);
+CREATE INDEX IF NOT EXISTS changes_scode_idx ON changes (scode, type, id) WHERE scode IS NOT NULL;
+CREATE INDEX IF NOT EXISTS changes_type_idx ON changes (type, changed_at);
+-- replaced by changes_slips_idx, which leaves out the releases that did not move later
+DROP INDEX IF EXISTS changes_delays_idx;
+CREATE INDEX IF NOT EXISTS changes_slips_idx ON changes (type, old, figure_type, account, delay_months) WHERE delay_months > 0;
+"""
+
+
+class HistoryEntry(BaseModel):
+    id: int
+    account: str
+    order_id: str
+    item_id: str | None
+    scode: str | None
+    figure_type: str | None
+    type: OrderEventType
+    old: str | None
+    new: str | None
+    delay_months: int | None
+    changed_at: datetime
+
+
+class DelayGrouping(str, Enum):
+    month = "month"  # originally scheduled release month
+    type = "type"  # figure type
+
+
+class DelayStats(BaseModel):
+    key: str
+    slips: int
+    average_delay_months: float
+    max_delay_months: int
+
+
+@dataclass(frozen=True)
+class HistoryQuery:
+    accounts: tuple[str, ...] | None = None
+    order_id: str | None = None
+    scode: str | None = None
+    types: tuple[OrderEventType, ...] | None = None
+    since: datetime | None = None
+    until: datetime | None = None
+    limit: int = 100
+    offset: int = 0
+
+
+def _months_between(old: date, new: date) -> int:
+    return (new.year - old.year) * 12 + new.month - old.month
+
+
+def _in_condition(column: str, values: Iterable[str]) -> tuple[str, tuple]:
+    values = tuple(values)
+    return f"{column} IN ({', '.join('?' * len(values))})", values
+
+
+@dataclass
+class OrderHistoryLog:
+    """Append-only log of order and item field changes, kept in SQLite next to the orders store."""
+
+    file_path: Path
+    compaction_interval: timedelta | None = field(default_factory=lambda: timedelta(days=1))
+    compact_after: timedelta = field(default_factory=lambda: timedelta(days=30))
+    _connection: sqlite3.Connection = field(init=False)
+    _executor: ThreadPoolExecutor = field(default_factory=lambda: ThreadPoolExecutor(1, thread_name_prefix="history"), init=False)
+    _compaction_task: asyncio.Task | None = field(default=None, init=False)
+
+    def __post_init__(self) -> None:
+        self._connection = sqlite3.connect(self.file_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        # only takes effect for a new database, space freed by the compaction is then returned to the file system
+        self._connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(HISTORY_SCHEMA)
+
+    async def _call(self, function: Callable[..., ResultType], *args: Any) -> ResultType:
+        # the connection is used from the history thread only, so the event loop never waits for sqlite
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(function, *args))
+
+    @staticmethod
+    def _row(event: OrderEvent, items: dict[tuple[str, str], Item]) -> tuple:
+        item = items.get((event.order_id, event.item_id)) if event.item_id is not None else None
+        delay_months = None
+        if event.type in RELEASE_CHANGE_TYPES and isinstance(event.old, date) and isinstance(event.new, date):
+            delay_months = _months_between(event.old, event.new)
+        return (
+            event.account,
+            event.order_id,
+            event.item_id,
+            item.scode if item is not None else None,
+            get_figure_type(item) if item is not None else None,
+            event.type.value,
+            None if event.old is None else str(event.old),
+            None if event.new is None else str(event.new),
+            delay_months,
+            event.created_at.isoformat(),
+        )
+
+    def _append(self, events: list[OrderEvent], orders: list[OrderInfo]) -> None:
+        items = {(order.id, item.id): item for order in orders for item in order.items}
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO changes (account, order_id, item_id, scode, figure_type, type, old, new, delay_months, changed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._row(event, items) for event in events],
+            )
+
+    async def append(self, events: list[OrderEvent], orders: Iterable[OrderInfo]) -> None:
+        """Log the changes, item details are taken from the orders they were detected in."""
+        if events:
+            await self._call(self._append, events, list(orders))
+
+    def _query(self, query: HistoryQuery) -> list[HistoryEntry]:
+        conditions: list[str] = []
+        parameters: list[Any] = []
+        if query.accounts is not None:
+            condition, values = _in_condition("account", query.accounts)
+            conditions.append(condition)
+            parameters += values
+        if query.order_id is not None:
+            conditions.append("order_id = ?")
+            parameters.append(query.order_id)
+        if query.scode is not None:
+            conditions.append("scode = ?")
+            parameters.append(query.scode)
+        if query.types is not None:
+            condition, values = _in_condition("type", (change_type.value for change_type in query.types))
+            conditions.append(condition)
+            parameters += values
+        if query.since is not None:
+            conditions.append("changed_at >= ?")
+            parameters.append(query.since.isoformat())
+        if query.until is not None:
+            conditions.append("changed_at < ?")
+            parameters.append(query.until.isoformat())
+        rows = self._connection.execute(
+            f"SELECT * FROM changes WHERE {' AND '.join(conditions) or '1'} ORDER BY id LIMIT ? OFFSET ?",
+            (*parameters, query.limit, query.offset),
+        ).fetchall()
+        return [HistoryEntry.model_validate(dict(row)) for row in rows]
+
+    async def query(self, query: HistoryQuery) -> list[HistoryEntry]:
+        return await self._call(self._query, query)
+
+    def _get_delays(
+        self, group_by: DelayGrouping, accounts: tuple[str, ...] | None, release_from: date | None, release_to: date | None
+    ) -> list[DelayStats]:
+        # item slips only, they carry the figure type, same month and earlier releases are not slips,
+        # the slips index covers the whole query
+        conditions = ["type = ?", "delay_months > 0"]
+        parameters: list[Any] = [OrderEventType.item_release_changed.value]
+        if release_from is not None:
+            conditions.append("old >= ?")
+            parameters.append(release_from.isoformat())
+        if release_to is not None:
+            conditions.append("old <= ?")
+            parameters.append(release_to.isoformat())
+        if accounts is not None:
+            condition, values = _in_condition("account", accounts)
+            conditions.append(condition)
+            parameters += values
+        key = "substr(old, 1, 7)" if group_by == DelayGrouping.month else "figure_type"
+        rows = self._connection.execute(
+            f"SELECT {key} AS key, COUNT(*) AS slips, AVG(delay_months) AS average_delay_months, MAX(delay_months) AS max_delay_months "
+            f"FROM changes WHERE {' AND '.join(conditions)} GROUP BY 1 ORDER BY 1",
+            parameters,
+        ).fetchall()
+        return [DelayStats.model_validate(dict(row)) for row in rows]
+
+    async def get_delays(
+        self,
+        group_by: DelayGrouping,
+        accounts: tuple[str, ...] | None = None,
+        release_from: date | None = None,
+        release_to: date | None = None,
+    ) -> list[DelayStats]:
+        return await self._call(self._get_delays, group_by, accounts, release_from, release_to)
+
+    def _compact(self, before: datetime) -> int:
+        condition, types = _in_condition("type", (change_type.value for change_type in COMPACTED_CHANGE_TYPES))
+        rows = self._connection.execute(
+            f"SELECT id, account, order_id, item_id, type, old, new FROM changes WHERE changed_at < ? AND {condition} "
+            "ORDER BY account, order_id, item_id, type, id",
+            (before.isoformat(), *types),
+        ).fetchall()
+        deleted_ids: list[tuple[int]] = []
+        updated_rows: list[tuple[str, int]] = []
+        # a run of changes of one field becomes a single change from the first old value to the last new one
+        for _, group in groupby(rows, key=lambda row: (row["account"], row["order_id"], row["item_id"], row["type"])):
+            changes = list(group)
+            if len(changes) < 2:
+                continue
+            first, last = changes[0], changes[-1]
+            deleted_ids += [(change["id"],) for change in changes[:-1]]
+            if first["old"] == last["new"]:
+                deleted_ids.append((last["id"],))
+            else:
+                updated_rows.append((first["old"], last["id"]))
+        with self._connection:
+            self._connection.executemany("DELETE FROM changes WHERE id = ?", deleted_ids)
+            self._connection.executemany("UPDATE changes SET old = ? WHERE id = ?", updated_rows)
+        self._connection.execute("PRAGMA incremental_vacuum")
+        return len(deleted_ids)
+
+    async def compact(self) -> int:
+        """Collapse repeated changes older than compact_after, returns the number of removed entries."""
+        deleted = await self._call(self._compact, datetime.now() - self.compact_after)
+        logger.info(f"History compacted: {deleted} entries removed")
+        return deleted
+
+    async def _compact_periodically(self, interval: timedelta) -> None:
+        while True:
+            await asyncio.sleep(interval.total_seconds())
+            try:
+                await self.compact()
+            except Exception as exception:
+                logger.opt(exception=exception).error("History compaction failed")
+
+    def start(self) -> None:
+        if self.compaction_interval and self._compaction_task is None:
+            self._compaction_task = asyncio.create_task(self._compact_periodically(self.compaction_interval))
+
+    async def close(self) -> None:
+        if self._compaction_task is not None:
+            self._compaction_task.cancel()
+            await asyncio.gather(self._compaction_task, return_exceptions=True)
+        await self._call(self._connection.close)
+        self._executor.shutdown()
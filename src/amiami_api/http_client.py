@@ -0,0 +1,60 @@
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, AsyncIterator
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+class HttpConnectionError(ConnectionError):
+    """The server could not be reached or the connection broke during the request."""
+
+
+@dataclass
+class HttpClient:
+    limit: int = 100
+    limit_per_host: int = 10
+    keepalive_timeout_seconds: float = 30
+    dns_cache_ttl_seconds: int = 300
+    compression: bool = True
+    _session: "aiohttp.ClientSession | None" = field(default=None, init=False)
+    # set with the session, so that requests need no aiohttp import of their own
+    _connection_error: type[Exception] = field(default=HttpConnectionError, init=False)
+
+    @property
+    def session(self) -> "aiohttp.ClientSession":
+        # created lazily, so the session is bound to the running event loop, aiohttp is imported only when it is needed
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout_seconds,
+                ttl_dns_cache=self.dns_cache_ttl_seconds,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                # the accounts share the session, auth is the per account header, so no cookie may be kept for one of them
+                cookie_jar=aiohttp.DummyCookieJar(),
+                headers={"Accept-Encoding": "gzip, deflate" if self.compression else "identity"},
+            )
+            self._connection_error = aiohttp.ClientConnectionError
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, timeout_seconds: float, **kwargs: Any) -> AsyncIterator["aiohttp.ClientResponse"]:
+        """Request with a total timeout that covers reading the response, connection failures are raised as HttpConnectionError."""
+        session = self.session
+        try:
+            async with asyncio.timeout(timeout_seconds):
+                async with session.request(method, url, **kwargs) as response:
+                    yield response
+        except self._connection_error as exception:
+            raise HttpConnectionError(repr(exception)) from exception
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,167 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Generic, Iterator, TypeVar
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+ValueType = TypeVar("ValueType")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+@dataclass
+class Metric(Generic[ValueType]):
+    name: str
+    documentation: str
+    label_names: tuple[str, ...] = ()
+    _values: dict[tuple[str, ...], ValueType] = field(default_factory=dict, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    type_name = "untyped"
+
+    def _label_values(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if labels.keys() != set(self.label_names):
+            raise ValueError(f"{self.name}: expected labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            lines += self._samples()
+        return "\n".join(lines)
+
+
+@dataclass
+class Counter(Metric[float]):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+@dataclass
+class Gauge(Metric[float]):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+
+
+@dataclass
+class HistogramValue:
+    bucket_counts: list[int]
+    count: int = 0
+    sum: float = 0
+
+
+@dataclass
+class Histogram(Metric[HistogramValue]):
+    buckets: tuple[float, ...] = DEFAULT_BUCKETS
+
+    type_name = "histogram"
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram_value = self._values.get(key)
+            if histogram_value is None:
+                histogram_value = self._values[key] = HistogramValue(bucket_counts=[0] * (len(self.buckets) + 1))
+            histogram_value.bucket_counts[bucket_index] += 1
+            histogram_value.count += 1
+            histogram_value.sum += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def _samples(self) -> Iterator[str]:
+        for key, value in self._values.items():
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip((*self.buckets, math.inf), value.bucket_counts):
+                cumulative_count += bucket_count
+                bucket_labels = _format_labels(self.label_names, key, f'le="{_format_value(upper_bound)}"')
+                yield f"{self.name}_bucket{bucket_labels} {cumulative_count}"
+            yield f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(value.sum)}"
+            yield f"{self.name}_count{_format_labels(self.label_names, key)} {value.count}"
+
+
+@dataclass
+class MetricsRegistry:
+    _metrics: dict[str, Metric] = field(default_factory=dict, init=False)
+
+    def register(self, metric: Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def counter(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Counter:
+        counter = Counter(name, documentation, label_names)
+        self.register(counter)
+        return counter
+
+    def gauge(self, name: str, documentation: str, label_names: tuple[str, ...] = ()) -> Gauge:
+        gauge = Gauge(name, documentation, label_names)
+        self.register(gauge)
+        return gauge
+
+    def histogram(self, name: str, documentation: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        histogram = Histogram(name, documentation, label_names, buckets=buckets)
+        self.register(histogram)
+        return histogram
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry = MetricsRegistry()
+
+amiami_request_duration = registry.histogram("amiami_api_request_duration_seconds", "Latency of AmiAmi API requests.", ("endpoint",))
+amiami_request_errors = registry.counter("amiami_api_request_errors_total", "Failed AmiAmi API requests.", ("endpoint", "kind"))
+amiami_request_retries = registry.counter("amiami_api_request_retries_total", "Retried AmiAmi API requests.", ("endpoint",))
+amiami_relogins = registry.counter("amiami_api_relogins_total", "Re-logins after an unauthorized response.")
+
+sync_duration = registry.histogram("amiami_sync_duration_seconds", "Duration of order syncs.", ("account", "order_type"))
+sync_orders = registry.counter("amiami_sync_orders_total", "Orders processed by syncs.", ("account", "order_type", "result"))
+sync_last_run_orders = registry.gauge("amiami_sync_last_run_orders", "Orders processed by the last sync.", ("account", "order_type", "result"))
+order_events = registry.counter("amiami_order_events_total", "Order change events published.", ("type",))
+
+store_save_duration = registry.histogram("amiami_store_save_duration_seconds", "Duration of store saves and commits.", ("account", "backend"))
+store_load_duration = registry.histogram("amiami_store_load_duration_seconds", "Duration of background store loads.", ("account", "backend"))
+store_file_size = registry.gauge("amiami_store_file_size_bytes", "Size of the store file after the last save.", ("account", "backend"))
+
+http_request_duration = registry.histogram("http_request_duration_seconds", "Latency of web API responses.", ("method", "route", "status"))
@@ -0,0 +1,70 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+
+@dataclass
+class TokenBucket:
+    rate: float  # tokens per second
+    capacity: float = 1
+    _tokens: float = field(default=0, init=False)
+    _updated_at: float = field(default_factory=time.monotonic, init=False)
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False)
+
+    def __post_init__(self) -> None:
+        self._tokens = self.capacity
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+@dataclass
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limit: grows by one slot per limit-worth of successes and shrinks on overload."""
+
+    initial_limit: int = 3
+    min_limit: int = 1
+    max_limit: int = 8
+    backoff_ratio: float = 0.5
+    _limit: float = field(default=0, init=False)
+    _in_flight: int = field(default=0, init=False)
+    _condition: asyncio.Condition = field(default_factory=asyncio.Condition, init=False)
+
+    def __post_init__(self) -> None:
+        self._limit = float(self.initial_limit)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def on_success(self) -> None:
+        self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+
+    def on_overload(self) -> None:
+        self._limit = max(float(self.min_limit), self._limit * self.backoff_ratio)
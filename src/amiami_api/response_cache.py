@@ -0,0 +1,29 @@
+import hashlib
+import secrets
+from dataclasses import dataclass, field
+from typing import Hashable
+
+
+@dataclass
+class ResponseCache:
+    max_entries: int = 128
+    _instance_tag: str = field(default_factory=lambda: secrets.token_hex(4), init=False)
+    # every entry keeps the version it was built for, accounts selections have versions of their own
+    _entries: dict[Hashable, tuple[Hashable, bytes]] = field(default_factory=dict, init=False)
+
+    def etag(self, key: Hashable, version: Hashable) -> str:
+        # etag depends only on the key and the store version, so a match can be answered without serializing anything
+        key_digest = hashlib.blake2b(repr((key, version)).encode(), digest_size=8).hexdigest()
+        return f'"{self._instance_tag}-{key_digest}"'
+
+    def get(self, key: Hashable, version: Hashable) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        return entry[1]
+
+    def put(self, key: Hashable, version: Hashable, body: bytes) -> None:
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = (version, body)
@@ -1,56 +1,158 @@
 import asyncio
-from dataclasses import dataclass
-from datetime import datetime
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator
 
 from loguru import logger
 
-from amiami_api.api import AmiAmiApi, Order, OrderInfo, OrderType
-from amiami_api.store import AmiAmiOrdersStore
+from amiami_api import metrics, utils
+from amiami_api.api import (
+    AmiAmiApi,
+    Item,
+    Order,
+    OrderInfo,
+    OrderType,
+    amiami_month_date_validate,
+)
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.config import DEFAULT_ACCOUNT_NAME
+from amiami_api.events import EventBus, OrderEvent, detect_changes, removed_order_events
+from amiami_api.history import OrderHistoryLog
+from amiami_api.store import OrdersQuery
+
+
+@dataclass
+class UpdateResult:
+    orders: list[OrderInfo]
+    fetched: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    failed: int = 0
 
 
 @dataclass
 class AmiamiService:
     api: AmiAmiApi
-    store: AmiAmiOrdersStore
-    update_parallelism: int = 3
+    store: AsyncAmiAmiOrdersStore
+    account: str = DEFAULT_ACCOUNT_NAME
+    max_staleness: timedelta = field(default_factory=lambda: timedelta(hours=24))
+    events: EventBus | None = None
+    history: OrderHistoryLog | None = None
+
+    @property
+    def version(self) -> int:
+        return self.store.version
 
     async def get_orders(self, order_type: OrderType) -> list[OrderInfo]:
-        return self.store.get_orders(order_type)
+        await self.store.wait_until_loaded()
+        return await self.store.get_orders(order_type)
 
     async def get_order(self, order_id: str) -> OrderInfo | None:
-        return self.store.get_order(order_id)
+        await self.store.wait_until_loaded()
+        return await self.store.get_order(order_id)
+
+    async def query_orders(self, query: OrdersQuery) -> list[OrderInfo]:
+        await self.store.wait_until_loaded()
+        return await self.store.query_orders(query)
+
+    async def query_items(self, query: OrdersQuery) -> list[Item]:
+        await self.store.wait_until_loaded()
+        return await self.store.query_items(query)
+
+    def iter_orders(self, query: OrdersQuery) -> AsyncIterator[OrderInfo]:
+        return self.store.iter_orders(query)
+
+    def iter_items(self, query: OrdersQuery) -> AsyncIterator[Item]:
+        return self.store.iter_items(query)
 
     async def get_current_orders(self, include_finished: bool = True) -> list[OrderInfo]:
-        orders = self.store.get_orders(OrderType.all)
-        now = datetime.now()
-        current_month = now.month
-        previous_month = current_month - 1 if current_month > 1 else 12
-        current_year = now.year
+        await self.store.wait_until_loaded()
+        current_month = date.today().replace(day=1)
+        orders = await self.store.get_orders_by_release_months([current_month, utils.previous_month_start(current_month)])
+        if not include_finished:
+            orders = [order for order in orders if order.is_open]  # type: ignore[truthy-function]
+        return orders
+
+    def _needs_fetch(self, order: Order, stored: OrderInfo | None, fetched_at: datetime | None, now: datetime) -> bool:
+        if stored is None or fetched_at is None:
+            return True
+        if now - fetched_at > self.max_staleness:
+            return True
+        if order.status != stored.status or order.price != stored.price:
+            return True
+        # "Before Last Month" summaries are corrected from items only in the detailed order info
+        if order.scheduled_release == amiami_month_date_validate("Before Last Month"):
+            return False
+        return order.scheduled_release != stored.scheduled_release
 
-        def filter_func(order: OrderInfo) -> bool:
-            if order.status == OrderType.shipped and not include_finished:
-                return False
-            return order.scheduled_release.month in [current_month, previous_month] and order.scheduled_release.year == current_year
+    def _detect_changes(
+        self,
+        stored_orders: dict[str, OrderInfo],
+        fetched_orders: list[OrderInfo],
+        deleted: list[str],
+        now: datetime,
+        is_initial_import: bool,
+    ) -> list[OrderEvent]:
+        events = removed_order_events(self.account, deleted, now)
+        for order in fetched_orders:
+            stored = stored_orders.get(order.id)
+            # the first sync of an empty store imports the orders, it does not announce every one of them
+            if stored is None and is_initial_import:
+                continue
+            events += detect_changes(self.account, stored, order, now)
+        return events
+
+    async def update_orders(self, order_type: OrderType, force: bool = False) -> UpdateResult:
+        # the delta is computed against the stored orders, and saving must not race with the initial load
+        await self.store.wait_until_loaded()
+        with metrics.sync_duration.time(account=self.account, order_type=order_type.value):
+            result = await self._update_orders(order_type, force)
+        for result_name in ("fetched", "skipped", "deleted", "failed"):
+            count = getattr(result, result_name)
+            metrics.sync_orders.inc(count, account=self.account, order_type=order_type.value, result=result_name)
+            metrics.sync_last_run_orders.set(count, account=self.account, order_type=order_type.value, result=result_name)
+        return result
 
-        return list(filter(filter_func, orders))
+    async def _update_orders(self, order_type: OrderType, force: bool) -> UpdateResult:
+        all_orders = await self.api.get_orders(OrderType.all)
+        orders = [order for order in all_orders if order_type.matches(order)]
+        now = datetime.now()
 
-    async def update_orders(self, order_type: OrderType) -> list[OrderInfo]:
-        orders, all_orders = await asyncio.gather(self.api.get_orders(order_type), self.api.get_orders(OrderType.all))
-        semaphore = asyncio.Semaphore(self.update_parallelism)
+        # stored orders are read even for forced syncs, changes are detected against them
+        is_initial_import = await self.store.count_orders() == 0
+        order_ids = [order.id for order in orders]
+        stored_orders = await self.store.get_orders_by_ids(order_ids)
+        fetched_at = await self.store.get_fetched_at(order_ids)
+        orders_to_fetch = [order for order in orders if force or self._needs_fetch(order, stored_orders.get(order.id), fetched_at.get(order.id), now)]
+        result = UpdateResult(orders=[], skipped=len(orders) - len(orders_to_fetch))
 
         async def fetch_order_info(order: Order) -> OrderInfo:
-            async with semaphore:
-                logger.info(f"Fetching order info for order {order.id}")
-                return await self.api.get_order_info(order.id)
+            logger.info(f"Fetching order info for order {order.id}")
+            return await self.api.get_order_info(order.id)
 
-        fetch_order_info_tasks = [fetch_order_info(order) for order in orders]
+        fetch_order_info_tasks = [fetch_order_info(order) for order in orders_to_fetch]
         orders_info = await asyncio.gather(*fetch_order_info_tasks, return_exceptions=True)
+        fetched_orders: list[OrderInfo] = []
         for order_info in orders_info:
             if isinstance(order_info, BaseException):
                 logger.opt(exception=order_info).error("Error while fetching order info")
+                result.failed += 1
                 continue
-            self.store.update_order(order_info.id, order_info)
+            fetched_orders.append(order_info)
+        result.fetched = len(fetched_orders)
 
-        self.store.clean_up_not_existing_orders([order.id for order in all_orders])
+        deleted = await self.store.update_and_clean_up(fetched_orders, [order.id for order in all_orders], fetched_at=now)
+        result.deleted = len(deleted)
+        changes = self._detect_changes(stored_orders, fetched_orders, deleted, now, is_initial_import)
+        # logged before publishing, so a client reacting to an event already finds it in the history
+        if self.history is not None:
+            await self.history.append(changes, fetched_orders)
+        if self.events is not None:
+            self.events.publish(changes)
 
-        return self.store.get_orders(order_type)
+        logger.info(
+            f"Orders of {self.account} updated: "
+            f"{result.fetched} fetched, {result.skipped} skipped, {result.deleted} deleted, {result.failed} failed"
+        )
+        result.orders = await self.store.get_orders(order_type)
+        return result
@@ -1,99 +1,662 @@
+import os
+import sqlite3
 from abc import ABC
-from dataclasses import dataclass, field
-from datetime import date
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime
+from functools import partial
 from pathlib import Path
+from typing import Callable, Iterable, Iterator, TypeVar
 
 from loguru import logger
 from pydantic import TypeAdapter
 
-from amiami_api.api import OrderInfo, OrderType
+from amiami_api import metrics, utils
+from amiami_api.api import Item, OrderInfo, OrderType
+from amiami_api.compact import CompactItem, CompactOrder
+from amiami_api.config import DEFAULT_ACCOUNT_NAME
+
+RowType = TypeVar("RowType")
+
+
+class StoredOrderInfo(OrderInfo):
+    """Order record of the file store, with the sync metadata that is not part of the served order."""
+
+    fetched_at: datetime | None = None
+
+
+orders_by_id_adapter = TypeAdapter(dict[str, StoredOrderInfo])
+
+
+@dataclass(frozen=True)
+class OrdersQuery:
+    order_type: OrderType = OrderType.all
+    release_from: date | None = None
+    release_to: date | None = None
+    status: str | None = None
+    search: str | None = None
+    limit: int | None = None
+    offset: int = 0
+
+    def matches_order(self, order: OrderInfo | CompactOrder) -> bool:
+        if self.release_from is not None and order.scheduled_release < self.release_from:
+            return False
+        if self.release_to is not None and order.scheduled_release > self.release_to:
+            return False
+        if self.status is not None and order.status.lower() != self.status.lower():
+            return False
+        if self.search is not None and not any(self.matches_item(item) for item in order.items):
+            return False
+        return True
+
+    def matches_item(self, item: Item | CompactItem) -> bool:
+        return self.search is None or self.search.lower() in item.name.lower()
+
+    def paginate(self, rows: list[RowType]) -> list[RowType]:
+        end = None if self.limit is None else self.offset + self.limit
+        return rows[self.offset : end]
+
+
+def order_sort_key(order: OrderInfo | CompactOrder) -> tuple[date, str]:
+    return order.scheduled_release, order.id
 
 
 class AmiAmiOrdersStore(ABC):
+    _version: int = 0
+
+    @property
+    def version(self) -> int:
+        """Counter incremented on every mutation, used to invalidate derived data."""
+        return self._version
+
     def get_order(self, order_id: str) -> OrderInfo | None:
         raise NotImplementedError
 
     def get_orders(self, order_type: OrderType = OrderType.all) -> list[OrderInfo]:
         raise NotImplementedError
 
-    def add_order(self, order: OrderInfo) -> None:
+    def count_orders(self) -> int:
+        return len(self.get_orders())
+
+    def get_orders_by_ids(self, order_ids: Iterable[str]) -> dict[str, OrderInfo]:
+        orders = {order_id: self.get_order(order_id) for order_id in order_ids}
+        return {order_id: order for order_id, order in orders.items() if order is not None}
+
+    def get_fetched_at(self, order_ids: Iterable[str]) -> dict[str, datetime]:
+        """When the details of the orders were last fetched, orders without a known time are left out."""
         raise NotImplementedError
 
-    def update_order(self, order_id: str, order: OrderInfo) -> None:
+    def add_order(self, order: OrderInfo, fetched_at: datetime | None = None) -> None:
+        raise NotImplementedError
+
+    def update_order(self, order_id: str, order: OrderInfo, fetched_at: datetime | None = None) -> None:
         raise NotImplementedError
 
     def delete_order(self, order_id: str) -> None:
         raise NotImplementedError
 
-    def clean_up_not_existing_orders(self, existing_orders: list[str]) -> None:
-        orders = self.get_orders()
-        for order in orders:
-            if order.id not in existing_orders:
-                self.delete_order(order.id)
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Group several mutations so that the store persists them once."""
+        yield
+
+    def load(self) -> None:
+        """Load persisted orders, for stores that do not load them on creation."""
+
+    def take_pending_write(self) -> Callable[[], bool] | None:
+        """Return deferred persistence work that may run on another thread and tells if it succeeded, None when there is nothing to write."""
+        return None
+
+    def bulk_update(self, orders: Iterable[OrderInfo], fetched_at: datetime | None = None) -> None:
+        with self.batch():
+            for order in orders:
+                self.update_order(order.id, order, fetched_at)
+
+    def bulk_delete(self, order_ids: Iterable[str]) -> None:
+        with self.batch():
+            for order_id in order_ids:
+                self.delete_order(order_id)
+
+    def get_orders_by_release_months(self, months: Iterable[date]) -> list[OrderInfo]:
+        month_starts = {month.replace(day=1) for month in months}
+        return [order for order in self.get_orders() if order.scheduled_release.replace(day=1) in month_starts]
+
+    def query_orders(self, query: OrdersQuery) -> list[OrderInfo]:
+        orders = [order for order in self.get_orders(query.order_type) if query.matches_order(order)]
+        return query.paginate(sorted(orders, key=order_sort_key))
+
+    def query_items(self, query: OrdersQuery) -> list[Item]:
+        items = [item for order in self.query_orders(replace(query, limit=None, offset=0)) for item in order.items if query.matches_item(item)]
+        return query.paginate(items)
+
+    def iter_orders(self, query: OrdersQuery) -> Iterator[OrderInfo]:
+        """Same rows as query_orders, materialized lazily so that callers can stream them."""
+        yield from self.query_orders(query)
+
+    def iter_items(self, query: OrdersQuery) -> Iterator[Item]:
+        yield from self.query_items(query)
+
+    def clean_up_not_existing_orders(self, existing_orders: list[str]) -> list[str]:
+        existing_orders_set = set(existing_orders)
+        deleted = [order.id for order in self.get_orders() if order.id not in existing_orders_set]
+        self.bulk_delete(deleted)
+        return deleted
 
 
 @dataclass
 class AmiAmiOrdersMemoryStore(AmiAmiOrdersStore):
-    _orders: dict[str, OrderInfo] = field(default_factory=dict, init=False)
+    # orders are kept in a compact form and materialized as pydantic models only when read
+    _orders: dict[str, CompactOrder] = field(default_factory=dict, init=False)
+    _open_ids: set[str] = field(default_factory=set, init=False)
+    _shipped_ids: set[str] = field(default_factory=set, init=False)
+    _ids_by_release_month: dict[date, set[str]] = field(default_factory=dict, init=False)
 
-    def get_order(self, order_id: str) -> OrderInfo | None:
-        return self._orders.get(order_id)
+    def _index_order(self, order: CompactOrder) -> None:
+        (self._open_ids if order.is_open else self._shipped_ids).add(order.id)
+        self._ids_by_release_month.setdefault(order.scheduled_release.replace(day=1), set()).add(order.id)
 
-    def get_orders(self, order_type: OrderType = OrderType.all) -> list[OrderInfo]:
-        all_orders = list(self._orders.values())
+    def _unindex_order(self, order: CompactOrder) -> None:
+        self._open_ids.discard(order.id)
+        self._shipped_ids.discard(order.id)
+        month = order.scheduled_release.replace(day=1)
+        month_ids = self._ids_by_release_month.get(month)
+        if month_ids is not None:
+            month_ids.discard(order.id)
+            if not month_ids:
+                del self._ids_by_release_month[month]
+
+    def _rebuild_indexes(self) -> None:
+        self._open_ids = set()
+        self._shipped_ids = set()
+        self._ids_by_release_month = {}
+        for order in self._orders.values():
+            self._index_order(order)
+
+    def _get_compact_orders(self, order_type: OrderType) -> list[CompactOrder]:
         match order_type:
             case OrderType.all:
-                return all_orders
+                return list(self._orders.values())
             case OrderType.open:
-                return [order for order in all_orders if order.is_open]  # type: ignore[truthy-function]
+                return [self._orders[order_id] for order_id in self._open_ids]
             case OrderType.shipped:
-                return [order for order in all_orders if not order.is_open]  # type: ignore[truthy-function]
+                return [self._orders[order_id] for order_id in self._shipped_ids]
             case OrderType.current_month:
                 # less or equal because sometime there are delays
-                return [order for order in all_orders if order.is_open and order.scheduled_release <= date.today()]  # type: ignore[truthy-function]
+                today = date.today()
+                current_month = today.replace(day=1)
+                orders: list[CompactOrder] = []
+                for month, month_ids in self._ids_by_release_month.items():
+                    if month > current_month:
+                        continue
+                    month_orders = [self._orders[order_id] for order_id in month_ids & self._open_ids]
+                    if month == current_month:
+                        month_orders = [order for order in month_orders if order.scheduled_release <= today]
+                    orders += month_orders
+                return orders
+
+    def get_order(self, order_id: str) -> OrderInfo | None:
+        order = self._orders.get(order_id)
+        return order.to_order_info() if order is not None else None
+
+    def get_orders(self, order_type: OrderType = OrderType.all) -> list[OrderInfo]:
+        return [order.to_order_info() for order in self._get_compact_orders(order_type)]
+
+    def count_orders(self) -> int:
+        return len(self._orders)
+
+    def get_orders_by_ids(self, order_ids: Iterable[str]) -> dict[str, OrderInfo]:
+        return {order_id: self._orders[order_id].to_order_info() for order_id in order_ids if order_id in self._orders}
+
+    def get_fetched_at(self, order_ids: Iterable[str]) -> dict[str, datetime]:
+        orders = [self._orders[order_id] for order_id in order_ids if order_id in self._orders]
+        return {order.id: order.fetched_at for order in orders if order.fetched_at is not None}
 
-    def add_order(self, order: OrderInfo) -> None:
-        self._orders[order.id] = order
+    def get_orders_by_release_months(self, months: Iterable[date]) -> list[OrderInfo]:
+        order_ids: set[str] = set()
+        for month in {month.replace(day=1) for month in months}:
+            order_ids |= self._ids_by_release_month.get(month, set())
+        return [self._orders[order_id].to_order_info() for order_id in order_ids]
 
-    def update_order(self, order_id: str, order: OrderInfo) -> None:
-        self._orders[order_id] = order
+    def _query_candidate_ids(self, query: OrdersQuery) -> Iterable[str]:
+        match query.order_type:
+            case OrderType.open:
+                candidate_ids: set[str] | None = self._open_ids
+            case OrderType.shipped:
+                candidate_ids = self._shipped_ids
+            case OrderType.current_month:
+                candidate_ids = {order.id for order in self._get_compact_orders(OrderType.current_month)}
+            case _:
+                candidate_ids = None
+        if query.release_from is not None or query.release_to is not None:
+            release_from = query.release_from.replace(day=1) if query.release_from else date.min
+            release_to = query.release_to or date.max
+            month_ids: set[str] = set()
+            for month, ids in self._ids_by_release_month.items():
+                if release_from <= month <= release_to:
+                    month_ids |= ids
+            candidate_ids = month_ids if candidate_ids is None else candidate_ids & month_ids
+        return self._orders.keys() if candidate_ids is None else candidate_ids
+
+    def _query_compact_orders(self, query: OrdersQuery) -> list[CompactOrder]:
+        # compact orders are immutable, so the sorted snapshot stays consistent while it is being streamed
+        orders = [self._orders[order_id] for order_id in self._query_candidate_ids(query)]
+        return sorted((order for order in orders if query.matches_order(order)), key=order_sort_key)
+
+    def query_orders(self, query: OrdersQuery) -> list[OrderInfo]:
+        return list(self.iter_orders(query))
+
+    def query_items(self, query: OrdersQuery) -> list[Item]:
+        return list(self.iter_items(query))
+
+    def iter_orders(self, query: OrdersQuery) -> Iterator[OrderInfo]:
+        for order in query.paginate(self._query_compact_orders(query)):
+            yield order.to_order_info()
+
+    def iter_items(self, query: OrdersQuery) -> Iterator[Item]:
+        items = [item for order in self._query_compact_orders(query) for item in order.items if query.matches_item(item)]
+        for item in query.paginate(items):
+            yield item.to_item()
+
+    def add_order(self, order: OrderInfo, fetched_at: datetime | None = None) -> None:
+        self.update_order(order.id, order, fetched_at)
+
+    def update_order(self, order_id: str, order: OrderInfo, fetched_at: datetime | None = None) -> None:
+        previous_order = self._orders.get(order_id)
+        if previous_order is not None:
+            self._unindex_order(previous_order)
+        compact_order = CompactOrder.from_order_info(order, fetched_at)
+        self._orders[order_id] = compact_order
+        self._index_order(compact_order)
+        self._version += 1
 
     def delete_order(self, order_id: str) -> None:
-        if order_id in self._orders:
-            del self._orders[order_id]
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self._unindex_order(order)
+            self._version += 1
+
+    def clean_up_not_existing_orders(self, existing_orders: list[str]) -> list[str]:
+        deleted = list(self._orders.keys() - set(existing_orders))
+        self.bulk_delete(deleted)
+        return deleted
 
 
 @dataclass
 class AmiAmiOrdersFileStore(AmiAmiOrdersMemoryStore):
     file_path: Path
+    compact: bool = False
+    background_load: bool = False
+    deferred_save: bool = False
+    account: str = DEFAULT_ACCOUNT_NAME  # metrics label
+    _batch_depth: int = field(default=0, init=False)
+    _dirty: bool = field(default=False, init=False)
 
     def __post_init__(self) -> None:
-        self._load()
+        if not self.background_load:
+            self.load()
 
-    def _load(self) -> None:
-        try:
-            with open(self.file_path, "rb") as file:
-                self._orders = TypeAdapter(dict[str, OrderInfo]).validate_json(file.read())
-        except FileNotFoundError:
-            logger.warning("File not found")
-        except Exception as exception:
-            logger.opt(exception=exception).error("Failed to load data from file")
+    def load(self) -> None:
+        with metrics.store_load_duration.time(account=self.account, backend="file"):
+            try:
+                with open(self.file_path, "rb") as file:
+                    orders = orders_by_id_adapter.validate_json(file.read())
+            except FileNotFoundError:
+                logger.warning("File not found")
+                return
+            except Exception as exception:
+                logger.opt(exception=exception).error("Failed to load data from file")
+                return
+            self._orders = {order_id: CompactOrder.from_order_info(order, order.fetched_at) for order_id, order in orders.items()}
+            self._rebuild_indexes()
+            self._version += 1
 
-    def _save(self) -> None:
+    def _write_orders(self, orders: dict[str, CompactOrder]) -> bool:
+        temp_file_path = self.file_path.with_name(f".{self.file_path.name}.tmp")
         try:
-            with open(self.file_path, "wb") as file:
-                file.write(TypeAdapter(dict[str, OrderInfo]).dump_json(self._orders, indent=2))
+            with metrics.store_save_duration.time(account=self.account, backend="file"):
+                records = {
+                    order_id: StoredOrderInfo.model_construct(**vars(order.to_order_info()), fetched_at=order.fetched_at)
+                    for order_id, order in orders.items()
+                }
+                data = orders_by_id_adapter.dump_json(records, indent=None if self.compact else 2)
+                # write to a temporary file and rename it, so readers never see a partially written file
+                with open(temp_file_path, "wb") as file:
+                    file.write(data)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_file_path, self.file_path)
+            metrics.store_file_size.set(len(data), account=self.account, backend="file")
+            return True
         except Exception as exception:
             logger.opt(exception=exception).error("Failed to save data to file")
+            return False
 
-    def add_order(self, order: OrderInfo) -> None:
-        super().add_order(order)
-        self._save()
+    def _save(self) -> None:
+        if self._batch_depth > 0 or self.deferred_save:
+            self._dirty = True
+            return
+        # the changes stay pending after a failed write, the next save writes them again
+        self._dirty = not self._write_orders(self._orders)
+
+    def _write_pending(self, orders: dict[str, CompactOrder]) -> bool:
+        written = self._write_orders(orders)
+        if not written:
+            # flushes are serialized, so no newer snapshot is taken before the failed one is marked pending again
+            self._dirty = True
+        return written
+
+    def take_pending_write(self) -> Callable[[], bool] | None:
+        if not self._dirty:
+            return None
+        self._dirty = False
+        # compact orders are immutable, so a shallow copy is a consistent snapshot to serialize off the store thread
+        return partial(self._write_pending, dict(self._orders))
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._dirty:
+                self._save()
 
-    def update_order(self, order_id: str, order: OrderInfo) -> None:
-        super().update_order(order_id, order)
+    def update_order(self, order_id: str, order: OrderInfo, fetched_at: datetime | None = None) -> None:
+        super().update_order(order_id, order, fetched_at)
         self._save()
 
     def delete_order(self, order_id: str) -> None:
         super().delete_order(order_id)
         self._save()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    is_open INTEGER NOT NULL,
+    scheduled_release TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    fetched_at TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_status_idx ON orders (status);
+CREATE INDEX IF NOT EXISTS orders_scheduled_release_idx ON orders (scheduled_release);
+CREATE INDEX IF NOT EXISTS orders_is_open_scheduled_release_idx ON orders (is_open, scheduled_release);
+
+CREATE TABLE IF NOT EXISTS items (
+    order_id TEXT NOT NULL REFERENCES orders (id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    scode TEXT NOT NULL,
+    name TEXT NOT NULL,
+    thumb_url TEXT NOT NULL,
+    release_date TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    in_stock_flag INTEGER NOT NULL,
+    PRIMARY KEY (order_id, id)
+);
+CREATE INDEX IF NOT EXISTS items_scode_idx ON items (scode);
+"""
+
+
+@dataclass
+class AmiAmiOrdersSqliteStore(AmiAmiOrdersStore):
+    file_path: Path
+    fetch_batch_size: int = 500
+    account: str = DEFAULT_ACCOUNT_NAME  # metrics label
+    _connection: sqlite3.Connection = field(init=False)
+    _batch_depth: int = field(default=0, init=False)
+
+    def __post_init__(self) -> None:
+        self._connection = sqlite3.connect(self.file_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA foreign_keys=ON")
+        self._connection.executescript(SQLITE_SCHEMA)
+
+    @staticmethod
+    def _order_type_condition(order_type: OrderType) -> tuple[str, tuple]:
+        match order_type:
+            case OrderType.all:
+                return "1", ()
+            case OrderType.open:
+                return "is_open = 1", ()
+            case OrderType.shipped:
+                return "is_open = 0", ()
+            case OrderType.current_month:
+                # less or equal because sometime there are delays
+                return "is_open = 1 AND scheduled_release <= ?", (date.today().isoformat(),)
+
+    @staticmethod
+    def _item_from_row(row: sqlite3.Row) -> Item:
+        return Item(
+            id=row["id"],
+            scode=row["scode"],
+            name=row["name"],
+            thumb_url=row["thumb_url"],
+            release_date=date.fromisoformat(row["release_date"]),
+            price=row["price"],
+            amount=row["amount"],
+            in_stock_flag=row["in_stock_flag"],
+        )
+
+    def _orders_from_rows(self, connection: sqlite3.Connection, order_rows: list[sqlite3.Row]) -> list[OrderInfo]:
+        if not order_rows:
+            return []
+        order_ids = [row["id"] for row in order_rows]
+        item_rows = connection.execute(
+            f"SELECT * FROM items WHERE order_id IN ({', '.join('?' * len(order_ids))}) ORDER BY order_id, position",
+            order_ids,
+        ).fetchall()
+        items: dict[str, list[Item]] = {}
+        for row in item_rows:
+            items.setdefault(row["order_id"], []).append(self._item_from_row(row))
+        return [
+            OrderInfo(
+                id=row["id"],
+                status=row["status"],
+                scheduled_release=date.fromisoformat(row["scheduled_release"]),
+                price=row["price"],
+                items=items.get(row["id"], []),
+            )
+            for row in order_rows
+        ]
+
+    def _iter_selected_orders(self, connection: sqlite3.Connection, condition: str, parameters: tuple, suffix: str = "") -> Iterator[OrderInfo]:
+        cursor = connection.execute(f"SELECT * FROM orders WHERE {condition} {suffix}", parameters)
+        while order_rows := cursor.fetchmany(self.fetch_batch_size):
+            yield from self._orders_from_rows(connection, order_rows)
+
+    def _select_orders(self, condition: str, parameters: tuple, suffix: str = "") -> list[OrderInfo]:
+        return list(self._iter_selected_orders(self._connection, condition, parameters, suffix))
+
+    @contextmanager
+    def _snapshot(self) -> Iterator[sqlite3.Connection]:
+        # a stream is read over many store calls and syncs write in between,
+        # a read transaction on a connection of its own keeps the whole stream on one WAL snapshot
+        connection = sqlite3.connect(f"{self.file_path.resolve().as_uri()}?mode=ro", uri=True, isolation_level=None, check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("BEGIN")
+            yield connection
+        finally:
+            connection.close()
+
+    def _query_condition(self, query: OrdersQuery) -> tuple[str, tuple]:
+        condition, order_type_parameters = self._order_type_condition(query.order_type)
+        conditions = [condition]
+        parameters: list = list(order_type_parameters)
+        if query.release_from is not None:
+            conditions.append("scheduled_release >= ?")
+            parameters.append(query.release_from.isoformat())
+        if query.release_to is not None:
+            conditions.append("scheduled_release <= ?")
+            parameters.append(query.release_to.isoformat())
+        if query.status is not None:
+            conditions.append("status = ? COLLATE NOCASE")
+            parameters.append(query.status)
+        if query.search is not None:
+            conditions.append("id IN (SELECT order_id FROM items WHERE instr(lower(name), lower(?)) > 0)")
+            parameters.append(query.search)
+        return " AND ".join(conditions), tuple(parameters)
+
+    @staticmethod
+    def _pagination_suffix(query: OrdersQuery) -> tuple[str, tuple]:
+        if query.limit is None and not query.offset:
+            return "", ()
+        return "LIMIT ? OFFSET ?", (-1 if query.limit is None else query.limit, query.offset)
+
+    def _query_orders(self, connection: sqlite3.Connection, query: OrdersQuery) -> Iterator[OrderInfo]:
+        condition, parameters = self._query_condition(query)
+        pagination, pagination_parameters = self._pagination_suffix(query)
+        yield from self._iter_selected_orders(
+            connection, condition, parameters + pagination_parameters, f"ORDER BY scheduled_release, id {pagination}"
+        )
+
+    def _query_items(self, connection: sqlite3.Connection, query: OrdersQuery) -> Iterator[Item]:
+        condition, parameters = self._query_condition(query)
+        item_condition = ""
+        if query.search is not None:
+            item_condition = "AND instr(lower(items.name), lower(?)) > 0"
+            parameters += (query.search,)
+        pagination, pagination_parameters = self._pagination_suffix(query)
+        cursor = connection.execute(
+            f"SELECT items.* FROM items JOIN orders ON orders.id = items.order_id "
+            f"WHERE orders.id IN (SELECT id FROM orders WHERE {condition}) {item_condition} "
+            f"ORDER BY orders.scheduled_release, orders.id, items.position {pagination}",
+            parameters + pagination_parameters,
+        )
+        while rows := cursor.fetchmany(self.fetch_batch_size):
+            for row in rows:
+                yield self._item_from_row(row)
+
+    def query_orders(self, query: OrdersQuery) -> list[OrderInfo]:
+        return list(self._query_orders(self._connection, query))
+
+    def query_items(self, query: OrdersQuery) -> list[Item]:
+        return list(self._query_items(self._connection, query))
+
+    def iter_orders(self, query: OrdersQuery) -> Iterator[OrderInfo]:
+        with self._snapshot() as connection:
+            yield from self._query_orders(connection, query)
+
+    def iter_items(self, query: OrdersQuery) -> Iterator[Item]:
+        with self._snapshot() as connection:
+            yield from self._query_items(connection, query)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        if self._batch_depth > 0:
+            yield
+            return
+        with metrics.store_save_duration.time(account=self.account, backend="sqlite"):
+            with self._connection:
+                yield
+        metrics.store_file_size.set(os.path.getsize(self.file_path), account=self.account, backend="sqlite")
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        with self._transaction():
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+
+    def get_order(self, order_id: str) -> OrderInfo | None:
+        orders = self._select_orders("id = ?", (order_id,))
+        return orders[0] if orders else None
+
+    def get_orders(self, order_type: OrderType = OrderType.all) -> list[OrderInfo]:
+        return self._select_orders(*self._order_type_condition(order_type))
+
+    def count_orders(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    def get_fetched_at(self, order_ids: Iterable[str]) -> dict[str, datetime]:
+        order_ids = list(order_ids)
+        fetched_at: dict[str, datetime] = {}
+        # in batches, to stay below the sqlite limit of query parameters
+        for start in range(0, len(order_ids), self.fetch_batch_size):
+            batch_ids = order_ids[start : start + self.fetch_batch_size]
+            rows = self._connection.execute(
+                f"SELECT id, fetched_at FROM orders WHERE id IN ({', '.join('?' * len(batch_ids))}) AND fetched_at IS NOT NULL",
+                batch_ids,
+            )
+            fetched_at |= {row["id"]: datetime.fromisoformat(row["fetched_at"]) for row in rows}
+        return fetched_at
+
+    def _upsert_order(self, order: OrderInfo, fetched_at: datetime | None) -> None:
+        self._version += 1
+        self._connection.execute(
+            "INSERT INTO orders (id, status, is_open, scheduled_release, price, fetched_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET status = excluded.status, is_open = excluded.is_open, "
+            "scheduled_release = excluded.scheduled_release, price = excluded.price, fetched_at = excluded.fetched_at",
+            (
+                order.id,
+                order.status,
+                int(order.is_open),  # type: ignore[call-overload]
+                order.scheduled_release.isoformat(),
+                order.price,
+                fetched_at.isoformat() if fetched_at else None,
+            ),
+        )
+        self._connection.execute("DELETE FROM items WHERE order_id = ?", (order.id,))
+        self._connection.executemany(
+            "INSERT INTO items (order_id, id, position, scode, name, thumb_url, release_date, price, amount, in_stock_flag) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    order.id,
+                    item.id,
+                    position,
+                    item.scode,
+                    item.name,
+                    item.thumb_url,
+                    item.release_date.isoformat(),
+                    item.price,
+                    item.amount,
+                    item.in_stock_flag,
+                )
+                for position, item in enumerate(order.items)
+            ],
+        )
+
+    def add_order(self, order: OrderInfo, fetched_at: datetime | None = None) -> None:
+        with self._transaction():
+            self._upsert_order(order, fetched_at)
+
+    def update_order(self, order_id: str, order: OrderInfo, fetched_at: datetime | None = None) -> None:
+        with self._transaction():
+            self._upsert_order(order, fetched_at)
+
+    def delete_order(self, order_id: str) -> None:
+        self.bulk_delete([order_id])
+
+    def get_orders_by_release_months(self, months: Iterable[date]) -> list[OrderInfo]:
+        month_starts = sorted({month.replace(day=1) for month in months})
+        if not month_starts:
+            return []
+        condition = " OR ".join(["(scheduled_release >= ? AND scheduled_release < ?)"] * len(month_starts))
+        parameters: list[str] = []
+        for month in month_starts:
+            parameters += [month.isoformat(), utils.next_month_start(month).isoformat()]
+        return self._select_orders(condition, tuple(parameters))
+
+    def bulk_delete(self, order_ids: Iterable[str]) -> None:
+        parameters = [(order_id,) for order_id in order_ids]
+        if not parameters:
+            return
+        with self._transaction():
+            deleted = self._connection.executemany("DELETE FROM orders WHERE id = ?", parameters).rowcount
+        # like the memory store, deleting nothing is not a change and keeps the caches derived from the version
+        if deleted > 0:
+            self._version += 1
+
+    def clean_up_not_existing_orders(self, existing_orders: list[str]) -> list[str]:
+        stored_ids = {row[0] for row in self._connection.execute("SELECT id FROM orders")}
+        deleted = sorted(stored_ids - set(existing_orders))
+        self.bulk_delete(deleted)
+        return deleted
@@ -0,0 +1,139 @@
+import asyncio
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from enum import Enum
+
+from loguru import logger
+from pydantic import BaseModel
+
+from amiami_api.api import OrderType
+from amiami_api.config import DEFAULT_ACCOUNT_NAME
+from amiami_api.service import AmiamiService
+
+
+class SyncJobStatus(str, Enum):
+    pending = "pending"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+    cancelled = "cancelled"
+
+
+class SyncJobResult(BaseModel):
+    orders: int
+    fetched: int
+    skipped: int
+    deleted: int
+    failed: int
+
+
+class SyncJob(BaseModel):
+    id: str
+    account: str = DEFAULT_ACCOUNT_NAME
+    order_type: OrderType
+    force: bool = False
+    status: SyncJobStatus = SyncJobStatus.pending
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+    result: SyncJobResult | None = None
+    error: str | None = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (SyncJobStatus.pending, SyncJobStatus.running)
+
+    def covers(self, order_type: OrderType, force: bool) -> bool:
+        if force and not self.force:
+            return False
+        return self.order_type in (OrderType.all, order_type)
+
+
+@dataclass
+class SyncScheduler:
+    service: AmiamiService
+    open_interval: timedelta | None = None
+    full_interval: timedelta | None = None
+    max_jobs_history: int = 50
+    _lock: asyncio.Lock = field(default_factory=asyncio.Lock, init=False)
+    _jobs: dict[str, SyncJob] = field(default_factory=dict, init=False)
+    _job_tasks: dict[str, asyncio.Task] = field(default_factory=dict, init=False)
+    _periodic_tasks: list[asyncio.Task] = field(default_factory=list, init=False)
+
+    def get_job(self, job_id: str) -> SyncJob | None:
+        return self._jobs.get(job_id)
+
+    def trigger(self, order_type: OrderType, force: bool = False) -> SyncJob:
+        # coalesce with an already queued or running sync that covers the requested one
+        for job in reversed(self._jobs.values()):
+            if job.is_active and job.covers(order_type, force):
+                return job
+
+        job = SyncJob(id=uuid.uuid4().hex, account=self.service.account, order_type=order_type, force=force, created_at=datetime.now())
+        self._jobs[job.id] = job
+        finished_jobs = [finished_job for finished_job in self._jobs.values() if not finished_job.is_active]
+        for finished_job in finished_jobs[: max(len(self._jobs) - self.max_jobs_history, 0)]:
+            del self._jobs[finished_job.id]
+        self._job_tasks[job.id] = asyncio.create_task(self._run_job(job))
+        return job
+
+    async def wait(self, job: SyncJob) -> SyncJob:
+        task = self._job_tasks.get(job.id)
+        if task is not None:
+            await asyncio.shield(task)
+        return job
+
+    async def run(self, order_type: OrderType, force: bool = False) -> SyncJob:
+        return await self.wait(self.trigger(order_type, force))
+
+    async def _run_job(self, job: SyncJob) -> None:
+        try:
+            # the lock keeps syncs from overlapping
+            async with self._lock:
+                job.status = SyncJobStatus.running
+                job.started_at = datetime.now()
+                logger.info(f"Sync job {job.id} started: {job.order_type.value}")
+                result = await self.service.update_orders(job.order_type, force=job.force)
+                job.result = SyncJobResult(
+                    orders=len(result.orders),
+                    fetched=result.fetched,
+                    skipped=result.skipped,
+                    deleted=result.deleted,
+                    failed=result.failed,
+                )
+                job.status = SyncJobStatus.succeeded
+        except asyncio.CancelledError:
+            # e.g. at shutdown, the job must not stay active forever
+            logger.warning(f"Sync job {job.id} cancelled")
+            job.status = SyncJobStatus.cancelled
+            job.error = "Sync cancelled"
+            raise
+        except Exception as exception:
+            logger.opt(exception=exception).error(f"Sync job {job.id} failed")
+            job.status = SyncJobStatus.failed
+            job.error = str(exception)
+        finally:
+            job.finished_at = datetime.now()
+            self._job_tasks.pop(job.id, None)
+
+    async def _run_periodically(self, order_type: OrderType, interval: timedelta, phase: float) -> None:
+        await asyncio.sleep(interval.total_seconds() * phase)
+        while True:
+            await asyncio.sleep(interval.total_seconds())
+            job = await self.run(order_type)
+            logger.info(f"Scheduled {order_type.value} sync finished: {job.status.value}")
+
+    def start(self, phase: float = 0) -> None:
+        """Start periodic syncs, the first ones are delayed by a phase fraction of their intervals."""
+        if self.open_interval:
+            self._periodic_tasks.append(asyncio.create_task(self._run_periodically(OrderType.open, self.open_interval, phase)))
+        if self.full_interval:
+            self._periodic_tasks.append(asyncio.create_task(self._run_periodically(OrderType.all, self.full_interval, phase)))
+
+    async def stop(self) -> None:
+        tasks = self._periodic_tasks + list(self._job_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._periodic_tasks.clear()
@@ -1,14 +1,44 @@
+import asyncio
+import itertools
 import math
-from typing import Any, Iterable
+import secrets
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Hashable, Iterable
 
 import telegramify_markdown
 from dependency_injector.wiring import Provide, inject
-from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes, ExtBot, JobQueue
+from loguru import logger
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import (
+    Application,
+    CallbackQueryHandler,
+    CommandHandler,
+    ContextTypes,
+    ExtBot,
+    JobQueue,
+)
 
+from amiami_api.accounts import AccountOrderInfo, Accounts
 from amiami_api.api import OrderInfo, OrderType
+from amiami_api.config import DEFAULT_ACCOUNT_NAME
+from amiami_api.events import EventBus, OrderEvent, OrderEventType
 from amiami_api.fx_rates import FxRatesService
-from amiami_api.service import AmiamiService
+from amiami_api.store import OrdersQuery
+from amiami_api.sync import SyncJob
+
+SUBSCRIBED_CHAT_IDS_KEY = "subscribed_chat_ids"
+EVENT_PUSH_TASK_KEY = "event_push_task"
+EVENT_PUSH_WAIT_SECONDS = 60
+MAX_PUSHED_EVENTS = 30
+ORDER_RENDER_CACHE_KEY = "order_render_cache"
+ORDER_LISTINGS_KEY = "order_listings"
+MAX_ORDER_LISTINGS = 10
+ORDERS_PAGE_PREFIX = "orders"
+ORDERS_PAGE_NOOP = "orders:noop"
+TELEGRAM_MESSAGE_LIMIT = 4096
+ORDER_SEPARATOR = "\n" + telegramify_markdown.markdownify("---").strip() + "\n\n"
+
 
 @inject
 def format_order(order: OrderInfo, jpy_to_usd_rate: float) -> str:
@@ -27,61 +57,260 @@ def format_order(order: OrderInfo, jpy_to_usd_rate: float) -> str:
     return f"{title}{items}"
 
 
-async def format_orders(orders: Iterable[OrderInfo], fx_rates_service: FxRatesService = Provide["fx_rates_service"]) -> str:
-    sorted_orders = sorted(orders, key=lambda o: o.scheduled_release)
+def render_markdown(text: str) -> str:
+    # blocks are rendered separately and joined afterwards, so without the trailing line break
+    return telegramify_markdown.markdownify(text).rstrip("\n")
+
+
+def message_length(text: str) -> int:
+    # telegram counts the message limit in utf-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_text(text: str, limit: int) -> list[str]:
+    """Split the text at line breaks into parts that fit the limit, an overlong line is cut."""
+    parts: list[str] = []
+    part = ""
+    for line in text.split("\n"):
+        while message_length(line) > limit:
+            cut = limit
+            while message_length(line[:cut]) > limit:
+                cut -= 1
+            if part:
+                parts.append(part)
+                part = ""
+            parts.append(line[:cut])
+            line = line[cut:]
+        if part and message_length(part) + 1 + message_length(line) > limit:
+            parts.append(part)
+            part = line
+        else:
+            part = f"{part}\n{line}" if part else line
+    if part:
+        parts.append(part)
+    return parts
+
+
+def paginate_blocks(header: str, sections: list[tuple[str | None, list[str]]], limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """Pack rendered blocks into messages within the limit, section headings are repeated on every page the section spans."""
+    pages: list[str] = []
+    page = header
+    # blocks are split to fit below the header and the heading, so the first page never holds the header alone
+    header_length = message_length(f"{header}\n\n") if header else 0
+    for heading, blocks in sections:
+        heading_prefix = f"{heading}\n\n" if heading else ""
+        section_on_page = False
+        for block in blocks:
+            for part_index, part in enumerate(split_text(block, limit - header_length - message_length(heading_prefix))):
+                separator = ("\n" if part_index else ORDER_SEPARATOR) if section_on_page else "\n\n"
+                addition = part if section_on_page else heading_prefix + part
+                if page and message_length(page) + message_length(separator) + message_length(addition) > limit:
+                    pages.append(page)
+                    page, separator, addition = "", "", heading_prefix + part
+                page = f"{page}{separator}{addition}" if page else addition
+                section_on_page = True
+    if page:
+        pages.append(page)
+    return pages
+
+
+def order_version(order: OrderInfo) -> Hashable:
+    # the fields format_order renders, far cheaper to compare than rendering the order again
+    items = tuple((item.id, item.scode, item.name, item.price, item.in_stock_flag) for item in order.items)
+    return order.status, order.scheduled_release, order.price, items
+
+
+@dataclass
+class OrderRenderCache:
+    """Rendered MarkdownV2 order blocks, an order is rendered again only after its rendered fields or the fx rate change."""
+
+    max_entries: int = 1024
+    _entries: dict[Hashable, str] = field(default_factory=dict, init=False)
+
+    def render(self, order: AccountOrderInfo, jpy_to_usd_rate: float) -> str:
+        key = (order.account, order.id, order_version(order), jpy_to_usd_rate)
+        rendered = self._entries.get(key)
+        if rendered is None:
+            rendered = render_markdown(format_order(order, jpy_to_usd_rate))
+            if len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = rendered
+        return rendered
+
+
+async def render_order_pages(
+    title: str,
+    orders: Iterable[AccountOrderInfo],
+    render_cache: OrderRenderCache,
+    fx_rates_service: FxRatesService = Provide["fx_rates_service"],
+) -> list[str]:
+    sorted_orders = sorted(orders, key=lambda o: (o.account, o.scheduled_release))
     jpy_to_usd_rate = await fx_rates_service.get_jpy_to_usd_rate()
-    return "\n---\n\n".join([format_order(o, jpy_to_usd_rate) for o in sorted_orders])
+    grouped_orders = [(account, list(account_orders)) for account, account_orders in itertools.groupby(sorted_orders, key=lambda o: o.account)]
+    sections = [
+        # orders of several accounts are grouped under the account names
+        (
+            render_markdown(f"## {account}") if len(grouped_orders) > 1 else None,
+            [render_cache.render(order, jpy_to_usd_rate) for order in account_orders],
+        )
+        for account, account_orders in grouped_orders
+    ]
+    return paginate_blocks(render_markdown(f"# {title}"), sections)
+
+
+def page_keyboard(listing_id: str, page: int, pages_count: int) -> InlineKeyboardMarkup:
+    buttons = [InlineKeyboardButton(f"{page + 1}/{pages_count}", callback_data=ORDERS_PAGE_NOOP)]
+    if page > 0:
+        buttons.insert(0, InlineKeyboardButton("◀", callback_data=f"{ORDERS_PAGE_PREFIX}:{listing_id}:{page - 1}"))
+    if page < pages_count - 1:
+        buttons.append(InlineKeyboardButton("▶", callback_data=f"{ORDERS_PAGE_PREFIX}:{listing_id}:{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+
+async def reply_orders(update: Update, context: ContextTypes.DEFAULT_TYPE, title: str, orders: list[AccountOrderInfo]) -> None:
+    """Send the first page of the orders, the rest is browsed with the inline keyboard."""
+    assert update.message is not None and context.chat_data is not None
+    pages = await render_order_pages(title, orders, context.application.bot_data[ORDER_RENDER_CACHE_KEY])
+    if len(pages) == 1:
+        await update.message.reply_markdown_v2(pages[0])
+        return
+    # pages are kept as rendered, browsing shows the orders as they were when the command ran
+    listings: dict[str, list[str]] = context.chat_data.setdefault(ORDER_LISTINGS_KEY, {})
+    if len(listings) >= MAX_ORDER_LISTINGS:
+        del listings[next(iter(listings))]
+    listing_id = secrets.token_hex(4)
+    listings[listing_id] = pages
+    await update.message.reply_markdown_v2(pages[0], reply_markup=page_keyboard(listing_id, 0, len(pages)))
+
+
+async def show_orders_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    assert query is not None and query.data is not None and context.chat_data is not None
+    if query.data == ORDERS_PAGE_NOOP:
+        await query.answer()
+        return
+    _, listing_id, page = query.data.split(":")
+    pages = context.chat_data.get(ORDER_LISTINGS_KEY, {}).get(listing_id)
+    if pages is None:
+        await query.answer("This list has expired, run the command again.")
+        return
+    await query.answer()
+    await query.edit_message_text(pages[int(page)], parse_mode="MarkdownV2", reply_markup=page_keyboard(listing_id, int(page), len(pages)))
+
+
+def format_event(event: OrderEvent) -> str:
+    account = "" if event.account == DEFAULT_ACCOUNT_NAME else f"{event.account}: "
+    order = f"{account}Order {event.order_id}"
+    match event.type:
+        case OrderEventType.order_added:
+            return f"{order}: new, {event.new}"
+        case OrderEventType.order_removed:
+            return f"{order}: removed"
+        case OrderEventType.status_changed:
+            return f"{order}: {event.old} → {event.new}"
+        case OrderEventType.release_changed:
+            assert isinstance(event.old, date) and isinstance(event.new, date)
+            return f"{order}: release moved from {event.old.strftime('%b %Y')} to {event.new.strftime('%b %Y')}"
+        case OrderEventType.price_changed:
+            return f"{order}: price {event.old}¥ → {event.new}¥"
+        case OrderEventType.item_release_changed:
+            assert isinstance(event.old, date) and isinstance(event.new, date)
+            return f"{order}: item {event.item_id} release moved from {event.old.strftime('%b %Y')} to {event.new.strftime('%b %Y')}"
+        case OrderEventType.item_stock_changed:
+            stock = "in stock ✅" if isinstance(event.new, int) and event.new > 0 else "out of stock ❌"
+            return f"{order}: item {event.item_id} is {stock}"
+
+
+def format_job_prefix(job: SyncJob, jobs: list[SyncJob]) -> str:
+    return f"{job.account}: " if len(jobs) > 1 else ""
+
+
+async def select_accounts(update: Update, context: ContextTypes.DEFAULT_TYPE, accounts: Accounts) -> Accounts | None:
+    # commands take an optional account name argument, all the accounts are used without it
+    assert update.message is not None
+    name = context.args[0] if context.args else None
+    selected = accounts.select(name)
+    if selected is None:
+        await update.message.reply_text(f"Unknown account {name}, available accounts: {', '.join(accounts.names)}")
+    return selected
 
 
 @inject
-async def update_open(update: Update, context: ContextTypes.DEFAULT_TYPE, service: AmiamiService = Provide["service"]) -> None:
+async def update_open(update: Update, context: ContextTypes.DEFAULT_TYPE, accounts: Accounts = Provide["accounts"]) -> None:
     assert update.message is not None
+    selected = await select_accounts(update, context, accounts)
+    if selected is None:
+        return
     await update.message.reply_text("Updating open orders...")
-    await service.update_orders(order_type=OrderType.open)
-    await update.message.reply_text("Open orders updated.")
+    jobs = await selected.run(order_type=OrderType.open)
+    for job in jobs:
+        if job.result is None:
+            await update.message.reply_text(f"{format_job_prefix(job, jobs)}Open orders update failed: {job.error}")
+        else:
+            await update.message.reply_text(f"{format_job_prefix(job, jobs)}Open orders updated.")
 
 
 @inject
-async def full_update(update: Update, context: ContextTypes.DEFAULT_TYPE, service: AmiamiService = Provide["service"]) -> None:
+async def full_update(update: Update, context: ContextTypes.DEFAULT_TYPE, accounts: Accounts = Provide["accounts"]) -> None:
     assert update.message is not None
+    selected = await select_accounts(update, context, accounts)
+    if selected is None:
+        return
     await update.message.reply_text("Full update (all orders)...")
-    orders = await service.update_orders(order_type=OrderType.all)
-    await update.message.reply_text(f"All orders updated: {len(orders)} orders found.")
+    jobs = await selected.run(order_type=OrderType.all)
+    for job in jobs:
+        if job.result is None:
+            await update.message.reply_text(f"{format_job_prefix(job, jobs)}Full update failed: {job.error}")
+            continue
+        await update.message.reply_text(
+            f"{format_job_prefix(job, jobs)}All orders updated: {job.result.orders} orders found "
+            f"({job.result.fetched} fetched, {job.result.skipped} unchanged, {job.result.deleted} deleted, {job.result.failed} failed)."
+        )
 
 
 @inject
-async def show_current_orders(update: Update, context: ContextTypes.DEFAULT_TYPE, service: AmiamiService = Provide["service"]):
+async def show_current_orders(update: Update, context: ContextTypes.DEFAULT_TYPE, accounts: Accounts = Provide["accounts"]):
     assert update.message is not None
-    orders = await service.get_current_orders()
+    selected = await select_accounts(update, context, accounts)
+    if selected is None:
+        return
+    orders = await selected.get_current_orders()
     if not orders:
         await update.message.reply_text("No current orders.")
         return
-    message = "# Current orders\n\n" + await format_orders(orders)
-    await update.message.reply_markdown_v2(telegramify_markdown.markdownify(message))
+    await reply_orders(update, context, "Current orders", orders)
 
 
 @inject
-async def show_open(update: Update, context: ContextTypes.DEFAULT_TYPE, service: AmiamiService = Provide["service"]):
+async def show_open(update: Update, context: ContextTypes.DEFAULT_TYPE, accounts: Accounts = Provide["accounts"]):
     assert update.message is not None
-    orders = await service.get_orders(order_type=OrderType.open)
+    selected = await select_accounts(update, context, accounts)
+    if selected is None:
+        return
+    orders = await selected.query_orders(OrdersQuery(order_type=OrderType.open))
     if not orders:
         await update.message.reply_text("No open orders.")
         return
-    message = "# Open orders\n\n" + await format_orders(orders)
-    await update.message.reply_markdown_v2(telegramify_markdown.markdownify(message))
+    await reply_orders(update, context, "Open orders", orders)
 
 
 @inject
-async def update_and_show_current(update: Update, context: ContextTypes.DEFAULT_TYPE, service: AmiamiService = Provide["service"]):
+async def update_and_show_current(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    accounts: Accounts = Provide["accounts"],
+):
     assert update.message is not None
+    selected = await select_accounts(update, context, accounts)
+    if selected is None:
+        return
     await update.message.reply_text("Updating and showing current month orders...")
-    await service.update_orders(order_type=OrderType.current_month)
-    orders = await service.get_current_orders()
+    await selected.run(order_type=OrderType.current_month)
+    orders = await selected.get_current_orders()
     if not orders:
         await update.message.reply_text("No current orders.")
         return
-    message = "# Current orders\n\n" + await format_orders(orders)
-    await update.message.reply_markdown_v2(telegramify_markdown.markdownify(message))
+    await reply_orders(update, context, "Current orders", orders)
 
 
 async def help(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -94,6 +323,8 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "- /show_current - Show current month orders\n"
         "- /show_open - Show open orders\n"
         "- /update_and_show_current - Update and show current month orders\n"
+        "\n"
+        "Commands apply to all accounts, or to one when its name is given, e.g. `/show_open main`.\n"
     )
     await update.message.reply_markdown_v2(telegramify_markdown.markdownify(text))
 
@@ -115,11 +346,39 @@ async def start(
             text="You are not allowed to use this bot. Please contact the administrator.",
         )
         return
+    # allowed chats get order change notifications until the bot restarts
+    assert update.effective_chat is not None
+    context.application.bot_data.setdefault(SUBSCRIBED_CHAT_IDS_KEY, set()).add(update.effective_chat.id)
     await update.message.reply_text(
         text="Hello! Now I'm running!",
     )
 
 
+@inject
+async def push_events(
+    application: Application,
+    events: EventBus = Provide["events"],
+    white_list: list[str] = Provide["config.telegram_bot_white_list"],
+) -> None:
+    after_id = events.last_id
+    while True:
+        new_events = await events.wait_for_events(after_id, EVENT_PUSH_WAIT_SECONDS)
+        if not new_events:
+            continue
+        after_id = new_events[-1].id
+        lines = [f"- {format_event(event)}" for event in new_events[:MAX_PUSHED_EVENTS]]
+        if len(new_events) > MAX_PUSHED_EVENTS:
+            lines.append(f"- ... and {len(new_events) - MAX_PUSHED_EVENTS} more changes")
+        text = telegramify_markdown.markdownify("# Order updates\n\n" + "\n".join(lines))
+        # private chat ids are the user ids, usernames can only be reached after they have started the bot
+        chat_ids = {int(user) for user in white_list if user.isdigit()} | application.bot_data.get(SUBSCRIBED_CHAT_IDS_KEY, set())
+        for chat_id in chat_ids:
+            try:
+                await application.bot.send_message(chat_id, text, parse_mode="MarkdownV2")
+            except Exception as exception:
+                logger.opt(exception=exception).warning(f"Failed to push order updates to chat {chat_id}")
+
+
 def create_bot(
     token: str,
 ) -> Application[ExtBot[None], ContextTypes.DEFAULT_TYPE, dict[Any, Any], dict[Any, Any], dict[Any, Any], JobQueue[ContextTypes.DEFAULT_TYPE]]:
@@ -131,4 +390,26 @@ def create_bot(
     application.add_handler(CommandHandler("show_open", show_open))
     application.add_handler(CommandHandler("update_and_show_current", update_and_show_current))
     application.add_handler(CommandHandler("help", help))
+    application.add_handler(CallbackQueryHandler(show_orders_page, pattern=f"^{ORDERS_PAGE_PREFIX}:"))
+    application.bot_data[ORDER_RENDER_CACHE_KEY] = OrderRenderCache()
     return application
+
+
+async def start_bot(application: Application) -> None:
+    await application.initialize()
+    await application.start()
+    assert application.updater is not None
+    await application.updater.start_polling()
+    application.bot_data[EVENT_PUSH_TASK_KEY] = asyncio.create_task(push_events(application))
+
+
+async def stop_bot(application: Application) -> None:
+    push_task = application.bot_data.pop(EVENT_PUSH_TASK_KEY, None)
+    if push_task is not None:
+        push_task.cancel()
+        await asyncio.gather(push_task, return_exceptions=True)
+    if application.updater is not None and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await application.shutdown()
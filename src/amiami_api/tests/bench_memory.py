@@ -0,0 +1,81 @@
+import gc
+import tracemalloc
+from datetime import date, timedelta
+from typing import Any, Callable, Iterator
+
+from amiami_api.api import Item, OrderInfo
+from amiami_api.store import AmiAmiOrdersMemoryStore
+
+ORDERS_COUNT = 10_000
+ITEMS_PER_ORDER = 2
+STATUSES = ["Order Processing", "Shipped", "Payment Pending", "Order Canceled"]
+
+
+def make_order(index: int) -> OrderInfo:
+    release = date(2020, 1, 1) + timedelta(days=index % 2000)
+    items = []
+    for item_index in range(ITEMS_PER_ORDER):
+        scode = f"FIGURE-{index * ITEMS_PER_ORDER + item_index:06d}"
+        items.append(
+            Item(
+                id=f"{index}-{item_index}",
+                scode=scode,
+                name=f"Figure {index}-{item_index} 1/7 Complete Figure",
+                thumb_url=f"https://img.amiami.com/images/product/thumb300/{scode}.jpg",
+                release_date=release,
+                price=15000 + item_index,
+                amount=1,
+                in_stock_flag=0,
+            )
+        )
+    return OrderInfo(
+        id=f"{index:08d}",
+        status=STATUSES[index % len(STATUSES)],
+        scheduled_release=release,
+        price=sum(item.price for item in items),
+        items=items,
+    )
+
+
+def measure(build: Callable[[list[OrderInfo]], Any], orders: list[OrderInfo]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build(orders)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del result
+    return after - before
+
+
+def copy_orders(orders: list[OrderInfo]) -> Iterator[OrderInfo]:
+    # fresh copies so that the measured structure owns its strings like after loading the file store
+    for order in orders:
+        yield OrderInfo.model_validate_json(order.model_dump_json())
+
+
+def build_pydantic(orders: list[OrderInfo]) -> dict[str, OrderInfo]:
+    return {order.id: order for order in copy_orders(orders)}
+
+
+def build_compact(orders: list[OrderInfo]) -> AmiAmiOrdersMemoryStore:
+    store = AmiAmiOrdersMemoryStore()
+    store.bulk_update(copy_orders(orders))
+    return store
+
+
+def main() -> None:
+    orders = [make_order(index) for index in range(ORDERS_COUNT)]
+    pydantic_bytes = measure(build_pydantic, orders)
+    compact_bytes = measure(build_compact, orders)
+    print(f"{ORDERS_COUNT} orders, {ITEMS_PER_ORDER} items each")
+    print(f"pydantic OrderInfo: {pydantic_bytes / ORDERS_COUNT:8.0f} bytes/order")
+    print(f"compact store:      {compact_bytes / ORDERS_COUNT:8.0f} bytes/order (indexes included)")
+    print(f"ratio:              {pydantic_bytes / compact_bytes:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import json
+import os
+import platform
+import statistics
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+import pytest
+
+from amiami_api.api import AmiAmiApi
+from amiami_api.http_client import HttpClient
+from amiami_api.tests.fake_amiami import FakeAccount, FakeAmiAmiServer
+from amiami_api.web import create_app
+
+BENCHMARK_RESULTS_PATH = Path(os.environ["AMIAMI_BENCHMARK_RESULTS"]) if os.environ.get("AMIAMI_BENCHMARK_RESULTS") else None
+
+_benchmark_results: list["BenchmarkResult"] = []
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    rounds: int
+    min: float
+    max: float
+    mean: float
+    median: float
+    stddev: float
+    extra_info: dict[str, Any]
+
+
+@dataclass
+class Benchmark:
+    """Minimal pytest-benchmark style timer, results are written to BENCHMARK_RESULTS_PATH, when it is set, at the end of the session."""
+
+    name: str
+    rounds: int = 5
+    extra_info: dict[str, Any] = field(default_factory=dict)
+    _timings: list[float] = field(default_factory=list, init=False)
+
+    def __call__(self, function: Callable[..., Any], *args: Any, setup: Callable[[], Any] | None = None, **kwargs: Any) -> Any:
+        result = None
+        for _ in range(self.rounds):
+            if setup is not None:
+                setup()
+            started_at = time.perf_counter()
+            result = function(*args, **kwargs)
+            self._timings.append(time.perf_counter() - started_at)
+        self._record()
+        return result
+
+    async def run_async(
+        self,
+        function: Callable[..., Awaitable[Any]],
+        *args: Any,
+        setup: Callable[[], Awaitable[Any]] | None = None,
+        **kwargs: Any,
+    ) -> Any:
+        result = None
+        for _ in range(self.rounds):
+            if setup is not None:
+                await setup()
+            started_at = time.perf_counter()
+            result = await function(*args, **kwargs)
+            self._timings.append(time.perf_counter() - started_at)
+        self._record()
+        return result
+
+    def _record(self) -> None:
+        _benchmark_results.append(
+            BenchmarkResult(
+                name=self.name,
+                rounds=len(self._timings),
+                min=min(self._timings),
+                max=max(self._timings),
+                mean=statistics.mean(self._timings),
+                median=statistics.median(self._timings),
+                stddev=statistics.stdev(self._timings) if len(self._timings) > 1 else 0,
+                extra_info=self.extra_info,
+            )
+        )
+        self._timings = []
+
+
+@pytest.fixture
+def benchmark(request: pytest.FixtureRequest) -> Benchmark:
+    return Benchmark(name=request.node.nodeid)
+
+
+def pytest_sessionfinish(session: pytest.Session, exitstatus: int) -> None:
+    if not _benchmark_results or BENCHMARK_RESULTS_PATH is None:
+        return
+    report = {
+        "datetime": datetime.now().isoformat(),
+        "machine_info": {"python": platform.python_version(), "platform": platform.platform()},
+        "benchmarks": [asdict(result) for result in _benchmark_results],
+    }
+    BENCHMARK_RESULTS_PATH.write_text(json.dumps(report, indent=2))
+
+
+@pytest.fixture
+async def fake_amiami() -> AsyncIterator[Callable[..., Awaitable[FakeAmiAmiServer]]]:
+    servers: list[FakeAmiAmiServer] = []
+
+    async def start(account: FakeAccount, **kwargs: Any) -> FakeAmiAmiServer:
+        server = FakeAmiAmiServer(account, **kwargs)
+        await server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        await server.close()
+
+
+@pytest.fixture
+async def http_client() -> AsyncIterator[HttpClient]:
+    client = HttpClient()
+    yield client
+    await client.close()
+
+
+@pytest.fixture
+def make_api(http_client: HttpClient) -> Callable[..., AmiAmiApi]:
+    def make(server: FakeAmiAmiServer, **kwargs: Any) -> AmiAmiApi:
+        # no client side rate limit, the fake server is local
+        kwargs.setdefault("requests_per_second", 0)
+        kwargs.setdefault("retry_backoff_seconds", 0)
+        return AmiAmiApi(username="user", password="password", api_root_url=server.api_root_url, http_client=http_client, **kwargs)
+
+    return make
+
+
+@pytest.fixture(scope="module")
+def web_app(tmp_path_factory: pytest.TempPathFactory) -> Any:
+    # the app reads its settings and serves the frontend build directory
+    directory = tmp_path_factory.mktemp("web")
+    (directory / "frontend" / "dist").mkdir(parents=True)
+    environment = {
+        "AMIAMI_LOGIN": "user",
+        "AMIAMI_PASSWORD": "password",
+        "FX_RATES_ACCESS_KEY": "key",
+        "AMIAMI_STORE_FILE_PATH": str(directory / "orders.json"),
+    }
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for key, value in environment.items():
+            monkeypatch.setenv(key, value)
+        monkeypatch.chdir(directory)
+        yield create_app()
@@ -0,0 +1,149 @@
+import asyncio
+import random
+import secrets
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+FAKE_STATUSES = ["Order Processing", "Payment Pending", "Shipped", "Cancelled"]
+
+
+@dataclass
+class FakeAccount:
+    """Synthetic AmiAmi account served by FakeAmiAmiServer."""
+
+    orders_count: int = 100
+    items_per_order: int = 2
+    seed: int = 0
+    orders: dict[str, dict[str, Any]] = field(default_factory=dict, init=False)
+
+    def __post_init__(self) -> None:
+        random_generator = random.Random(self.seed)
+        for index in range(self.orders_count):
+            self.orders[str(index)] = self._make_order(index, random_generator)
+
+    def _make_order(self, index: int, random_generator: random.Random) -> dict[str, Any]:
+        release = date(2020, 1, 1) + timedelta(days=random_generator.randrange(365 * 8))
+        items = []
+        for item_index in range(self.items_per_order):
+            scode = f"FIGURE-{index * self.items_per_order + item_index:06d}"
+            items.append(
+                {
+                    "ds_no": f"{index}-{item_index}",
+                    "scode": scode,
+                    "sname": f"Figure {index}-{item_index} 1/{random_generator.choice([4, 6, 7, 8])} Complete Figure",
+                    "thumb_url": f"/images/product/thumb300/{index % 300}/{scode}.jpg",
+                    "releasedate": release.isoformat(),
+                    "price": random_generator.randrange(1000, 40000),
+                    "amount": 1,
+                    "stock_flg": 1,
+                }
+            )
+        return {
+            "d_no": str(index),
+            "d_status": random_generator.choice(FAKE_STATUSES),
+            "date": f"Release Date {release.strftime('%Y/%m')}",
+            "subtotal": sum(item["price"] for item in items),
+            "items": items,
+        }
+
+    def touch_orders(self, count: int, status: str = "Shipped") -> None:
+        # simulates a delta: some orders change status between two syncs
+        for order in list(self.orders.values())[:count]:
+            order["d_status"] = status
+
+
+@dataclass
+class FakeAmiAmiServer:
+    """Local stand-in for the AmiAmi API with configurable latency, page size cap and error rate."""
+
+    account: FakeAccount
+    latency_seconds: float = 0
+    max_page_size: int | None = None
+    error_rate: float = 0
+    error_status: int = 503
+    seed: int = 0
+    requests_count: dict[str, int] = field(default_factory=dict, init=False)
+    # session cookies sent by the clients, the login sets one that the real API does not need
+    received_session_cookies: set[str] = field(default_factory=set, init=False)
+    session_cookie: str = field(default_factory=lambda: secrets.token_hex(8), init=False)
+    _token: str = field(default_factory=lambda: secrets.token_hex(8), init=False)
+    _random: random.Random = field(init=False)
+    _server: TestServer | None = field(default=None, init=False)
+
+    def __post_init__(self) -> None:
+        self._random = random.Random(self.seed)
+
+    @property
+    def api_root_url(self) -> str:
+        assert self._server is not None, "server is not started"
+        return str(self._server.make_url("/"))
+
+    async def _before_request(self, request: web.Request) -> web.Response | None:
+        self.requests_count[request.path] = self.requests_count.get(request.path, 0) + 1
+        if "session" in request.cookies:
+            self.received_session_cookies.add(request.cookies["session"])
+        if self.latency_seconds:
+            await asyncio.sleep(self.latency_seconds)
+        if self.error_rate and self._random.random() < self.error_rate:
+            return web.Response(status=self.error_status, headers={"Retry-After": "0"})
+        if request.path != "/login" and request.headers.get("X-Authorization") != f"bearer {self._token}":
+            return web.json_response({"RSuccess": False, "RValue": None, "RMessage": "Please login"})
+        return None
+
+    async def _login(self, request: web.Request) -> web.Response:
+        if (error_response := await self._before_request(request)) is not None:
+            return error_response
+        response = web.json_response({"RSuccess": True, "RValue": None, "RMessage": "OK", "login": {"token": self._token}})
+        response.set_cookie("session", self.session_cookie)
+        return response
+
+    async def _orders(self, request: web.Request) -> web.Response:
+        if (error_response := await self._before_request(request)) is not None:
+            return error_response
+        page = int(request.query.get("pagecnt", 1))
+        page_size = int(request.query.get("pagemax", 20))
+        if self.max_page_size is not None:
+            page_size = min(page_size, self.max_page_size)
+        orders = list(self.account.orders.values())[(page - 1) * page_size : page * page_size]
+        return web.json_response(
+            {
+                "RSuccess": True,
+                "RValue": None,
+                "RMessage": "OK",
+                "orders": [{key: value for key, value in order.items() if key != "items"} for order in orders],
+                "search_result": {"total_results": len(self.account.orders)},
+            }
+        )
+
+    async def _order_detail(self, request: web.Request) -> web.Response:
+        if (error_response := await self._before_request(request)) is not None:
+            return error_response
+        order = self.account.orders.get(request.query.get("d_no", ""))
+        if order is None:
+            return web.json_response({"RSuccess": False, "RValue": None, "RMessage": "Order not found"})
+        return web.json_response({"RSuccess": True, "RValue": None, "RMessage": "OK", "order": order})
+
+    def expire_token(self) -> None:
+        # the issued token stops working, clients have to login again
+        self._token = secrets.token_hex(8)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/login", self._login)
+        app.router.add_get("/orders", self._orders)
+        app.router.add_get("/orders/detail", self._order_detail)
+        return app
+
+    async def start(self) -> None:
+        # a host name rather than an ip address, cookie jars only keep cookies of named hosts
+        self._server = TestServer(self.create_app(), host="localhost")
+        await self._server.start_server()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            await self._server.close()
+            self._server = None
@@ -0,0 +1,109 @@
+from datetime import date
+
+import pytest
+
+from amiami_api.accounts import Account, Accounts
+from amiami_api.analytics import (
+    AnalyticsService,
+    Stats,
+    TypeStats,
+    get_figure_type,
+    merge_stats,
+)
+from amiami_api.api import AmiAmiApi, Item, OrderInfo
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.service import AmiamiService
+from amiami_api.store import AmiAmiOrdersMemoryStore
+from amiami_api.sync import SyncScheduler
+from amiami_api.tests.fake_amiami import FakeAccount
+
+
+def make_item(name: str, scode: str = "FIGURE-000001", price: int = 10000, release_date: date = date(2024, 8, 1)) -> Item:
+    return Item(id=scode, scode=scode, name=name, thumb_url="", release_date=release_date, price=price, amount=1, in_stock_flag=1)
+
+
+def make_order(order_id: str, release_date: date, *items: Item) -> OrderInfo:
+    items = tuple(item.model_copy(update={"release_date": release_date}) for item in items)
+    return OrderInfo(
+        id=order_id, status="Order Processing", scheduled_release=release_date, price=sum(item.price for item in items), items=list(items)
+    )
+
+
+def make_account(name: str, orders: list[OrderInfo]) -> Account:
+    store = AmiAmiOrdersMemoryStore()
+    store.bulk_update(orders)
+    async_store = AsyncAmiAmiOrdersStore(store)
+    service = AmiamiService(api=AmiAmiApi(username="user", password="password"), store=async_store, account=name)
+    return Account(name=name, service=service, sync_scheduler=SyncScheduler(service), analytics_service=AnalyticsService(async_store))
+
+
+@pytest.mark.parametrize(
+    ("item", "figure_type"),
+    [
+        (make_item("Figure 1/7 Complete Figure"), "1/7 scale"),
+        (make_item("Figure 1/12 Action Figure"), "1/12 scale"),
+        (make_item("Nendoroid Hatsune Miku"), "nendoroid"),
+        (make_item("Acrylic Stand", scode="GOODS-000001"), "goods"),
+        (make_item("Art Book", scode="BOOK-000001"), "other"),
+    ],
+)
+def test_get_figure_type(item: Item, figure_type: str) -> None:
+    assert get_figure_type(item) == figure_type
+
+
+def test_merge_stats_sums_types_and_months() -> None:
+    first = Stats(
+        start=date(2024, 1, 1),
+        end=date(2024, 2, 1),
+        by_type={"nendoroid": TypeStats(count=1, cost=5000)},
+        total=TypeStats(count=1, cost=5000),
+        cost_per_month={"2024-01": 5000, "2024-02": 0},
+    )
+    second = Stats(
+        start=date(2024, 1, 1),
+        end=date(2024, 2, 1),
+        by_type={"nendoroid": TypeStats(count=2, cost=9000), "1/7 scale": TypeStats(count=1, cost=20000)},
+        total=TypeStats(count=3, cost=29000),
+        cost_per_month={"2024-01": 0, "2024-02": 29000},
+    )
+
+    merged = merge_stats(date(2024, 1, 1), date(2024, 2, 1), [first, second])
+
+    assert merged == Stats(
+        start=date(2024, 1, 1),
+        end=date(2024, 2, 1),
+        by_type={"1/7 scale": TypeStats(count=1, cost=20000), "nendoroid": TypeStats(count=3, cost=14000)},
+        total=TypeStats(count=4, cost=34000),
+        cost_per_month={"2024-01": 5000, "2024-02": 29000},
+    )
+    assert list(merged.by_type) == ["1/7 scale", "nendoroid"]
+
+
+async def test_stats_are_merged_across_accounts() -> None:
+    orders = [OrderInfo.model_validate(order) for order in FakeAccount(orders_count=40).orders.values()]
+    accounts = Accounts({"main": make_account("main", orders[:25]), "alt": make_account("alt", orders[25:])})
+    single_account = Accounts({"all": make_account("all", orders)})
+
+    merged = await accounts.get_stats()
+
+    # an open range covers the releases of all the accounts, like the stats of one account holding every order
+    assert merged == await single_account.get_stats()
+    assert merged.total.count == 80
+    assert await accounts.get_stats(date(2024, 1, 1), date(2024, 6, 30)) == await single_account.get_stats(date(2024, 1, 1), date(2024, 6, 30))
+
+
+async def test_stats_are_recomputed_when_the_store_changes() -> None:
+    nendoroid = make_item("Nendoroid Hatsune Miku", price=6000)
+    account = make_account("main", [make_order("1", date(2024, 8, 1), nendoroid)])
+    analytics_service = account.analytics_service
+
+    stats = await analytics_service.get_stats()
+    assert await analytics_service.get_stats() is stats
+    await account.service.store.bulk_update([make_order("2", date(2024, 9, 1), make_item("Figure 1/7 Complete Figure", "FIGURE-000002", 20000))])
+    changed_stats = await analytics_service.get_stats()
+
+    assert changed_stats is not stats
+    assert stats.total == TypeStats(count=1, cost=6000)
+    assert changed_stats.total == TypeStats(count=2, cost=26000)
+    assert changed_stats.cost_per_month == {"2024-08": 6000, "2024-09": 20000}
+    await account.service.store.close()
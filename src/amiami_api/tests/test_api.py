@@ -0,0 +1,96 @@
+import asyncio
+from typing import Awaitable, Callable
+
+import pytest
+
+from amiami_api.api import AmiAmiApi, AmiAmiRetryableError, ApiOrdersResponse, OrderType
+from amiami_api.http_client import HttpConnectionError
+from amiami_api.tests.fake_amiami import FakeAccount, FakeAmiAmiServer
+
+StartFakeAmiAmi = Callable[..., Awaitable[FakeAmiAmiServer]]
+MakeApi = Callable[..., AmiAmiApi]
+
+
+async def test_get_orders_follows_capped_page_size(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    account = FakeAccount(orders_count=100)
+    server = await fake_amiami(account, max_page_size=20)
+
+    orders = await make_api(server, page_size=50).get_orders(OrderType.all)
+
+    assert sorted(order.id for order in orders) == sorted(account.orders)
+    assert server.requests_count["/orders"] == 6
+
+
+async def test_get_orders_dedups_orders_shifted_while_paginating(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    account = FakeAccount(orders_count=100)
+    server = await fake_amiami(account)
+    api = make_api(server, page_size=20, page_fetch_parallelism=1)
+    get_orders_page = api._get_orders_page
+
+    async def get_orders_page_with_new_order(page: int) -> ApiOrdersResponse:
+        response = await get_orders_page(page)
+        if page == 1:
+            # a new order on top shifts every later page by one
+            account.orders = {"new": {**account.orders["0"], "d_no": "new"}, **account.orders}
+        return response
+
+    api._get_orders_page = get_orders_page_with_new_order  # type: ignore[method-assign]
+    orders = await api.get_orders(OrderType.all)
+
+    order_ids = [order.id for order in orders]
+    assert len(order_ids) == len(set(order_ids))
+    assert set(order_ids) >= {str(index) for index in range(100)}
+
+
+async def test_rate_limited_requests_are_retried(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    server = await fake_amiami(FakeAccount(orders_count=100), error_rate=0.3, error_status=429, seed=1)
+
+    orders = await make_api(server, page_size=20, max_retries=10).get_orders(OrderType.all)
+
+    assert len(orders) == 100
+    # 5 full pages and the empty one after them, the rest are retries
+    assert server.requests_count["/orders"] > 6
+
+
+async def test_concurrent_auth_failures_login_once(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    account = FakeAccount(orders_count=10)
+    server = await fake_amiami(account)
+    api = make_api(server)
+    await api.get_orders(OrderType.all)
+    server.expire_token()
+
+    orders_info = await asyncio.gather(*[api.get_order_info(order_id) for order_id in account.orders])
+
+    assert [order_info.id for order_info in orders_info] == list(account.orders)
+    assert server.requests_count["/login"] == 2
+
+
+def test_auth_errors_are_matched_on_the_whole_message() -> None:
+    assert AmiAmiApi._is_auth_error_message("Please login.")
+    assert not AmiAmiApi._is_auth_error_message("Order not found")
+    assert not AmiAmiApi._is_auth_error_message("Item is out of stock, login to get notified")
+
+
+async def test_accounts_sharing_the_http_client_do_not_share_cookies(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    # both servers are on localhost, so a shared cookie jar would send one account's cookies to the other
+    servers = [await fake_amiami(FakeAccount(orders_count=10, seed=seed)) for seed in range(2)]
+    apis = [make_api(server) for server in servers]
+
+    for api in apis + apis:
+        await api.get_orders(OrderType.all)
+
+    assert all(not server.received_session_cookies for server in servers)
+
+
+async def test_timeouts_and_connection_errors_are_retryable(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    server = await fake_amiami(FakeAccount(orders_count=10), latency_seconds=0.2)
+    api = make_api(server, request_timeout_seconds=0.05, max_retries=0)
+
+    with pytest.raises(AmiAmiRetryableError) as timeout_error:
+        await api.get_orders(OrderType.all)
+    await server.close()
+    with pytest.raises(AmiAmiRetryableError) as connection_error:
+        await api.get_orders(OrderType.all)
+
+    assert isinstance(timeout_error.value.__cause__, TimeoutError)
+    assert isinstance(connection_error.value.__cause__, HttpConnectionError)
@@ -0,0 +1,182 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import pytest
+from dependency_injector import providers
+from fastapi.testclient import TestClient
+
+import amiami_api
+from amiami_api.accounts import Account, Accounts
+from amiami_api.analytics import AnalyticsService
+from amiami_api.api import AmiAmiApi, OrderInfo, OrderType
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.di import DIContainer
+from amiami_api.response_cache import ResponseCache
+from amiami_api.service import AmiamiService
+from amiami_api.store import (
+    AmiAmiOrdersFileStore,
+    AmiAmiOrdersMemoryStore,
+    AmiAmiOrdersSqliteStore,
+    AmiAmiOrdersStore,
+)
+from amiami_api.sync import SyncScheduler
+from amiami_api.tests.conftest import Benchmark
+from amiami_api.tests.fake_amiami import FakeAccount, FakeAmiAmiServer
+
+pytestmark = pytest.mark.benchmark
+
+StartFakeAmiAmi = Callable[..., Awaitable[FakeAmiAmiServer]]
+MakeApi = Callable[..., AmiAmiApi]
+
+
+def make_orders(count: int) -> list[OrderInfo]:
+    account = FakeAccount(orders_count=count)
+    return [OrderInfo.model_validate(order) for order in account.orders.values()]
+
+
+@pytest.mark.parametrize("orders_count", [100, 1000])
+async def test_update_orders_full(benchmark: Benchmark, fake_amiami: StartFakeAmiAmi, make_api: MakeApi, orders_count: int) -> None:
+    server = await fake_amiami(FakeAccount(orders_count=orders_count))
+    api = make_api(server, page_size=100)
+    service = AmiamiService(api=api, store=AsyncAmiAmiOrdersStore(AmiAmiOrdersMemoryStore()))
+
+    async def reset_store() -> None:
+        await service.store.close()
+        service.store = AsyncAmiAmiOrdersStore(AmiAmiOrdersMemoryStore())
+
+    benchmark.rounds = 3
+    benchmark.extra_info = {"orders": orders_count}
+    result = await benchmark.run_async(service.update_orders, OrderType.all, setup=reset_store)
+    assert result.fetched == orders_count
+    await service.store.close()
+
+
+@pytest.mark.parametrize("changed_ratio", [0, 0.1])
+async def test_update_orders_delta(benchmark: Benchmark, fake_amiami: StartFakeAmiAmi, make_api: MakeApi, changed_ratio: float) -> None:
+    account = FakeAccount(orders_count=1000)
+    server = await fake_amiami(account)
+    service = AmiamiService(api=make_api(server, page_size=100), store=AsyncAmiAmiOrdersStore(AmiAmiOrdersMemoryStore()))
+    await service.update_orders(OrderType.all)
+    changed_count = int(account.orders_count * changed_ratio)
+    statuses = iter(["Shipped", "Order Processing"] * 5)
+
+    async def change_orders() -> None:
+        # the store is in sync after every round, so each round fetches exactly the changed orders
+        account.touch_orders(changed_count, status=next(statuses))
+
+    benchmark.rounds = 5
+    benchmark.extra_info = {"orders": account.orders_count, "changed": changed_count}
+    result = await benchmark.run_async(service.update_orders, OrderType.all, setup=change_orders)
+    assert result.fetched == changed_count
+    assert result.skipped == account.orders_count - changed_count
+    await service.store.close()
+
+
+@pytest.mark.parametrize("page_size", [20, 50, 100])
+async def test_get_orders_pagination(benchmark: Benchmark, fake_amiami: StartFakeAmiAmi, make_api: MakeApi, page_size: int) -> None:
+    server = await fake_amiami(FakeAccount(orders_count=1000), latency_seconds=0.005)
+    api = make_api(server, page_size=page_size)
+
+    benchmark.extra_info = {"orders": 1000, "page_size": page_size, "latency_seconds": server.latency_seconds}
+    orders = await benchmark.run_async(api.get_orders, OrderType.all)
+    assert len(orders) == 1000
+
+
+async def test_get_orders_with_errors(benchmark: Benchmark, fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    server = await fake_amiami(FakeAccount(orders_count=500), error_rate=0.1)
+    api = make_api(server, page_size=20, max_retries=10)
+
+    benchmark.extra_info = {"orders": 500, "error_rate": server.error_rate}
+    orders = await benchmark.run_async(api.get_orders, OrderType.all)
+    assert len(orders) == 500
+
+
+def make_store(backend: str, directory: Path) -> AmiAmiOrdersStore:
+    if backend == "file":
+        return AmiAmiOrdersFileStore(file_path=directory / "orders.json", compact=True)
+    return AmiAmiOrdersSqliteStore(file_path=directory / "orders.sqlite3")
+
+
+def remove_store_files(directory: Path) -> None:
+    for path in directory.iterdir():
+        os.remove(path)
+
+
+@pytest.mark.parametrize("backend", ["file", "sqlite"])
+@pytest.mark.parametrize("orders_count", [100, 1000, 10000])
+def test_store_save(benchmark: Benchmark, tmp_path: Path, backend: str, orders_count: int) -> None:
+    orders = make_orders(orders_count)
+
+    def save() -> AmiAmiOrdersStore:
+        store = make_store(backend, tmp_path)
+        store.bulk_update(orders)
+        return store
+
+    benchmark.rounds = 3
+    benchmark.extra_info = {"orders": orders_count, "backend": backend}
+    benchmark(save, setup=lambda: remove_store_files(tmp_path))
+
+
+@pytest.mark.parametrize("backend", ["file", "sqlite"])
+@pytest.mark.parametrize("orders_count", [100, 1000, 10000])
+def test_store_load(benchmark: Benchmark, tmp_path: Path, backend: str, orders_count: int) -> None:
+    make_store(backend, tmp_path).bulk_update(make_orders(orders_count))
+
+    def load() -> list[OrderInfo]:
+        return make_store(backend, tmp_path).get_orders()
+
+    benchmark.rounds = 3
+    benchmark.extra_info = {"orders": orders_count, "backend": backend}
+    assert len(benchmark(load)) == orders_count
+
+
+@pytest.mark.parametrize("stream", [None, "ndjson", "array"])
+@pytest.mark.parametrize("orders_count", [100, 1000, 10000])
+def test_orders_endpoint_serialization(benchmark: Benchmark, web_app: Any, orders_count: int, stream: str | None) -> None:
+    store = AmiAmiOrdersMemoryStore()
+    store.bulk_update(make_orders(orders_count))
+    async_store = AsyncAmiAmiOrdersStore(store)
+    service = AmiamiService(api=AmiAmiApi(username="user", password="password"), store=async_store)
+    account = Account(name="default", service=service, sync_scheduler=SyncScheduler(service), analytics_service=AnalyticsService(async_store))
+    container = DIContainer()
+    container.accounts.override(providers.Object(Accounts({account.name: account})))
+    # a new cache for every request, so that every round serializes the orders
+    container.response_cache.override(providers.Factory(ResponseCache))
+    client = TestClient(web_app)
+    params = {"order_type": "all"} if stream is None else {"order_type": "all", "stream": stream}
+
+    benchmark.extra_info = {"orders": orders_count, "stream": stream}
+    response = benchmark(client.get, "/api/orders/", params=params)
+    assert response.status_code == 200
+    container.unwire()
+
+
+def test_import_time(benchmark: Benchmark) -> None:
+    source_path = Path(amiami_api.__file__).parents[1]
+    command = [
+        sys.executable,
+        "-X",
+        "importtime",
+        "-c",
+        "import sys, amiami_api.web; sys.exit(any(name in sys.modules for name in ('telegram', 'telegramify_markdown', 'aiohttp')))",
+    ]
+
+    def import_web() -> subprocess.CompletedProcess:
+        return subprocess.run(command, capture_output=True, text=True, env={**os.environ, "PYTHONPATH": str(source_path)})
+
+    profile = import_web()
+    assert profile.returncode == 0, "heavy modules must be imported lazily"
+
+    # "import time: self [us] | cumulative | imported package" lines
+    cumulative_times: dict[str, int] = {}
+    for line in profile.stderr.splitlines():
+        columns = line.removeprefix("import time:").split("|")
+        if len(columns) == 3 and columns[1].strip().isdigit():
+            cumulative_times[columns[2].strip()] = int(columns[1])
+    slowest_imports = sorted(cumulative_times.items(), key=lambda item: item[1], reverse=True)[:20]
+
+    benchmark.extra_info = {"slowest_imports_us": dict(slowest_imports)}
+    benchmark(import_web)
@@ -0,0 +1,101 @@
+import asyncio
+import copy
+from datetime import date, datetime
+from typing import Any
+
+from amiami_api.api import OrderInfo
+from amiami_api.events import (
+    EventBus,
+    OrderEvent,
+    OrderEventType,
+    detect_changes,
+    removed_order_events,
+)
+from amiami_api.tests.fake_amiami import FakeAccount
+
+NOW = datetime(2024, 6, 15, 12)
+
+
+def make_order_data() -> dict[str, Any]:
+    order = FakeAccount(orders_count=1).orders["0"]
+    order["d_status"] = "Order Processing"
+    order["date"] = "Release Date 2024/08"
+    for item in order["items"]:
+        item["releasedate"] = "2024-08-01"
+    return order
+
+
+def changed_order(**changes: Any) -> OrderInfo:
+    order = copy.deepcopy(make_order_data())
+    item_changes = changes.pop("items", {})
+    order |= changes
+    for item in order["items"]:
+        item |= item_changes.get(item["ds_no"], {})
+    return OrderInfo.model_validate(order)
+
+
+def summary(events: list[OrderEvent]) -> list[tuple]:
+    return [(event.type, event.item_id, event.old, event.new) for event in events]
+
+
+def test_new_order_is_announced_once() -> None:
+    order = changed_order()
+
+    events = detect_changes("main", None, order, NOW)
+
+    assert summary(events) == [(OrderEventType.order_added, None, None, "Order Processing")]
+    assert (events[0].account, events[0].order_id, events[0].created_at) == ("main", "0", NOW)
+
+
+def test_unchanged_order_has_no_events() -> None:
+    assert detect_changes("main", changed_order(), changed_order(), NOW) == []
+
+
+def test_order_and_item_changes() -> None:
+    stored = changed_order()
+    fetched = changed_order(
+        d_status="Shipped",
+        date="Release Date 2024/10",
+        subtotal=stored.price + 500,
+        items={"0-0": {"releasedate": "2024-10-01", "stock_flg": 0}, "0-1": {"releasedate": "2024-09-01"}},
+    )
+
+    events = detect_changes("main", stored, fetched, NOW)
+
+    assert summary(events) == [
+        (OrderEventType.status_changed, None, "Order Processing", "Shipped"),
+        (OrderEventType.release_changed, None, date(2024, 8, 1), date(2024, 10, 1)),
+        (OrderEventType.price_changed, None, stored.price, stored.price + 500),
+        (OrderEventType.item_release_changed, "0-0", date(2024, 8, 1), date(2024, 10, 1)),
+        (OrderEventType.item_stock_changed, "0-0", 1, 0),
+        (OrderEventType.item_release_changed, "0-1", date(2024, 8, 1), date(2024, 9, 1)),
+    ]
+
+
+def test_items_added_to_an_order_have_no_events() -> None:
+    stored = changed_order()
+    stored.items = stored.items[:1]
+
+    assert detect_changes("main", stored, changed_order(), NOW) == []
+
+
+def test_removed_orders() -> None:
+    events = removed_order_events("main", ["1", "2"], NOW)
+
+    assert [(event.type, event.order_id) for event in events] == [(OrderEventType.order_removed, "1"), (OrderEventType.order_removed, "2")]
+
+
+async def test_event_bus_wakes_subscribers_and_reports_gaps() -> None:
+    bus = EventBus(capacity=3)
+    waiter = asyncio.create_task(bus.wait_for_events(0, timeout=1))
+    await asyncio.sleep(0)
+
+    bus.publish(removed_order_events("main", ["1", "2"], NOW))
+
+    assert [event.id for event in await waiter] == [1, 2]
+    bus.publish(removed_order_events("main", ["3", "4"], NOW))
+    assert [event.id for event in bus.events_after(2)] == [3, 4]
+    # the first event has been dropped from the buffer
+    assert bus.has_gap(0)
+    assert not bus.has_gap(1)
+    assert await bus.wait_for_events(4, timeout=0.01) == []
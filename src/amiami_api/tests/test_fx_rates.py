@@ -0,0 +1,70 @@
+import asyncio
+import datetime
+from pathlib import Path
+
+import pytest
+
+from amiami_api.fx_rates import CachedFxRates, FxRatesService, LatestFxRatesResponse
+
+RATES = LatestFxRatesResponse(success=True, timestamp=0, base="EUR", date=datetime.date(2024, 6, 15), rates={"JPY": 160.0, "USD": 1.1})
+
+
+def make_service(fail: bool = False, cache_file_path: Path | None = None) -> tuple[FxRatesService, list[int]]:
+    service = FxRatesService(access_key="key", cache_file_path=cache_file_path)
+    requests: list[int] = []
+
+    async def get_rates_data() -> LatestFxRatesResponse:
+        requests.append(1)
+        await asyncio.sleep(0.01)
+        if fail:
+            raise ConnectionError("provider is down")
+        return RATES
+
+    service._get_rates_data = get_rates_data  # type: ignore[method-assign]
+    return service, requests
+
+
+def stale_rates() -> CachedFxRates:
+    return CachedFxRates(fetched_at=datetime.datetime.now() - datetime.timedelta(days=2), data=RATES)
+
+
+async def test_concurrent_callers_share_one_refresh() -> None:
+    service, requests = make_service()
+
+    rates = await asyncio.gather(*(service.get_jpy_to_usd_rate() for _ in range(5)))
+
+    assert rates == [pytest.approx(1.1 / 160)] * 5
+    assert len(requests) == 1
+    assert await service.get_rate("USD", "EUR") == pytest.approx(1 / 1.1)
+    assert len(requests) == 1
+
+
+async def test_stale_rates_are_served_while_a_failing_refresh_backs_off() -> None:
+    service, requests = make_service(fail=True)
+    service._cached = stale_rates()
+
+    assert await service.get_jpy_to_usd_rate() == pytest.approx(1.1 / 160)
+    await asyncio.sleep(0.02)
+    assert await service.get_jpy_to_usd_rate() == pytest.approx(1.1 / 160)
+
+    assert len(requests) == 1
+
+
+async def test_missing_rates_raise_when_the_provider_fails() -> None:
+    service, _ = make_service(fail=True)
+
+    with pytest.raises(RuntimeError):
+        await service.get_jpy_to_usd_rate()
+
+
+async def test_refreshed_rates_are_cached_in_the_file(tmp_path: Path) -> None:
+    cache_file_path = tmp_path / "fx_rates.json"
+    cache_file_path.write_text("{corrupt")
+    service, _ = make_service(cache_file_path=cache_file_path)
+
+    await service.get_jpy_to_usd_rate()
+
+    assert [path.name for path in tmp_path.iterdir()] == ["fx_rates.json"]
+    cached_service, requests = make_service(cache_file_path=cache_file_path)
+    assert await cached_service.get_jpy_to_usd_rate() == pytest.approx(1.1 / 160)
+    assert requests == []
@@ -0,0 +1,116 @@
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator
+
+import pytest
+
+from amiami_api.api import Item, OrderInfo
+from amiami_api.events import OrderEvent, OrderEventType
+from amiami_api.history import (
+    DelayGrouping,
+    DelayStats,
+    HistoryQuery,
+    OrderHistoryLog,
+)
+
+NOW = datetime.now()
+LONG_AGO = NOW - timedelta(days=40)
+
+
+def make_item(item_id: str, name: str, release_date: date) -> Item:
+    return Item(
+        id=item_id,
+        scode=f"FIGURE-{item_id}",
+        name=name,
+        thumb_url=f"/images/product/thumb300/{item_id}.jpg",
+        release_date=release_date,
+        price=10000,
+        amount=1,
+        in_stock_flag=1,
+    )
+
+
+ORDER = OrderInfo(
+    id="1",
+    status="Order Processing",
+    scheduled_release=date(2024, 11, 1),
+    price=20000,
+    items=[make_item("1-0", "Figure 1/7 Complete Figure", date(2024, 11, 1)), make_item("1-1", "Nendoroid Figure", date(2024, 9, 1))],
+)
+
+
+def event(
+    event_type: OrderEventType, old: str | int | date, new: str | int | date, item_id: str | None = None, created_at: datetime = LONG_AGO
+) -> OrderEvent:
+    return OrderEvent(type=event_type, account="main", order_id=ORDER.id, item_id=item_id, old=old, new=new, created_at=created_at)
+
+
+@pytest.fixture
+async def history(tmp_path: Path) -> AsyncIterator[OrderHistoryLog]:
+    history = OrderHistoryLog(tmp_path / "history.sqlite3", compaction_interval=None)
+    await history.append(
+        [
+            event(OrderEventType.status_changed, "Order Processing", "Payment Pending"),
+            event(OrderEventType.price_changed, 20000, 21000),
+            event(OrderEventType.item_release_changed, date(2024, 8, 1), date(2024, 10, 1), item_id="1-0"),
+            event(OrderEventType.status_changed, "Payment Pending", "Order Processing"),
+            event(OrderEventType.price_changed, 21000, 20000),
+            event(OrderEventType.item_stock_changed, 1, 0, item_id="1-0"),
+            event(OrderEventType.item_release_changed, date(2024, 10, 1), date(2024, 11, 1), item_id="1-0"),
+            event(OrderEventType.item_release_changed, date(2024, 8, 1), date(2024, 9, 1), item_id="1-1"),
+            event(OrderEventType.release_changed, date(2024, 8, 1), date(2024, 11, 1)),
+            event(OrderEventType.status_changed, "Order Processing", "Shipped"),
+            # recent changes are kept as they are
+            event(OrderEventType.price_changed, 20000, 19000, created_at=NOW),
+            event(OrderEventType.price_changed, 19000, 20000, created_at=NOW),
+        ],
+        [ORDER],
+    )
+    yield history
+    await history.close()
+
+
+async def test_compact_collapses_repeated_changes(history: OrderHistoryLog) -> None:
+    removed = await history.compact()
+
+    entries = await history.query(HistoryQuery())
+    assert removed == 4
+    assert [(entry.type, entry.item_id, entry.old, entry.new) for entry in entries] == [
+        (OrderEventType.item_release_changed, "1-0", "2024-08-01", "2024-10-01"),
+        (OrderEventType.item_stock_changed, "1-0", "1", "0"),
+        (OrderEventType.item_release_changed, "1-0", "2024-10-01", "2024-11-01"),
+        (OrderEventType.item_release_changed, "1-1", "2024-08-01", "2024-09-01"),
+        (OrderEventType.release_changed, None, "2024-08-01", "2024-11-01"),
+        (OrderEventType.status_changed, None, "Order Processing", "Shipped"),
+        (OrderEventType.price_changed, None, "20000", "19000"),
+        (OrderEventType.price_changed, None, "19000", "20000"),
+    ]
+    assert await history.compact() == 0
+
+
+async def test_delays_are_grouped_from_item_slips(history: OrderHistoryLog) -> None:
+    assert await history.get_delays(DelayGrouping.month) == [
+        DelayStats(key="2024-08", slips=2, average_delay_months=1.5, max_delay_months=2),
+        DelayStats(key="2024-10", slips=1, average_delay_months=1, max_delay_months=1),
+    ]
+    assert await history.get_delays(DelayGrouping.type) == [
+        DelayStats(key="1/7 scale", slips=2, average_delay_months=1.5, max_delay_months=2),
+        DelayStats(key="nendoroid", slips=1, average_delay_months=1, max_delay_months=1),
+    ]
+    assert await history.get_delays(DelayGrouping.month, release_from=date(2024, 9, 1)) == [
+        DelayStats(key="2024-10", slips=1, average_delay_months=1, max_delay_months=1),
+    ]
+    assert await history.get_delays(DelayGrouping.month, accounts=("alt",)) == []
+
+
+async def test_releases_that_did_not_move_later_are_not_slips(history: OrderHistoryLog) -> None:
+    delays = await history.get_delays(DelayGrouping.type)
+    await history.append(
+        [
+            event(OrderEventType.item_release_changed, date(2024, 8, 1), date(2024, 8, 20), item_id="1-0"),
+            event(OrderEventType.item_release_changed, date(2024, 10, 1), date(2024, 7, 1), item_id="1-1"),
+        ],
+        [ORDER],
+    )
+
+    assert await history.get_delays(DelayGrouping.type) == delays
@@ -0,0 +1,89 @@
+import re
+from typing import Any
+
+import pytest
+from fastapi.testclient import TestClient
+
+from amiami_api.metrics import MetricsRegistry
+
+SAMPLE_PATTERN = re.compile(r'^(?P<name>[a-z_]+)(?:\{(?P<labels>[a-z_]+="[^"]*"(?:,[a-z_]+="[^"]*")*)\})? (?P<value>\S+)$')
+
+
+def parse_samples(text: str) -> dict[tuple[str, frozenset[tuple[str, str]]], float]:
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith("#"):
+            continue
+        match = SAMPLE_PATTERN.match(line)
+        assert match, f"invalid sample line: {line!r}"
+        labels = frozenset(re.findall(r'([a-z_]+)="([^"]*)"', match["labels"] or ""))
+        samples[match["name"], labels] = float(match["value"])
+    return samples
+
+
+def test_registry_renders_the_text_format() -> None:
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ("endpoint",))
+    queue_size = registry.gauge("queue_size", "Queued jobs.")
+    duration = registry.histogram("duration_seconds", "Durations.", ("endpoint",), buckets=(0.1, 1, 10))
+
+    requests.inc(endpoint="orders")
+    requests.inc(2, endpoint="orders")
+    queue_size.set(1.5)
+    for value in (0.05, 0.1, 0.5, 5, 50):
+        duration.observe(value, endpoint="orders")
+
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{endpoint="orders"} 3\n'
+        "# HELP queue_size Queued jobs.\n"
+        "# TYPE queue_size gauge\n"
+        "queue_size 1.5\n"
+        "# HELP duration_seconds Durations.\n"
+        "# TYPE duration_seconds histogram\n"
+        'duration_seconds_bucket{endpoint="orders",le="0.1"} 2\n'
+        'duration_seconds_bucket{endpoint="orders",le="1"} 3\n'
+        'duration_seconds_bucket{endpoint="orders",le="10"} 4\n'
+        'duration_seconds_bucket{endpoint="orders",le="+Inf"} 5\n'
+        'duration_seconds_sum{endpoint="orders"} 55.65\n'
+        'duration_seconds_count{endpoint="orders"} 5\n'
+    )
+
+
+def test_registry_rejects_wrong_labels_and_duplicates() -> None:
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ("endpoint",))
+
+    with pytest.raises(ValueError):
+        requests.inc(route="orders")
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total", "Requests.")
+
+
+def test_metrics_endpoint_counts_requests_into_buckets(web_app: Any) -> None:
+    client = TestClient(web_app)
+    labels = {("method", "GET"), ("route", "/metrics"), ("status", "200")}
+
+    # a scrape shows the requests finished before it, the other tests of the session may have scraped already
+    before = parse_samples(client.get("/metrics").text)
+    response = client.get("/metrics")
+    after = parse_samples(response.text)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE http_request_duration_seconds histogram" in response.text.splitlines()
+    bucket_deltas = [
+        (float(dict(key_labels)["le"]), value - before.get((name, key_labels), 0))
+        for (name, key_labels), value in after.items()
+        if name == "http_request_duration_seconds_bucket" and labels < key_labels
+    ]
+    count_key = "http_request_duration_seconds_count", frozenset(labels)
+    sum_key = "http_request_duration_seconds_sum", frozenset(labels)
+    # the one new request lands in a single bucket and is counted by every cumulative bucket above it
+    deltas = [delta for _, delta in sorted(bucket_deltas)]
+    assert len(deltas) == 16
+    assert set(deltas) <= {0, 1} and deltas == sorted(deltas) and deltas[-1] == 1
+    assert sorted(bucket_deltas)[-1][0] == float("inf")
+    assert after[count_key] == before.get(count_key, 0) + 1
+    assert after[sum_key] > before.get(sum_key, 0)
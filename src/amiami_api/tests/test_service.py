@@ -0,0 +1,92 @@
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable
+
+import pytest
+
+from amiami_api.api import (
+    AmiAmiApi,
+    Item,
+    Order,
+    OrderInfo,
+    OrderType,
+    amiami_month_date_validate,
+)
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.service import AmiamiService
+from amiami_api.store import AmiAmiOrdersMemoryStore
+from amiami_api.tests.fake_amiami import FakeAccount, FakeAmiAmiServer
+
+StartFakeAmiAmi = Callable[..., Awaitable[FakeAmiAmiServer]]
+MakeApi = Callable[..., AmiAmiApi]
+
+NOW = datetime(2024, 6, 15, 12)
+RECENTLY = NOW - timedelta(hours=1)
+BEFORE_LAST_MONTH = amiami_month_date_validate("Before Last Month")
+
+
+def make_service(api: AmiAmiApi | None = None) -> AmiamiService:
+    return AmiamiService(
+        api=api or AmiAmiApi(username="user", password="password"),
+        store=AsyncAmiAmiOrdersStore(AmiAmiOrdersMemoryStore()),
+        max_staleness=timedelta(hours=24),
+    )
+
+
+def make_order(status: str = "Order Processing", scheduled_release: date = date(2024, 8, 1), price: int = 12000) -> Order:
+    return Order(id="1", status=status, scheduled_release=scheduled_release, price=price)
+
+
+def make_stored(scheduled_release: date = date(2024, 8, 1)) -> OrderInfo:
+    item = Item(
+        id="1-0",
+        scode="FIGURE-000001",
+        name="Figure 1/7 Complete Figure",
+        thumb_url="/images/product/thumb300/1/FIGURE-000001.jpg",
+        release_date=scheduled_release,
+        price=12000,
+        amount=1,
+        in_stock_flag=1,
+    )
+    return OrderInfo(id="1", status="Order Processing", scheduled_release=scheduled_release, price=12000, items=[item])
+
+
+@pytest.mark.parametrize(
+    ("order", "stored", "fetched_at", "needs_fetch"),
+    [
+        pytest.param(make_order(), None, None, True, id="new"),
+        pytest.param(make_order(), make_stored(), None, True, id="never fetched"),
+        pytest.param(make_order(), make_stored(), RECENTLY, False, id="unchanged"),
+        pytest.param(make_order(), make_stored(), NOW - timedelta(hours=25), True, id="stale"),
+        pytest.param(make_order(status="Shipped"), make_stored(), RECENTLY, True, id="status changed"),
+        pytest.param(make_order(price=11000), make_stored(), RECENTLY, True, id="price changed"),
+        pytest.param(make_order(scheduled_release=date(2024, 9, 1)), make_stored(), RECENTLY, True, id="release changed"),
+        # the summary says "Before Last Month", the stored order info has the release corrected from its items
+        pytest.param(make_order(scheduled_release=BEFORE_LAST_MONTH), make_stored(date(2023, 1, 1)), RECENTLY, False, id="before last month"),
+        pytest.param(
+            make_order(status="Shipped", scheduled_release=BEFORE_LAST_MONTH),
+            make_stored(date(2023, 1, 1)),
+            RECENTLY,
+            True,
+            id="before last month with status changed",
+        ),
+    ],
+)
+def test_needs_fetch(order: Order, stored: OrderInfo | None, fetched_at: datetime | None, needs_fetch: bool) -> None:
+    assert make_service()._needs_fetch(order, stored, fetched_at, NOW) is needs_fetch
+
+
+async def test_update_orders_fetches_changed_orders_only(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    account = FakeAccount(orders_count=30)
+    server = await fake_amiami(account)
+    service = make_service(make_api(server))
+
+    first_result = await service.update_orders(OrderType.all)
+    second_result = await service.update_orders(OrderType.all)
+    account.touch_orders(5, status="Preparing Shipment")
+    third_result = await service.update_orders(OrderType.all)
+
+    assert (first_result.fetched, first_result.skipped) == (30, 0)
+    assert (second_result.fetched, second_result.skipped) == (0, 30)
+    assert (third_result.fetched, third_result.skipped) == (5, 25)
+    assert server.requests_count["/orders/detail"] == 35
+    await service.store.close()
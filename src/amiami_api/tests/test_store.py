@@ -0,0 +1,141 @@
+import asyncio
+from datetime import date, datetime
+from pathlib import Path
+
+import pytest
+
+from amiami_api import metrics
+from amiami_api.api import OrderInfo, OrderType
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.store import (
+    AmiAmiOrdersFileStore,
+    AmiAmiOrdersSqliteStore,
+    AmiAmiOrdersStore,
+    OrdersQuery,
+)
+from amiami_api.tests.fake_amiami import FakeAccount
+
+QUERIES = [
+    OrdersQuery(),
+    OrdersQuery(order_type=OrderType.open),
+    OrdersQuery(order_type=OrderType.shipped),
+    OrdersQuery(order_type=OrderType.current_month),
+    OrdersQuery(release_from=date(2022, 1, 1), release_to=date(2023, 12, 31)),
+    OrdersQuery(status="shipped"),
+    OrdersQuery(search="1/7"),
+    OrdersQuery(search="FIGURE 1"),
+    OrdersQuery(order_type=OrderType.open, search="1/8", release_from=date(2024, 1, 1)),
+    OrdersQuery(limit=25),
+    OrdersQuery(offset=190),
+    OrdersQuery(status="Payment Pending", limit=10, offset=5),
+]
+
+
+@pytest.fixture
+def stores(tmp_path: Path) -> tuple[AmiAmiOrdersStore, AmiAmiOrdersStore]:
+    orders = [OrderInfo.model_validate(order) for order in FakeAccount(orders_count=200).orders.values()]
+    file_store = AmiAmiOrdersFileStore(file_path=tmp_path / "orders.json")
+    sqlite_store = AmiAmiOrdersSqliteStore(file_path=tmp_path / "orders.sqlite3")
+    for store in (file_store, sqlite_store):
+        store.bulk_update(orders)
+    # the file store answers from the loaded file, like after a restart
+    return AmiAmiOrdersFileStore(file_path=tmp_path / "orders.json"), sqlite_store
+
+
+@pytest.mark.parametrize("query", QUERIES, ids=repr)
+def test_file_and_sqlite_stores_answer_queries_alike(stores: tuple[AmiAmiOrdersStore, AmiAmiOrdersStore], query: OrdersQuery) -> None:
+    file_store, sqlite_store = stores
+
+    file_orders = file_store.query_orders(query)
+
+    assert file_orders
+    assert sqlite_store.query_orders(query) == file_orders
+    assert list(sqlite_store.iter_orders(query)) == list(file_store.iter_orders(query)) == file_orders
+    assert sqlite_store.query_items(query) == file_store.query_items(query)
+
+
+def test_file_and_sqlite_stores_keep_fetched_at(stores: tuple[AmiAmiOrdersStore, AmiAmiOrdersStore], tmp_path: Path) -> None:
+    fetched_at = datetime(2024, 6, 15, 12, 30)
+    file_store, sqlite_store = stores
+    order = file_store.get_orders()[0]
+
+    for store in (file_store, sqlite_store):
+        store.update_order(order.id, order, fetched_at)
+
+    assert AmiAmiOrdersFileStore(file_path=tmp_path / "orders.json").get_fetched_at([order.id]) == {order.id: fetched_at}
+    assert sqlite_store.get_fetched_at([order.id, "missing"]) == {order.id: fetched_at}
+
+
+def test_version_changes_only_when_orders_are_deleted(stores: tuple[AmiAmiOrdersStore, AmiAmiOrdersStore]) -> None:
+    for store in stores:
+        order_ids = [order.id for order in store.get_orders()]
+        version = store.version
+
+        store.bulk_delete([])
+        store.delete_order("missing")
+        assert store.clean_up_not_existing_orders(order_ids) == []
+        assert store.version == version
+
+        assert store.clean_up_not_existing_orders(order_ids[1:]) == order_ids[:1]
+        assert store.version > version
+
+
+def test_store_metrics_are_labelled_by_account(tmp_path: Path) -> None:
+    for account, orders_count in (("main", 10), ("alt", 20)):
+        orders = [OrderInfo.model_validate(order) for order in FakeAccount(orders_count=orders_count).orders.values()]
+        store = AmiAmiOrdersFileStore(file_path=tmp_path / f"orders-{account}.json", account=account)
+        store.bulk_update(orders)
+
+    file_sizes = {account: metrics.store_file_size._values[(account, "file")] for account in ("main", "alt")}
+    assert file_sizes == {account: (tmp_path / f"orders-{account}.json").stat().st_size for account in ("main", "alt")}
+
+
+async def test_failed_file_writes_are_retried(tmp_path: Path) -> None:
+    file_path = tmp_path / "orders.json"
+    store = AmiAmiOrdersFileStore(file_path=tmp_path / "missing" / "orders.json", deferred_save=True)
+    async_store = AsyncAmiAmiOrdersStore(store, flush_delay_seconds=0.01)
+    orders = [OrderInfo.model_validate(order) for order in FakeAccount(orders_count=10).orders.values()]
+
+    await async_store.bulk_update(orders)
+    await asyncio.sleep(0.05)
+    store.file_path = file_path
+    await async_store.close()
+
+    assert AmiAmiOrdersFileStore(file_path=file_path).count_orders() == 10
+
+
+async def test_pending_changes_are_written_on_close_after_a_failed_flush(tmp_path: Path) -> None:
+    file_path = tmp_path / "orders.json"
+    store = AmiAmiOrdersFileStore(file_path=tmp_path / "missing" / "orders.json", deferred_save=True)
+    # the debounced flush never runs before close
+    async_store = AsyncAmiAmiOrdersStore(store, flush_delay_seconds=60)
+    orders = [OrderInfo.model_validate(order) for order in FakeAccount(orders_count=10).orders.values()]
+
+    await async_store.bulk_update(orders)
+    assert not await async_store.flush()
+    store.file_path = file_path
+    await async_store.close()
+
+    assert AmiAmiOrdersFileStore(file_path=file_path).count_orders() == 10
+
+
+async def test_sqlite_streams_read_one_snapshot(tmp_path: Path) -> None:
+    orders = [OrderInfo.model_validate(order) for order in FakeAccount(orders_count=100).orders.values()]
+    store = AmiAmiOrdersSqliteStore(file_path=tmp_path / "orders.sqlite3", fetch_batch_size=10)
+    store.bulk_update(orders)
+    async_store = AsyncAmiAmiOrdersStore(store, stream_batch_size=10)
+    expected_orders = store.query_orders(OrdersQuery())
+    expected_items = store.query_items(OrdersQuery())
+
+    streams = async_store.iter_orders(OrdersQuery()), async_store.iter_items(OrdersQuery())
+    first_rows = [await anext(stream) for stream in streams]
+    # a sync deletes and updates orders while the streams are read
+    await async_store.bulk_delete([order.id for order in expected_orders[::2]])
+    await async_store.bulk_update([order.model_copy(update={"status": "Shipped"}) for order in expected_orders[1::2]])
+    streamed_orders = [first_rows[0]] + [order async for order in streams[0]]
+    streamed_items = [first_rows[1]] + [item async for item in streams[1]]
+
+    assert streamed_orders == expected_orders
+    assert streamed_items == expected_items
+    assert len(store.query_orders(OrdersQuery())) == 50
+    await async_store.close()
@@ -0,0 +1,52 @@
+import asyncio
+from typing import Awaitable, Callable
+
+from amiami_api.api import AmiAmiApi, OrderType
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.service import AmiamiService
+from amiami_api.store import AmiAmiOrdersMemoryStore
+from amiami_api.sync import SyncJobStatus, SyncScheduler
+from amiami_api.tests.fake_amiami import FakeAccount, FakeAmiAmiServer
+
+StartFakeAmiAmi = Callable[..., Awaitable[FakeAmiAmiServer]]
+MakeApi = Callable[..., AmiAmiApi]
+
+
+async def make_scheduler(fake_amiami: StartFakeAmiAmi, make_api: MakeApi, latency_seconds: float = 0) -> SyncScheduler:
+    server = await fake_amiami(FakeAccount(orders_count=20), latency_seconds=latency_seconds)
+    return SyncScheduler(AmiamiService(api=make_api(server), store=AsyncAmiAmiOrdersStore(AmiAmiOrdersMemoryStore())))
+
+
+async def test_triggers_are_coalesced(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    scheduler = await make_scheduler(fake_amiami, make_api)
+
+    full_job = scheduler.trigger(OrderType.all)
+    # an active full sync covers the narrower ones, a forced sync is not covered by a regular one
+    assert scheduler.trigger(OrderType.all) is full_job
+    assert scheduler.trigger(OrderType.open) is full_job
+    forced_job = scheduler.trigger(OrderType.open, force=True)
+    assert forced_job is not full_job
+    assert scheduler.trigger(OrderType.open, force=True) is forced_job
+
+    await scheduler.wait(full_job)
+    await scheduler.wait(forced_job)
+    assert full_job.status == forced_job.status == SyncJobStatus.succeeded
+    assert scheduler.trigger(OrderType.all) is not full_job
+    await scheduler.stop()
+    await scheduler.service.store.close()
+
+
+async def test_cancelled_job_is_not_left_running(fake_amiami: StartFakeAmiAmi, make_api: MakeApi) -> None:
+    scheduler = await make_scheduler(fake_amiami, make_api, latency_seconds=0.05)
+    running_job = scheduler.trigger(OrderType.all)
+    pending_job = scheduler.trigger(OrderType.open, force=True)
+    await asyncio.sleep(0.02)
+    assert running_job.status == SyncJobStatus.running
+
+    await scheduler.stop()
+
+    for job in (running_job, pending_job):
+        assert job.status == SyncJobStatus.cancelled
+        assert not job.is_active
+        assert job.finished_at is not None
+    await scheduler.service.store.close()
@@ -0,0 +1,47 @@
+from amiami_api.telegram_bot import (
+    TELEGRAM_MESSAGE_LIMIT,
+    message_length,
+    paginate_blocks,
+    split_text,
+)
+
+
+def make_block(index: int, lines: int) -> str:
+    # the emojis take two utf-16 code units each
+    return "\n".join(f"⦁ 📦 order {index} item {line} " + "x" * 60 for line in range(lines))
+
+
+def test_split_text_fits_the_limit() -> None:
+    text = "\n".join(["short", "📦" * 30, "y" * 25])
+
+    parts = split_text(text, 20)
+
+    assert all(0 < message_length(part) <= 20 for part in parts)
+    assert "".join(parts) == text.replace("\n", "")
+
+
+def test_paginate_blocks_stays_within_the_telegram_limit() -> None:
+    sections: list[tuple[str | None, list[str]]] = [
+        ("Account main", [make_block(index, 3) for index in range(100)]),
+        ("Account alt", [make_block(index, 200) for index in range(2)]),
+    ]
+
+    pages = paginate_blocks("Open orders", sections)
+
+    assert len(pages) > 1
+    assert all(0 < message_length(page) <= TELEGRAM_MESSAGE_LIMIT for page in pages)
+    assert pages[0].startswith("Open orders\n\nAccount main\n\n")
+    assert all(page.startswith(("Account main", "Account alt")) for page in pages[1:])
+    for index in range(100):
+        assert sum(f"order {index} item 0 " in page for page in pages) >= 1
+
+
+def test_paginate_blocks_does_not_leave_the_header_alone() -> None:
+    header = "H" * 100
+    block = "\n".join("z" * 90 for _ in range(60))
+
+    pages = paginate_blocks(header, [(None, [block])], limit=1000)
+
+    assert pages[0].startswith(f"{header}\n\nzzz")
+    assert all(0 < message_length(page) <= 1000 for page in pages)
+    assert "\n".join(page.removeprefix(f"{header}\n\n") for page in pages) == block
@@ -0,0 +1,67 @@
+from typing import Any, Iterator
+
+import pytest
+from dependency_injector import providers
+from fastapi.testclient import TestClient
+
+from amiami_api.accounts import Account, Accounts
+from amiami_api.analytics import AnalyticsService
+from amiami_api.api import AmiAmiApi, OrderInfo
+from amiami_api.async_store import AsyncAmiAmiOrdersStore
+from amiami_api.di import DIContainer
+from amiami_api.response_cache import ResponseCache
+from amiami_api.service import AmiamiService
+from amiami_api.store import AmiAmiOrdersMemoryStore
+from amiami_api.sync import SyncScheduler
+from amiami_api.tests.fake_amiami import FakeAccount
+
+
+@pytest.fixture
+def store() -> AmiAmiOrdersMemoryStore:
+    store = AmiAmiOrdersMemoryStore()
+    store.bulk_update(OrderInfo.model_validate(order) for order in FakeAccount(orders_count=20).orders.values())
+    return store
+
+
+@pytest.fixture
+def client(web_app: Any, store: AmiAmiOrdersMemoryStore) -> Iterator[TestClient]:
+    async_store = AsyncAmiAmiOrdersStore(store)
+    service = AmiamiService(api=AmiAmiApi(username="user", password="password"), store=async_store)
+    account = Account(name="default", service=service, sync_scheduler=SyncScheduler(service), analytics_service=AnalyticsService(async_store))
+    container = DIContainer()
+    container.accounts.override(providers.Object(Accounts({account.name: account})))
+    # every test starts its store at the same version, a shared cache would answer with an earlier test's body
+    container.response_cache.override(providers.Object(ResponseCache()))
+    yield TestClient(web_app)
+    container.unwire()
+
+
+@pytest.mark.parametrize("path", ["/api/orders/?order_type=all", "/api/orders/?order_type=all&stream=ndjson", "/api/orders/0/"])
+def test_matching_etag_is_answered_with_not_modified(client: TestClient, path: str) -> None:
+    response = client.get(path)
+    etag = response.headers["ETag"]
+
+    not_modified_response = client.get(path, headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert not_modified_response.status_code == 304
+    assert not_modified_response.headers["ETag"] == etag
+    assert not_modified_response.content == b""
+
+
+def test_etag_changes_with_the_store(client: TestClient, store: AmiAmiOrdersMemoryStore) -> None:
+    response = client.get("/api/orders/", params={"order_type": "all"})
+    store.delete_order("0")
+
+    changed_response = client.get("/api/orders/", params={"order_type": "all"}, headers={"If-None-Match": response.headers["ETag"]})
+
+    assert changed_response.status_code == 200
+    assert changed_response.headers["ETag"] != response.headers["ETag"]
+    assert len(changed_response.json()) == len(response.json()) - 1
+
+
+def test_served_orders_carry_the_account_only(client: TestClient) -> None:
+    order = client.get("/api/orders/0/").json()
+
+    assert order["account"] == "default"
+    assert "fetched_at" not in order
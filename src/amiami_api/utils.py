@@ -6,3 +6,24 @@ def first_day_of_next_month() -> date:
     if now.month == 12:
         return now.replace(day=1, month=1, year=now.year + 1).date()
     return now.replace(day=1, month=now.month + 1).date()
+
+
+def next_month_start(value: date) -> date:
+    if value.month == 12:
+        return value.replace(day=1, month=1, year=value.year + 1)
+    return value.replace(day=1, month=value.month + 1)
+
+
+def previous_month_start(value: date) -> date:
+    if value.month == 1:
+        return value.replace(day=1, month=12, year=value.year - 1)
+    return value.replace(day=1, month=value.month - 1)
+
+
+def months_between(start: date, end: date) -> list[date]:
+    months: list[date] = []
+    month = start.replace(day=1)
+    while month <= end:
+        months.append(month)
+        month = next_month_start(month)
+    return months
@@ -1,80 +1,438 @@
+import asyncio
+import importlib
+import time
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime
+from enum import Enum
+from typing import (
+    Annotated,
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Hashable,
+)
 
 from dependency_injector.wiring import Provide, inject
-from fastapi import APIRouter, Depends, FastAPI, HTTPException
+from fastapi import (
+    APIRouter,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+)
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from loguru import logger
+from pydantic import TypeAdapter
 
-from amiami_api.api import Item, OrderInfo, OrderType
+from amiami_api import metrics
+from amiami_api.accounts import AccountOrderInfo, Accounts
+from amiami_api.analytics import Stats
+from amiami_api.api import Item, OrderType
 from amiami_api.config import Config
 from amiami_api.di import DIContainer
-from amiami_api.service import AmiamiService
+from amiami_api.events import EventBus, OrderEvent, OrderEventType
+from amiami_api.history import (
+    DelayGrouping,
+    DelayStats,
+    HistoryEntry,
+    HistoryQuery,
+    OrderHistoryLog,
+)
+from amiami_api.response_cache import ResponseCache
+from amiami_api.store import OrdersQuery
+from amiami_api.sync import SyncJob
 
-api_router = APIRouter(prefix="/api", tags=["api_root"])
+
+@inject
+async def wait_until_store_loaded(accounts: Accounts = Depends(Provide[DIContainer.accounts])) -> None:
+    # the server starts accepting requests while the stores are still loading in the background
+    await accounts.wait_until_loaded()
+
+
+@inject
+def selected_accounts(account: str | None = None, accounts: Accounts = Depends(Provide[DIContainer.accounts])) -> Accounts:
+    # orders of all the accounts are aggregated unless one is selected
+    selected = accounts.select(account)
+    if selected is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    return selected
+
+
+api_router = APIRouter(prefix="/api", tags=["api_root"], dependencies=[Depends(wait_until_store_loaded)])
+metrics_router = APIRouter(tags=["metrics"])
+
+orders_adapter = TypeAdapter(list[AccountOrderInfo])
+order_adapter = TypeAdapter(AccountOrderInfo)
+items_adapter = TypeAdapter(list[Item])
+item_adapter = TypeAdapter(Item)
+projected_rows_adapter = TypeAdapter(list[dict[str, Any]])
+projected_row_adapter = TypeAdapter(dict[str, Any])
+event_adapter = TypeAdapter(OrderEvent)
+
+STREAM_CHUNK_ROWS = 200
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RETRY_MILLISECONDS = 3000
+
+
+class StreamFormat(str, Enum):
+    ndjson = "ndjson"
+    array = "array"  # chunked JSON array, parseable by plain JSON clients
+
+
+def parse_fields(fields: str | None) -> frozenset[str] | None:
+    if not fields:
+        return None
+    return frozenset(field.strip() for field in fields.split(",") if field.strip())
+
+
+def dump_rows(adapter: TypeAdapter, rows: list, fields: frozenset[str] | None) -> bytes:
+    if fields is None:
+        return adapter.dump_json(rows, by_alias=True)
+    dumped_rows = adapter.dump_python(rows, by_alias=True, mode="json")
+    return projected_rows_adapter.dump_json([{key: value for key, value in row.items() if key in fields} for row in dumped_rows])
+
+
+def dump_row(adapter: TypeAdapter, row: Any, fields: frozenset[str] | None) -> bytes:
+    if fields is None:
+        return adapter.dump_json(row, by_alias=True)
+    dumped_row = adapter.dump_python(row, by_alias=True, mode="json")
+    return projected_row_adapter.dump_json({key: value for key, value in dumped_row.items() if key in fields})
+
+
+async def stream_rows(adapter: TypeAdapter, rows: AsyncIterator, fields: frozenset[str] | None, stream_format: StreamFormat) -> AsyncIterator[bytes]:
+    if stream_format == StreamFormat.array:
+        yield b"["
+    chunk: list[bytes] = []
+    is_first_chunk = True
+    async for row in rows:
+        chunk.append(dump_row(adapter, row, fields))
+        if len(chunk) < STREAM_CHUNK_ROWS:
+            continue
+        yield _join_chunk(chunk, stream_format, is_first_chunk)
+        chunk.clear()
+        is_first_chunk = False
+    if chunk:
+        yield _join_chunk(chunk, stream_format, is_first_chunk)
+    if stream_format == StreamFormat.array:
+        yield b"]"
+
+
+def _join_chunk(chunk: list[bytes], stream_format: StreamFormat, is_first_chunk: bool) -> bytes:
+    if stream_format == StreamFormat.ndjson:
+        return b"\n".join(chunk) + b"\n"
+    return (b"" if is_first_chunk else b",") + b",".join(chunk)
+
+
+def streaming_json_response(
+    request: Request,
+    etag: str,
+    adapter: TypeAdapter,
+    rows: Callable[[], AsyncIterator],
+    fields: frozenset[str] | None,
+    stream_format: StreamFormat,
+) -> Response:
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    media_type = "application/x-ndjson" if stream_format == StreamFormat.ndjson else "application/json"
+    return StreamingResponse(stream_rows(adapter, rows(), fields, stream_format), media_type=media_type, headers={"ETag": etag})
+
+
+def format_sse_event(event: OrderEvent) -> bytes:
+    return f"id: {event.id}\nevent: {event.type.value}\ndata: ".encode() + event_adapter.dump_json(event) + b"\n\n"
+
+
+async def stream_events(events: EventBus, after_id: int, account_names: frozenset[str]) -> AsyncIterator[bytes]:
+    # browsers reconnect after the retry delay and resume from the Last-Event-ID header
+    yield f"retry: {SSE_RETRY_MILLISECONDS}\n\n".encode()
+    while True:
+        if events.has_gap(after_id):
+            # the missed events are gone from the buffer, the client has to reload the orders
+            yield f"id: {events.last_id}\nevent: reset\ndata: {{}}\n\n".encode()
+            after_id = events.last_id
+        new_events = await events.wait_for_events(after_id, SSE_KEEPALIVE_SECONDS)
+        if not new_events:
+            yield b": keepalive\n\n"
+            continue
+        after_id = new_events[-1].id
+        chunk = b"".join(format_sse_event(event) for event in new_events if event.account in account_names)
+        if chunk:
+            yield chunk
+
+
+def orders_query(
+    release_from: date | None = None,
+    release_to: date | None = None,
+    status: str | None = None,
+    search: str | None = None,
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    offset: Annotated[int, Query(ge=0)] = 0,
+) -> OrdersQuery:
+    return OrdersQuery(
+        release_from=release_from,
+        release_to=release_to,
+        status=status,
+        search=search,
+        limit=limit,
+        offset=offset,
+    )
+
+
+async def cached_json_response(
+    request: Request,
+    cache: ResponseCache,
+    key: Hashable,
+    version: Hashable,
+    build: Callable[[], Awaitable[bytes]],
+) -> Response:
+    etag = cache.etag(key, version)
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    body = cache.get(key, version)
+    if body is None:
+        body = await build()
+        cache.put(key, version, body)
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+
+@api_router.get("/accounts/")
+@inject
+async def get_accounts(accounts: Accounts = Depends(Provide[DIContainer.accounts])) -> list[str]:
+    return list(accounts.names)
 
 
-@api_router.get("/orders/")
+@api_router.get("/orders/", response_model=list[AccountOrderInfo])
 @inject
 async def get_orders(
+    request: Request,
     order_type: OrderType = OrderType.open,
-    service: AmiamiService = Depends(Provide[DIContainer.service]),
-) -> list[OrderInfo]:
-    return await service.get_orders(order_type)
+    query: OrdersQuery = Depends(orders_query),
+    fields: str | None = None,
+    stream: StreamFormat | None = None,
+    accounts: Accounts = Depends(selected_accounts),
+    cache: ResponseCache = Depends(Provide[DIContainer.response_cache]),
+) -> Response:
+    query = replace(query, order_type=order_type)
+    projection = parse_fields(fields)
+    if stream is not None:
+        etag = cache.etag(("orders", accounts.names, query, projection, stream), accounts.version)
+        return streaming_json_response(request, etag, order_adapter, lambda: accounts.iter_orders(query), projection, stream)
+
+    async def build() -> bytes:
+        return dump_rows(orders_adapter, await accounts.query_orders(query), projection)
+
+    return await cached_json_response(request, cache, ("orders", accounts.names, query, projection), accounts.version, build)
 
 
-@api_router.get("/orders/{order_id}/")
+@api_router.get("/orders/{order_id}/", response_model=AccountOrderInfo)
 @inject
 async def get_order(
+    request: Request,
     order_id: str,
-    service: AmiamiService = Depends(Provide[DIContainer.service]),
-) -> OrderInfo:
-    order = await service.get_order(order_id)
-    if order is None:
-        raise HTTPException(status_code=404, detail="Order not found")
-    return order
+    accounts: Accounts = Depends(selected_accounts),
+    cache: ResponseCache = Depends(Provide[DIContainer.response_cache]),
+) -> Response:
+    async def build() -> bytes:
+        order = await accounts.get_order(order_id)
+        if order is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        return order_adapter.dump_json(order, by_alias=True)
 
+    return await cached_json_response(request, cache, ("order", accounts.names, order_id), accounts.version, build)
 
-@api_router.get("/items/")
+
+@api_router.get("/items/", response_model=list[Item])
 @inject
 async def get_items(
-    service: AmiamiService = Depends(Provide[DIContainer.service]),
-) -> list[Item]:
-    items: list[Item] = []
-    orders = await service.get_orders(OrderType.all)
-    for order in orders:
-        items.extend(order.items)
-    return items
+    request: Request,
+    order_type: OrderType = OrderType.all,
+    query: OrdersQuery = Depends(orders_query),
+    fields: str | None = None,
+    stream: StreamFormat | None = None,
+    accounts: Accounts = Depends(selected_accounts),
+    cache: ResponseCache = Depends(Provide[DIContainer.response_cache]),
+) -> Response:
+    query = replace(query, order_type=order_type)
+    projection = parse_fields(fields)
+    if stream is not None:
+        etag = cache.etag(("items", accounts.names, query, projection, stream), accounts.version)
+        return streaming_json_response(request, etag, item_adapter, lambda: accounts.iter_items(query), projection, stream)
+
+    async def build() -> bytes:
+        return dump_rows(items_adapter, await accounts.query_items(query), projection)
+
+    return await cached_json_response(request, cache, ("items", accounts.names, query, projection), accounts.version, build)
+
+
+@api_router.get("/events/")
+@inject
+async def get_events(
+    last_event_id: Annotated[int | None, Header()] = None,
+    accounts: Accounts = Depends(selected_accounts),
+    events: EventBus = Depends(Provide[DIContainer.events]),
+) -> StreamingResponse:
+    """Order change events as Server-Sent Events, optionally of one account."""
+    return StreamingResponse(
+        stream_events(events, events.resume_id(last_event_id), frozenset(accounts.names)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@api_router.get("/stats/")
+async def get_stats(
+    start: date | None = None,
+    end: date | None = None,
+    accounts: Accounts = Depends(selected_accounts),
+) -> Stats:
+    return await accounts.get_stats(start, end)
 
 
-@api_router.post("/orders/update/")
+@api_router.get("/history/")
 @inject
+async def get_history(
+    order_id: str | None = None,
+    scode: str | None = None,
+    change_type: Annotated[list[OrderEventType] | None, Query()] = None,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    accounts: Accounts = Depends(selected_accounts),
+    history: OrderHistoryLog = Depends(Provide[DIContainer.history]),
+) -> list[HistoryEntry]:
+    """Logged changes of orders and items, oldest first."""
+    query = HistoryQuery(
+        accounts=accounts.names,
+        order_id=order_id,
+        scode=scode,
+        types=tuple(change_type) if change_type else None,
+        since=since,
+        until=until,
+        limit=limit,
+        offset=offset,
+    )
+    return await history.query(query)
+
+
+@api_router.get("/history/delays/")
+@inject
+async def get_release_delays(
+    group_by: DelayGrouping = DelayGrouping.month,
+    release_from: date | None = None,
+    release_to: date | None = None,
+    accounts: Accounts = Depends(selected_accounts),
+    history: OrderHistoryLog = Depends(Provide[DIContainer.history]),
+) -> list[DelayStats]:
+    """Release date slips of items, grouped by the originally scheduled month or by figure type."""
+    return await history.get_delays(group_by, accounts.names, release_from, release_to)
+
+
+@api_router.post("/orders/update/", status_code=202)
 async def update_orders(
     order_type: OrderType = OrderType.open,
-    service: AmiamiService = Depends(Provide[DIContainer.service]),
-) -> list[OrderInfo]:
-    return await service.update_orders(order_type)
+    force: bool = False,
+    accounts: Accounts = Depends(selected_accounts),
+) -> list[SyncJob]:
+    """Trigger a sync of the selected account, or of all the accounts, one job per account."""
+    return accounts.trigger(order_type, force)
+
+
+@api_router.get("/sync/jobs/{job_id}/")
+@inject
+async def get_sync_job(
+    job_id: str,
+    accounts: Accounts = Depends(Provide[DIContainer.accounts]),
+) -> SyncJob:
+    job = accounts.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics() -> PlainTextResponse:
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+async def observe_request_duration(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    started_at = time.perf_counter()
+    response = await call_next(request)
+    # the route template keeps the label cardinality bounded, streamed bodies are timed up to the first byte
+    route = request.scope.get("route")
+    metrics.http_request_duration.observe(
+        time.perf_counter() - started_at,
+        method=request.method,
+        route=getattr(route, "path", "unmatched"),
+        status=str(response.status_code),
+    )
+    return response
+
+
+@dataclass
+class TelegramBotRunner:
+    container: DIContainer
+    _application: Any = field(default=None, init=False)
+    _start_task: asyncio.Task | None = field(default=None, init=False)
+
+    def start(self) -> None:
+        # the bot connects to telegram in parallel, so it does not delay serving the api
+        self._start_task = asyncio.create_task(self._start())
+
+    async def _start(self) -> None:
+        try:
+            # python-telegram-bot is imported in a thread, so the event loop keeps serving requests meanwhile
+            telegram_bot = await asyncio.to_thread(importlib.import_module, "amiami_api.telegram_bot")
+            self.container.wire(modules=[telegram_bot])
+            self._application = self.container.telegram_bot()
+            await telegram_bot.start_bot(self._application)
+        except Exception as exception:
+            # the web app keeps running without the bot
+            logger.opt(exception=exception).error("Failed to start the telegram bot")
+
+    async def stop(self) -> None:
+        if self._start_task is not None:
+            self._start_task.cancel()
+            await asyncio.gather(self._start_task, return_exceptions=True)
+        if self._application is not None:
+            from amiami_api.telegram_bot import stop_bot
+
+            await stop_bot(self._application)
 
 
 def create_app() -> FastAPI:
+    config = Config()
     container = DIContainer()
-    container.config.from_dict(Config().model_dump())
+    container.config.from_dict(config.model_dump())
 
     @asynccontextmanager
     async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
-        bot = container.telegram_bot()
-        async with bot:
-            await bot.start()
-            assert bot.updater is not None
-            await bot.updater.start_polling()
-            yield
-            await bot.stop()
+        accounts = container.accounts()
+        accounts.start()
+        history = container.history()
+        history.start()
+        container.fx_rates_service().warm_up()
+        bot_runner = TelegramBotRunner(container) if config.telegram_bot_token else None
+        if bot_runner is not None:
+            bot_runner.start()
+        yield
+        if bot_runner is not None:
+            await bot_runner.stop()
+        await accounts.stop()
+        await history.close()
+        await container.http_client().close()
 
     app = FastAPI(lifespan=lifespan)
+    app.middleware("http")(observe_request_duration)
     app.include_router(api_router)
+    app.include_router(metrics_router)
 
     statics = StaticFiles(directory="frontend/dist/", html=True)
     app.mount("/", statics, name="static")
     return app
-
-
-app = create_app()